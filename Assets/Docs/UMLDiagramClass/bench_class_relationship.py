@@ -0,0 +1,352 @@
+"""Benchmark generate_class_relationship.py on a synthetic C# tree.
+
+Generates a reproducible corpus (many files, deep nesting, long string/comment blocks, partial classes,
+heavy generics), times each stage of the tool and writes machine-readable results so revisions can be
+compared:
+
+    python bench_class_relationship.py --files 2000 --json-out bench.json
+    python bench_class_relationship.py --files 2000 --compare bench.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import generate_class_relationship as gcr  # noqa: E402
+
+
+UNITY_TYPES = [
+    "GameObject",
+    "Transform",
+    "Rigidbody",
+    "AudioSource",
+    "Animator",
+    "Camera",
+    "Material",
+    "Texture2D",
+    "Vector3",
+    "Quaternion",
+]
+
+# Filler for string and comment blocks: full of characters that would fool a naive brace/regex scan.
+LOREM = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore "
+    "et dolore magna aliqua { braces } ; semicolons; public class NotAType { } 'quotes' // not a comment "
+)
+
+
+class CorpusSpec:
+    def __init__(
+        self,
+        files: int,
+        seed: int = 1,
+        nesting: int = 3,
+        members: int = 12,
+        text_blocks: int = 4,
+        partial_ratio: float = 0.1,
+        generic_depth: int = 3,
+    ) -> None:
+        self.files = files
+        self.seed = seed
+        self.nesting = nesting
+        self.members = members
+        self.text_blocks = text_blocks
+        self.partial_ratio = partial_ratio
+        self.generic_depth = generic_depth
+
+    def to_json(self) -> dict:
+        return dict(vars(self))
+
+
+def _generic_type(rng: random.Random, names: List[str], depth: int) -> str:
+    if depth <= 0 or rng.random() < 0.3:
+        return rng.choice(names)
+    container = rng.choice(["List", "Dictionary", "HashSet", "IReadOnlyList", "Func"])
+    if container in ("Dictionary", "Func"):
+        return f"{container}<{_generic_type(rng, names, depth - 1)}, {_generic_type(rng, names, depth - 1)}>"
+    return f"{container}<{_generic_type(rng, names, depth - 1)}>"
+
+
+def _text_block(rng: random.Random, indent: str) -> str:
+    text = LOREM * rng.randint(1, 3)
+    style = rng.randrange(5)
+    if style == 0:
+        return f"{indent}// {text}\n"
+    if style == 1:
+        lines = "".join(f"{indent} * {text}\n" for _ in range(rng.randint(2, 6)))
+        return f"{indent}/*\n{lines}{indent} */\n"
+    if style == 2:
+        return f'{indent}var s{rng.randrange(1000)} = @"{text} ""quoted""\n{text}";\n'
+    if style == 3:
+        # Interpolated string with a nested string literal holding braces
+        return f'{indent}var s{rng.randrange(1000)} = $"{{(flag ? "{{" : "}}")}} {text} \\"{{{{x}}}}\\"";\n'
+    return f'{indent}var raw = """\n{text} "quoted" ""twice""\n""";\n'
+
+
+def _type_source(
+    rng: random.Random, spec: CorpusSpec, name: str, names: List[str], depth: int, indent: str, partial: bool
+) -> str:
+    lines: List[str] = []
+    kind = "partial class" if partial else rng.choice(["class", "class", "sealed class", "struct"])
+    base = f" : {rng.choice(names)}, I{rng.choice(names)}" if kind != "struct" and rng.random() < 0.7 else ""
+    lines.append(f"{indent}public {kind} {name}{base}\n{indent}{{\n")
+    inner = indent + "    "
+    for i in range(spec.members):
+        t = _generic_type(rng, names, spec.generic_depth)
+        choice = rng.randrange(5)
+        if choice == 0:
+            lines.append(f"{inner}[SerializeField] private {t} field{i};\n")
+        elif choice == 1:
+            lines.append(f"{inner}private {rng.choice(names)} owned{i} = new {rng.choice(names)}();\n")
+        elif choice == 2:
+            lines.append(f"{inner}public {t} Prop{i} {{ get; set; }}\n")
+        elif choice == 3:
+            lines.append(f"{inner}public {rng.choice(names)}[] array{i};\n")
+        else:
+            lines.append(
+                f"{inner}public {rng.choice(names)} Method{i}({t} a, {rng.choice(names)} b)\n{inner}{{\n"
+                f"{inner}    if (a != null) {{ return new {rng.choice(names)}(); }}\n"
+            )
+            for _ in range(rng.randint(0, spec.text_blocks)):
+                lines.append(_text_block(rng, inner + "    "))
+            lines.append(f"{inner}    return null;\n{inner}}}\n")
+    if depth > 0:
+        lines.append(_type_source(rng, spec, f"{name}Nested{depth}", names, depth - 1, inner, False))
+    lines.append(f"{indent}}}\n")
+    return "".join(lines)
+
+
+# Written into every generated corpus: --corpus only ever deletes a folder that holds it.
+CORPUS_MARKER = ".bench_corpus"
+
+
+def prepare_corpus_folder(corpus: Path) -> None:
+    """Empty a folder for generate_corpus; refuses an existing non-empty folder this script did not create."""
+    if not corpus.exists():
+        return
+    if not corpus.is_dir():
+        raise SystemExit(f"--corpus {corpus} is not a folder")
+    if (corpus / CORPUS_MARKER).is_file():
+        shutil.rmtree(corpus)
+    elif any(corpus.iterdir()):
+        raise SystemExit(f"--corpus {corpus} is not empty and was not generated by this script; refusing to delete it")
+
+
+def generate_corpus(root: Path, spec: CorpusSpec) -> int:
+    """Write spec.files .cs files under root (spread over subfolders); returns total bytes written."""
+    rng = random.Random(spec.seed)
+    root.mkdir(parents=True, exist_ok=True)
+    (root / CORPUS_MARKER).write_text("Generated by bench_class_relationship.py; safe to delete.\n", encoding="utf-8")
+    names = UNITY_TYPES + [f"Type{i}" for i in range(spec.files)]
+    partial_names = [f"Partial{i}" for i in range(max(1, int(spec.files * spec.partial_ratio) // 2))]
+    total = 0
+    for i in range(spec.files):
+        folder = root / f"Module{i % 37}" / f"Area{i % 11}"
+        folder.mkdir(parents=True, exist_ok=True)
+        partial = rng.random() < spec.partial_ratio
+        name = rng.choice(partial_names) if partial else f"Type{i}"
+        body = _type_source(rng, spec, name, names, spec.nesting, "    ", partial)
+        text = (
+            "using System;\nusing System.Collections.Generic;\nusing UnityEngine;\n\n"
+            f"namespace Bench.Module{i % 37}\n{{\n{body}}}\n"
+        )
+        path = folder / f"File{i}.cs"
+        path.write_text(text, encoding="utf-8")
+        total += len(text.encode("utf-8"))
+    return total
+
+
+def _timed(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_stages(corpus: Path, repeat: int) -> dict:
+    files = gcr.discover_sources(corpus)
+    total_bytes = sum(f.stat().st_size for f in files)
+    texts = [gcr.decode_source(f.read_bytes()) for f in files]
+
+    stages = {}
+
+    def record(name: str, seconds: float) -> None:
+        stages[name] = {
+            "seconds": round(seconds, 6),
+            "mb_per_s": round(total_bytes / 1e6 / seconds, 3) if seconds else None,
+            "files_per_s": round(len(files) / seconds, 1) if seconds else None,
+        }
+
+    record("discover", _timed(lambda: gcr.discover_sources(corpus), repeat))
+    record("read", _timed(lambda: [gcr.decode_source(f.read_bytes()) for f in files], repeat))
+
+    cleaned: List[str] = []
+
+    def strip() -> None:
+        cleaned[:] = [gcr.strip_comments_and_strings(t) for t in texts]
+
+    record("strip_comments_and_strings", _timed(strip, repeat))
+
+    parsed: List[gcr.ParsedFile] = []
+
+    def scan() -> None:
+        parsed[:] = [gcr.scan_declarations(f, c) for f, c in zip(files, cleaned)]
+
+    record("type_decl_scan", _timed(scan, repeat))
+
+    per_file: List[List[gcr.TypeDecl]] = []
+
+    def members() -> None:
+        for fn in gcr.TYPE_EXPR_CACHES:
+            fn.cache_clear()
+        per_file[:] = [gcr.analyze_file(p) for p in parsed]
+
+    record("member_parse", _timed(members, repeat))
+
+    all_decls = [d for decls in per_file for d in decls]
+    merged: dict = {}
+    symbols = gcr.SymbolTable(())
+
+    def merge() -> None:
+        nonlocal symbols
+        symbols = gcr.SymbolTable.from_decls(all_decls)
+        merged.clear()
+        merged.update(gcr.merge_decls(gcr.resolve_decl(d, symbols) for d in all_decls))
+
+    record("merge", _timed(merge, repeat))
+
+    known = symbols.names
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = Path(tmp) / "ClassRelationship.csv"
+
+        def write() -> None:
+            with out_path.open("w", newline="", encoding="utf-8") as f:
+                gcr.write_csv(lambda: gcr.iter_rows(merged, known), f)
+
+        record("csv_write", _timed(write, repeat))
+
+    total = sum(stage["seconds"] for name, stage in stages.items() if name != "discover")
+    record("total", total)
+    return {
+        "files": len(files),
+        "bytes": total_bytes,
+        "types": len(all_decls),
+        "merged_types": len(merged),
+        "stages": stages,
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def print_report(result: dict, baseline: Optional[dict] = None) -> None:
+    print(f"{result['files']} files, {result['bytes'] / 1e6:.2f} MB, {result['types']} types")
+    print(f"{'stage':<28}{'seconds':>10}{'MB/s':>10}{'files/s':>12}{'vs base':>10}")
+    base_stages = (baseline or {}).get("stages", {})
+    for name, stage in result["stages"].items():
+        delta = ""
+        base = base_stages.get(name)
+        if base and base.get("seconds"):
+            delta = f"{(stage['seconds'] / base['seconds'] - 1) * 100:+.1f}%"
+        print(
+            f"{name:<28}{stage['seconds']:>10.4f}{stage['mb_per_s'] or 0:>10.2f}"
+            f"{stage['files_per_s'] or 0:>12.1f}{delta:>10}"
+        )
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark generate_class_relationship.py on a synthetic C# corpus")
+    ap.add_argument("--files", type=int, default=1000, help="Number of .cs files to generate (default: 1000)")
+    ap.add_argument("--seed", type=int, default=1, help="Random seed; same seed + options = same corpus")
+    ap.add_argument("--nesting", type=int, default=3, help="Nested type depth per file (default: 3)")
+    ap.add_argument("--members", type=int, default=12, help="Members per type (default: 12)")
+    ap.add_argument("--text-blocks", type=int, default=4, help="Max string/comment blocks per method (default: 4)")
+    ap.add_argument("--partial-ratio", type=float, default=0.1, help="Share of files declaring partial classes")
+    ap.add_argument("--generic-depth", type=int, default=3, help="Max generic nesting in member types")
+    ap.add_argument("--repeat", type=int, default=3, help="Time each stage this many times and keep the best")
+    ap.add_argument(
+        "--corpus",
+        default=None,
+        help=(
+            "Generate into (and keep) this folder instead of a temp dir; it must be missing, empty or "
+            "a corpus this script generated before"
+        ),
+    )
+    ap.add_argument("--json-out", default=None, help="Write results as JSON to this path")
+    ap.add_argument("--compare", default=None, help="Baseline JSON from an earlier run to compare against")
+    args = ap.parse_args()
+
+    spec = CorpusSpec(
+        files=args.files,
+        seed=args.seed,
+        nesting=args.nesting,
+        members=args.members,
+        text_blocks=args.text_blocks,
+        partial_ratio=args.partial_ratio,
+        generic_depth=args.generic_depth,
+    )
+
+    tmp_dir = None
+    if args.corpus:
+        corpus = Path(args.corpus)
+        prepare_corpus_folder(corpus)
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix="bench_cs_")
+        corpus = Path(tmp_dir)
+    try:
+        gen_start = time.perf_counter()
+        generate_corpus(corpus, spec)
+        gen_seconds = time.perf_counter() - gen_start
+        result = run_stages(corpus, max(1, args.repeat))
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    result = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "corpus": spec.to_json(),
+        "generate_seconds": round(gen_seconds, 3),
+        **result,
+    }
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        if baseline.get("corpus") != result["corpus"]:
+            print("warning: baseline was measured on a different corpus spec", file=sys.stderr)
+    print_report(result, baseline)
+
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(result, indent=2) + "\n", encoding="utf-8")
+        print(f"Wrote results to: {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,10 +1,26 @@
 import argparse
 import csv
+import filecmp
+import functools
+import hashlib
+import heapq
+import inspect
+import itertools
+import json
+import mmap
 import os
 import re
-from dataclasses import dataclass, field
+import select
+import stat
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from contextlib import ExitStack, contextmanager, nullcontext
+from dataclasses import asdict, dataclass, field, replace
 from pathlib import Path
-from typing import Iterable, List, Optional, Sequence, Set, Tuple
+from typing import Callable, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Set, TextIO, Tuple, Union
 
 
 CS_PRIMITIVES: Set[str] = {
@@ -130,128 +146,346 @@ class TypeDecl:
     aggregation: Set[str] = field(default_factory=set)
     association: Set[str] = field(default_factory=set)
     dependency: Set[str] = field(default_factory=set)
+    # Resolution scope of the declaration: enclosing namespace, visible using directives and aliases
+    namespace: str = ""
+    usings: List[str] = field(default_factory=list)
+    aliases: dict[str, str] = field(default_factory=dict)
+    # Capitalized names used inside method bodies and initializers (--scan-bodies); after resolve_decl,
+    # only the ones that resolve to declared types
+    body_refs: Set[str] = field(default_factory=set)
+    # Bit i set: declared this way in --defines configuration i; 0: the same in every configuration
+    configs: int = 0
+
+    @property
+    def qualified_name(self) -> str:
+        return f"{self.namespace}.{self.name}" if self.namespace else self.name
+
+
+class _LexSyntax:
+    """Compiled lexer patterns for one text type (str, or bytes for the mmap scanner)."""
+
+    def __init__(self, enc) -> None:
+        self.enc = enc
+        # Anything that starts a comment or a literal. Optional $/@ prefixes stay in the output as code;
+        # only the part from the first quote on is blanked. The leading lookahead lets the regex engine
+        # skip plain code with a fast character-set scan.
+        self.start_re = re.compile(enc(r"""(?=[/'"$@])(?://|/\*|'|(?P<prefix>\$+@?|@\$*)?(?P<quotes>"+))"""))
+        self.char_re = re.compile(enc(r"""'[^'\\]*(?:\\[\s\S]?[^'\\]*)*'?"""))
+        self.string_re = re.compile(enc(r'''"[^"\\]*(?:\\[\s\S]?[^"\\]*)*"?'''))
+        self.verbatim_re = re.compile(enc(r'''"[^"]*(?:""[^"]*)*"?'''))
+        # Next interesting character inside the text part of an interpolated string.
+        self.interp_text_re = re.compile(enc(r'[\\"{}]'))
+        self.interp_verbatim_text_re = re.compile(enc(r'["{}]'))
+        # Next interesting token inside an interpolation hole: braces or a nested comment/literal.
+        self.hole_re = re.compile(enc(r"""(?=[{}/'"$@])(?:[{}]|//|/\*|'|(?:\$+@?|@\$*)?"+)"""))
+        self.newline = enc("\n")
+        self.block_end = enc("*/")
+        self.quote = enc('"')
+        self.lbrace = enc("{")
+        self.rbrace = enc("}")
+        self.backslash = enc("\\")
+        self.dollar = enc("$")
+        self.at = enc("@")
+        self.slash = enc("/")
+        self.apostrophe = enc("'")
+
+
+_STR_SYNTAX = _LexSyntax(lambda s: s)
+_BYTES_SYNTAX = _LexSyntax(lambda s: s.encode("ascii"))
+
+
+def _literal_end(code, syn: _LexSyntax, m) -> int:
+    """End (exclusive) of the comment/literal whose start token is match m; unterminated runs to EOF."""
+    n = len(code)
+    start = m.start()
+    tok = m.group()
+    if tok[:1] == syn.slash:
+        if tok[1:2] == syn.slash:
+            end = code.find(syn.newline, start)
+            return n if end == -1 else end
+        end = code.find(syn.block_end, start + 2)
+        return n if end == -1 else end + 2
+    if tok == syn.apostrophe:
+        return syn.char_re.match(code, start).end()
+
+    prefix = m.group("prefix") or tok[:0]
+    quote_start = m.start("quotes")
+    quote_count = len(m.group("quotes"))
+    interpolated = syn.dollar in prefix
+    verbatim = syn.at in prefix
+
+    if quote_count >= 3 and not verbatim:
+        # C# 11 raw string literal: closes at the first run of the same number of quotes.
+        delim = m.group("quotes")
+        end = code.find(delim, quote_start + quote_count)
+        return n if end == -1 else end + quote_count
+    if not interpolated:
+        pattern = syn.verbatim_re if verbatim else syn.string_re
+        return pattern.match(code, quote_start).end()
+    return _interpolated_end(code, syn, quote_start, verbatim)
+
+
+def _interpolated_end(code, syn: _LexSyntax, quote_start: int, verbatim: bool) -> int:
+    n = len(code)
+    text_re = syn.interp_verbatim_text_re if verbatim else syn.interp_text_re
+    j = quote_start + 1
+    while True:
+        m = text_re.search(code, j)
+        if m is None:
+            return n
+        k = m.start()
+        c = m.group()
+        nxt = code[k + 1 : k + 2]
+        if c == syn.backslash:
+            j = k + 2
+        elif c == syn.quote:
+            if verbatim and nxt == syn.quote:
+                j = k + 2
+                continue
+            return k + 1
+        elif c == syn.lbrace:
+            j = k + 2 if nxt == syn.lbrace else _hole_end(code, syn, k + 1)
+        else:
+            j = k + 2 if nxt == syn.rbrace else k + 1
+
+
+def _hole_end(code, syn: _LexSyntax, j: int) -> int:
+    """Skip an interpolation hole (code, possibly with nested braces and literals) starting after '{'."""
+    n = len(code)
+    depth = 1
+    while True:
+        m = syn.hole_re.search(code, j)
+        if m is None:
+            return n
+        tok = m.group()
+        if tok == syn.lbrace:
+            depth += 1
+            j = m.end()
+        elif tok == syn.rbrace:
+            depth -= 1
+            j = m.end()
+            if depth == 0:
+                return j
+        else:
+            j = _literal_end(code, syn, syn.start_re.match(code, m.start()))
+
+
+def iter_literal_spans(code) -> Iterable[Tuple[int, int]]:
+    """Yield (start, end) of every comment and string/char literal in code (str or bytes), in order."""
+    syn = _STR_SYNTAX if isinstance(code, str) else _BYTES_SYNTAX
+    pos = 0
+    search = syn.start_re.search
+    while True:
+        m = search(code, pos)
+        if m is None:
+            return
+        start = m.start("quotes") if m.group("quotes") else m.start()
+        end = _literal_end(code, syn, m)
+        yield start, end
+        pos = end
+
+
+def _blank(segment: str) -> str:
+    if "\n" not in segment:
+        return " " * len(segment)
+    return "\n".join(" " * len(part) for part in segment.split("\n"))
 
 
 def strip_comments_and_strings(code: str) -> str:
-    """Remove comments and string/char literals to make brace counting & regex safer."""
+    """Remove comments and string/char literals to make brace counting & regex safer.
+
+    Blanked characters become spaces (newlines are kept), so offsets and line numbers match the input.
+    Jumps between comment/literal starts with compiled regexes instead of walking every character, and
+    understands interpolated ($"", $@"", @$"") strings with nested braces and C# 11 raw (\"\"\") strings.
+    """
     out: List[str] = []
+    pos = 0
+    for start, end in iter_literal_spans(code):
+        out.append(code[pos:start])
+        out.append(_blank(code[start:end]))
+        pos = end
+    out.append(code[pos:])
+    return "".join(out)
+
+
+# Preprocessor configurations (--defines). Directive lines are found once per file in the stripped text;
+# each configuration then only walks that short directive list to find the code it does not compile.
+# Configurations that drop the same spans share one analysis, so a file without #if costs the same
+# as without --defines, and one guarded by UNITY_EDITOR alone is analyzed at most twice.
+PP_DIRECTIVE_RE = re.compile(
+    r"(?m)^[^\S\n]*#[^\S\n]*(?P<keyword>if|elif|else|endif|define|undef)\b(?P<argument>[^\n]*)"
+)
+PP_DIRECTIVE_RE_BYTES = re.compile(PP_DIRECTIVE_RE.pattern.encode("ascii"))
+PP_TOKEN_RE = re.compile(r"\s*(\|\||&&|==|!=|!|\(|\)|[A-Za-z_]\w*)")
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_pp_condition(text: str) -> Callable[[Set[str]], bool]:
+    """Compile a #if/#elif condition (symbols, true/false, !, ==, !=, &&, || and parentheses) into a
+    predicate over the defined symbols. A malformed condition is always false."""
+    tokens: List[str] = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        m = PP_TOKEN_RE.match(text, pos)
+        if m is None:
+            return lambda defined: False
+        tokens.append(m.group(1))
+        pos = m.end()
     i = 0
-    n = len(code)
-    state = "code"  # code | line_comment | block_comment | string | verbatim_string | char
 
-    while i < n:
-        c = code[i]
-        nxt = code[i + 1] if i + 1 < n else ""
-
-        if state == "code":
-            if c == "/" and nxt == "/":
-                state = "line_comment"
-                out.append(" ")
-                i += 2
-                continue
-            if c == "/" and nxt == "*":
-                state = "block_comment"
-                out.append(" ")
-                i += 2
-                continue
-            if c == '"':
-                # verbatim string starts with @"
-                if i > 0 and code[i - 1] == "@":
-                    state = "verbatim_string"
-                else:
-                    state = "string"
-                out.append(" ")
-                i += 1
-                continue
-            if c == "'":
-                state = "char"
-                out.append(" ")
-                i += 1
-                continue
-            out.append(c)
+    def take(token: str) -> bool:
+        nonlocal i
+        if i < len(tokens) and tokens[i] == token:
             i += 1
-            continue
+            return True
+        return False
 
-        if state == "line_comment":
-            if c == "\n":
-                state = "code"
-                out.append("\n")
-            else:
-                out.append(" ")
-            i += 1
-            continue
+    def primary() -> Callable[[Set[str]], bool]:
+        nonlocal i
+        if take("!"):
+            inner = primary()
+            return lambda defined: not inner(defined)
+        if take("("):
+            inner = disjunction()
+            if not take(")"):
+                raise ValueError(text)
+            return inner
+        if i >= len(tokens) or not _is_ident(tokens[i]):
+            raise ValueError(text)
+        symbol = tokens[i]
+        i += 1
+        if symbol in ("true", "false"):
+            value = symbol == "true"
+            return lambda defined: value
+        return lambda defined: symbol in defined
 
-        if state == "block_comment":
-            if c == "*" and nxt == "/":
-                state = "code"
-                out.append("  ")
-                i += 2
-            else:
-                out.append("\n" if c == "\n" else " ")
-                i += 1
-            continue
+    def equality() -> Callable[[Set[str]], bool]:
+        left = primary()
+        while i < len(tokens) and tokens[i] in ("==", "!="):
+            negate = tokens[i] == "!="
+            take(tokens[i])
+            right = primary()
+            left = (lambda a, b, n: lambda defined: (a(defined) == b(defined)) != n)(left, right, negate)
+        return left
 
-        if state == "string":
-            if c == "\\":
-                # escape + next char
-                out.append(" ")
-                if i + 1 < n:
-                    out.append(" ")
-                    i += 2
-                else:
-                    i += 1
-                continue
-            if c == '"':
-                state = "code"
-                out.append(" ")
-                i += 1
-                continue
-            out.append("\n" if c == "\n" else " ")
-            i += 1
-            continue
+    def conjunction() -> Callable[[Set[str]], bool]:
+        left = equality()
+        while take("&&"):
+            left = (lambda a, b: lambda defined: a(defined) and b(defined))(left, equality())
+        return left
+
+    def disjunction() -> Callable[[Set[str]], bool]:
+        left = conjunction()
+        while take("||"):
+            left = (lambda a, b: lambda defined: a(defined) or b(defined))(left, conjunction())
+        return left
+
+    try:
+        condition = disjunction()
+    except ValueError:
+        return lambda defined: False
+    if i != len(tokens):
+        return lambda defined: False
+    return condition
 
-        if state == "verbatim_string":
-            # "" escapes inside verbatim strings
-            if c == '"' and nxt == '"':
-                out.append("  ")
-                i += 2
-                continue
-            if c == '"':
-                state = "code"
-                out.append(" ")
-                i += 1
-                continue
-            out.append("\n" if c == "\n" else " ")
-            i += 1
-            continue
 
-        if state == "char":
-            if c == "\\":
-                out.append(" ")
-                if i + 1 < n:
-                    out.append(" ")
-                    i += 2
+def scan_directives(code) -> List[Tuple[str, str, int, int]]:
+    """(keyword, argument, line start, line end) of every conditional/#define directive in stripped code."""
+    if isinstance(code, str):
+        return [(m.group("keyword"), m.group("argument"), m.start(), m.end()) for m in PP_DIRECTIVE_RE.finditer(code)]
+    return [
+        (m.group("keyword").decode("ascii"), m.group("argument").decode("utf-8", errors="ignore"), m.start(), m.end())
+        for m in PP_DIRECTIVE_RE_BYTES.finditer(code)
+    ]
+
+
+def inactive_spans(
+    directives: Sequence[Tuple[str, str, int, int]], defines: FrozenSet[str], length: int
+) -> Tuple[Tuple[int, int], ...]:
+    """(start, end) of the code a configuration does not compile; unbalanced directives are tolerated."""
+    defined = set(defines)
+    spans: List[Tuple[int, int]] = []
+    stack: List[Tuple[bool, bool]] = []  # (enclosing code active, a branch of this #if was taken)
+    active = True
+    off = 0  # where the current inactive code began
+    for keyword, argument, start, end in directives:
+        if keyword in ("define", "undef"):
+            symbol = argument.split("//", 1)[0].strip()
+            if active and symbol:
+                if keyword == "define":
+                    defined.add(symbol)
                 else:
-                    i += 1
-                continue
-            if c == "'":
-                state = "code"
-                out.append(" ")
-                i += 1
-                continue
-            out.append("\n" if c == "\n" else " ")
-            i += 1
+                    defined.discard(symbol)
             continue
+        was_active = active
+        if keyword == "if":
+            active = active and parse_pp_condition(argument.split("//", 1)[0])(defined)
+            stack.append((was_active, active))
+        elif not stack:
+            continue
+        elif keyword == "elif":
+            enclosing, taken = stack[-1]
+            active = enclosing and not taken and parse_pp_condition(argument.split("//", 1)[0])(defined)
+            stack[-1] = (enclosing, taken or active)
+        elif keyword == "else":
+            enclosing, taken = stack[-1]
+            active = enclosing and not taken
+            stack[-1] = (enclosing, True)
+        else:  # endif
+            active = stack.pop()[0]
+        if was_active and not active:
+            off = end
+        elif active and not was_active:
+            spans.append((off, start))
+    if not active:
+        spans.append((off, length))
+    return tuple(spans)
+
+
+def preprocessor_variants(
+    code, configs: Sequence[FrozenSet[str]]
+) -> List[Tuple[int, Tuple[Tuple[int, int], ...]]]:
+    """(configuration mask, inactive spans) for each distinct variant of stripped code.
+
+    Bit i of the mask stands for configs[i]; the mask is 0 when every configuration sees the same code.
+    Without configurations directives are ignored and the code is analyzed as written.
+    """
+    directives = scan_directives(code) if configs else None
+    if not directives:
+        return [(0, ())]
+    groups: dict[Tuple[Tuple[int, int], ...], int] = {}
+    for i, defines in enumerate(configs):
+        spans = inactive_spans(directives, defines, len(code))
+        groups[spans] = groups.get(spans, 0) | (1 << i)
+    if len(groups) == 1:
+        return [(0, next(iter(groups)))]
+    return [(mask, spans) for spans, mask in groups.items()]
+
 
+def blank_spans(code: str, spans: Sequence[Tuple[int, int]]) -> str:
+    """code with every span blanked like a comment (newlines kept, so offsets do not move)."""
+    out: List[str] = []
+    pos = 0
+    for start, end in spans:
+        out.append(code[pos:start])
+        out.append(_blank(code[start:end]))
+        pos = end
+    out.append(code[pos:])
     return "".join(out)
 
 
+# Leading indentation is whitespace except newline, matched atomically (the lookahead captures it and
+# the backreference consumes it, so it is never backtracked). A plain \s* let every line start inside a
+# long blanked comment/string region re-scan the whole region, which is quadratic.
 TYPE_DECL_RE = re.compile(
-    r"(?m)^\s*(?P<mods>(?:public|private|protected|internal|static|abstract|sealed|partial|new|unsafe)\s+)*"
+    r"(?m)^(?=(?P<indent>[^\S\n]*))(?P=indent)(?P<mods>(?:public|private|protected|internal|static|abstract|sealed|partial|new|unsafe)\s+)*"
     r"(?P<kind>class|struct|interface|enum)\s+"
     r"(?P<name>[A-Za-z_]\w*)"
     r"(?:\s*:\s*(?P<bases>[^\{\n]+))?\s*\{"
 )
+# Same pattern over raw bytes for the mmap scanner (\w and \s are ASCII-only there).
+TYPE_DECL_RE_BYTES = re.compile(TYPE_DECL_RE.pattern.encode("ascii"))
 
 
 def normalize_kind(kind: str, mods: str) -> str:
@@ -296,428 +530,3912 @@ def split_base_list(bases: Optional[str]) -> List[str]:
     return [p.strip() for p in parts if p.strip()]
 
 
-def find_matching_brace(code: str, open_brace_index: int) -> int:
-    depth = 0
-    for i in range(open_brace_index, len(code)):
-        ch = code[i]
-        if ch == '{':
-            depth += 1
-        elif ch == '}':
-            depth -= 1
-            if depth == 0:
-                return i
-    return -1
+BRACE_RE = re.compile(r"[{}]")
+BRACE_RE_BYTES = re.compile(rb"[{}]")
+
+
+def build_brace_index(code) -> dict[int, int]:
+    """Map every '{' offset to its matching '}' offset (-1 if unclosed) in one stack-based pass.
+
+    code may be str or a bytes-like buffer (the mmap scanner).
+    """
+    is_text = isinstance(code, str)
+    brace_re = BRACE_RE if is_text else BRACE_RE_BYTES
+    open_brace = "{" if is_text else b"{"
+    pairs: dict[int, int] = {}
+    stack: List[int] = []
+    for m in brace_re.finditer(code):
+        if m.group() == open_brace:
+            stack.append(m.start())
+        elif stack:
+            pairs[stack.pop()] = m.start()
+    for open_index in stack:
+        pairs[open_index] = -1
+    return pairs
+
+
+# Type expressions (List<Transform>, GameObject, ...) repeat heavily across a codebase, so the
+# helpers that parse them are memoized. Results are frozensets so cached values can't be mutated.
+TYPE_EXPR_CACHE_SIZE = 8192
+
+NULLABLE_POINTER_RE = re.compile(r"[\?\*\&]")
+# Dotted names stay whole (UnityEngine.UI.Button) so the symbol table can resolve them as one type.
+TYPE_NAME_RE = re.compile(r"[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*")
+# One alternation for every container (longest first) instead of one regex per container per call
+GENERIC_CONTAINER_RE = re.compile(
+    r"\b(?:" + "|".join(re.escape(c) for c in sorted(GENERIC_CONTAINERS, key=lambda c: (-len(c), c))) + r")\s*<"
+)
 
 
-def extract_simple_type_names(type_expr: str) -> Set[str]:
-    """Extract identifiers from a type expression (handles generics/arrays/namespaces)."""
+@functools.lru_cache(maxsize=TYPE_EXPR_CACHE_SIZE)
+def extract_simple_type_names(type_expr: str) -> FrozenSet[str]:
+    """Extract type names from a type expression (handles generics/arrays; qualified names stay dotted)."""
     type_expr = type_expr.replace("global::", "")
     # Remove nullable suffix ? and pointer/ref symbols
-    type_expr = re.sub(r"[\?\*\&]", " ", type_expr)
-    # Keep identifiers only
-    names = set(re.findall(r"[A-Za-z_]\w*", type_expr))
+    type_expr = NULLABLE_POINTER_RE.sub(" ", type_expr)
+    # Keep (possibly qualified) names only
+    names = set(TYPE_NAME_RE.findall(type_expr))
     # Drop container names, primitives, and keywords
-    names = {
+    return frozenset(
         n
         for n in names
-        if n not in CS_PRIMITIVES
-        and n not in GENERIC_CONTAINERS
+        if n.rsplit(".", 1)[-1] not in CS_PRIMITIVES
+        and n.rsplit(".", 1)[-1] not in GENERIC_CONTAINERS
         and n not in CS_KEYWORDS
         and (n[0].isupper() or n[0] == "_")
-    }
-    return names
+    )
 
 
+@functools.lru_cache(maxsize=TYPE_EXPR_CACHE_SIZE)
 def is_collection_type(type_expr: str) -> bool:
     if "[]" in type_expr:
         return True
     # Quick check for common generic containers
-    for c in GENERIC_CONTAINERS:
-        if re.search(rf"\b{re.escape(c)}\s*<", type_expr):
-            return True
-    return False
+    return GENERIC_CONTAINER_RE.search(type_expr) is not None
 
 
-VISIBILITY_MODS_RE = re.compile(r"\b(public|private|protected|internal)\b")
-MODIFIERS_RE = re.compile(
-    r"\b(static|readonly|const|volatile|sealed|abstract|virtual|override|async|extern|new|unsafe|partial|event)\b"
+# Member declarations are read from a token stream of each member's header (see iter_member_texts),
+# so attributes, signatures and constraints may span any number of lines.
+MEMBER_TOKEN_RE = re.compile(r"(?:global::)?@?[A-Za-z_]\w*(?:\.@?[A-Za-z_]\w*)*|\S")
+MEMBER_MODIFIERS: FrozenSet[str] = frozenset(
+    (
+        "public private protected internal static readonly const volatile sealed abstract virtual override "
+        "async extern new unsafe partial event ref required fixed"
+    ).split()
 )
+PARAM_MODIFIERS: FrozenSet[str] = frozenset(("ref", "out", "in", "params", "this", "scoped", "readonly"))
+# A member header starting with one of these declares a nested type or a delegate, not a member.
+NESTED_DECL_KEYWORDS: FrozenSet[str] = frozenset(("class", "struct", "interface", "enum", "record", "delegate"))
+NEW_KEYWORD_RE = re.compile(r"\bnew\b")
+WHITESPACE_RUN_RE = re.compile(r"\s+")
 
 
-def _first_space_outside_generics(s: str) -> int:
+def _is_ident(token: str) -> bool:
+    return token[0].isalpha() or token[0] in "_@"
+
+
+def _skip_group(tokens: Sequence[str], i: int, close: str) -> int:
+    """Index just past the token closing the group opened at tokens[i] ('[' or '<' or '(')."""
+    opener = tokens[i]
     depth = 0
-    for idx, ch in enumerate(s):
-        if ch == '<':
+    for j in range(i, len(tokens)):
+        if tokens[j] == opener:
             depth += 1
-        elif ch == '>':
-            depth = max(0, depth - 1)
-        elif ch.isspace() and depth == 0:
-            return idx
-    return -1
+        elif tokens[j] == close:
+            depth -= 1
+            if depth == 0:
+                return j + 1
+    return len(tokens)
 
 
-def try_parse_field_or_expression_property(line: str) -> Optional[Tuple[str, str]]:
-    """Parse a field-like member or expression-bodied property at depth 0.
+def parse_type_tokens(tokens: Sequence[str], i: int) -> Tuple[int, str]:
+    """Parse one type expression starting at tokens[i]: names, generics, tuples, arrays, ? and *.
 
-    Returns (type_expr, initializer_text).
+    Returns (index after the type, normalized type text), or (i, "") when no type starts there.
+    Tuple element names are dropped: (int count, Foo foo) becomes (int, Foo).
     """
-    s = line.strip()
-    if not s.endswith(";"):
-        return None
+    n = len(tokens)
+    if i >= n:
+        return i, ""
+    if tokens[i] == "(":
+        parts: List[str] = []
+        j = i + 1
+        while True:
+            j, part = parse_type_tokens(tokens, j)
+            if not part:
+                return i, ""
+            parts.append(part)
+            if j < n and _is_ident(tokens[j]):
+                j += 1  # element name
+            if j < n and tokens[j] == ",":
+                j += 1
+            elif j < n and tokens[j] == ")":
+                j += 1
+                break
+            else:
+                return i, ""
+        text = "(" + ", ".join(parts) + ")"
+    elif _is_ident(tokens[i]):
+        j = i + 1
+        text = tokens[i]
+        while j < n and tokens[j] == "<":
+            args: List[str] = []
+            j += 1
+            while True:
+                j, arg = parse_type_tokens(tokens, j)
+                if not arg:
+                    return i, ""
+                args.append(arg)
+                if j < n and tokens[j] == ",":
+                    j += 1
+                elif j < n and tokens[j] == ">":
+                    j += 1
+                    break
+                else:
+                    return i, ""
+            text += "<" + ", ".join(args) + ">"
+            if j + 1 < n and tokens[j] == "." and _is_ident(tokens[j + 1]):
+                text += "." + tokens[j + 1]  # Outer<T>.Inner
+                j += 2
+    else:
+        return i, ""
+    while j < n:
+        if tokens[j] in ("?", "*"):
+            text += tokens[j]
+            j += 1
+            continue
+        if tokens[j] != "[":
+            break
+        k = j + 1
+        while k < n and tokens[k] == ",":
+            k += 1
+        if k >= n or tokens[k] != "]":
+            break  # not a rank specifier (a fixed buffer size or an indexer)
+        text += "".join(tokens[j : k + 1])
+        j = k + 1
+    return j, text
 
-    # remove attributes on the same line (best-effort)
-    s = re.sub(r"^\s*(\[[^\]]*\]\s*)+", "", s)
-    # drop trailing ';'
-    s = s[:-1].strip()
-
-    init = ""
-    if "=>" in s:
-        left, right = s.split("=>", 1)
-        s = left.strip()
-        init = right.strip()
-    elif "=" in s:
-        left, right = s.split("=", 1)
-        s = left.strip()
-        init = right.strip()
-
-    # If this looks like a method signature, don't treat it as a field/property.
-    if "(" in s:
-        return None
 
-    # remove common modifiers
-    s = VISIBILITY_MODS_RE.sub(" ", s)
-    s = MODIFIERS_RE.sub(" ", s)
-    s = re.sub(r"\s+", " ", s).strip()
+def parse_param_tokens(tokens: Sequence[str], i: int) -> Tuple[List[str], int]:
+    """Parameter types of the list opened by tokens[i] == '(' (or '[' for indexers), and the index after it."""
+    close = ")" if tokens[i] == "(" else "]"
+    n = len(tokens)
+    types: List[str] = []
+    j = i + 1
+    while j < n and tokens[j] != close:
+        while j < n and tokens[j] == "[":
+            j = _skip_group(tokens, j, "]")
+        while j < n and tokens[j] in PARAM_MODIFIERS:
+            j += 1
+        k, type_expr = parse_type_tokens(tokens, j)
+        # a type with no parameter name after it is not a parameter (e.g. __arglist)
+        if type_expr and k < n and _is_ident(tokens[k]):
+            types.append(type_expr)
+        j = max(k, j)
+        # skip the name and any default value up to the next top-level ',' or the closing token
+        depth = 0
+        while j < n:
+            tok = tokens[j]
+            if tok in "([{":
+                depth += 1
+            elif tok in ")]}":
+                if depth == 0:
+                    break
+                depth -= 1
+            elif tok == "," and depth == 0:
+                break
+            j += 1
+        if j < n and tokens[j] == ",":
+            j += 1
+    return types, j + 1
 
-    # For multi-variable declarations (Type a, b, c) we only need Type.
-    split_idx = _first_space_outside_generics(s)
-    if split_idx == -1:
-        return None
 
-    type_expr = s[:split_idx].strip()
-    # ensure we have something that looks like a type
-    if not type_expr or type_expr in CS_KEYWORDS:
-        return None
+@dataclass
+class MemberHead:
+    """What parse_member_head found in one member header."""
 
-    return type_expr, init
+    kind: str  # "method", "constructor" or "member" (field, property, indexer or event)
+    type_expr: str = ""  # field/property type or method return type
+    param_types: List[str] = field(default_factory=list)
+    # Generic method: its own type parameters and the types named in its where clauses
+    type_params: List[str] = field(default_factory=list)
+    constraint_types: List[str] = field(default_factory=list)
 
 
-def try_parse_auto_property(line: str) -> Optional[str]:
-    """Parse an auto-property signature line at depth 0.
+def parse_member_head(head: str, type_name: str) -> Optional[MemberHead]:
+    """Classify one member header (the declaration up to its body, '=' or '=>') in a single token pass.
 
-    Example: public Foo Bar { get; set; }
+    type_name is the simple name of the declaring type, used to recognize constructors.
+    Returns None for nested type declarations, delegates, finalizers and anything unrecognized.
     """
-    if "{" not in line:
+    tokens = MEMBER_TOKEN_RE.findall(head)
+    n = len(tokens)
+    i = 0
+    while i < n and tokens[i] == "[":
+        i = _skip_group(tokens, i, "]")
+    while i < n and tokens[i] in MEMBER_MODIFIERS:
+        i += 1
+    if i >= n or tokens[i] in NESTED_DECL_KEYWORDS or tokens[i] == "~":
         return None
-    s = line.strip()
-    s = re.sub(r"^\s*(\[[^\]]*\]\s*)+", "", s)
+    if tokens[i] == type_name and i + 1 < n and tokens[i + 1] == "(":
+        return MemberHead("constructor", param_types=parse_param_tokens(tokens, i + 1)[0])
+    if tokens[i] in ("implicit", "explicit") and i + 1 < n and tokens[i + 1] == "operator":
+        j, type_expr = parse_type_tokens(tokens, i + 2)
+        if not type_expr or j >= n or tokens[j] != "(":
+            return None
+        return MemberHead("method", type_expr, parse_param_tokens(tokens, j)[0])
 
-    # take the part before '{'
-    s = s.split("{", 1)[0].strip()
-
-    # Methods also contain '{' but include parentheses; ignore those.
-    if "(" in s:
+    j, type_expr = parse_type_tokens(tokens, i)
+    if not type_expr or j >= n:
         return None
-    s = VISIBILITY_MODS_RE.sub(" ", s)
-    s = MODIFIERS_RE.sub(" ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-
-    # last token is property name; type is the rest
-    tokens = s.split(" ")
-    if len(tokens) < 2:
+    if tokens[j] == "operator":
+        while j < n and tokens[j] != "(":
+            j += 1
+        if j >= n:
+            return None
+        return MemberHead("method", type_expr, parse_param_tokens(tokens, j)[0])
+    if type_expr in CS_KEYWORDS and type_expr != "void":
         return None
-    type_expr = " ".join(tokens[:-1]).strip()
-    if not type_expr or type_expr in CS_KEYWORDS:
+    if tokens[j] == "this" and j + 1 < n and tokens[j + 1] == "[":
+        return MemberHead("member", type_expr, parse_param_tokens(tokens, j + 1)[0])
+    if not _is_ident(tokens[j]):
         return None
-    return type_expr
-
-METHOD_RE = re.compile(
-    r"^\s*(?:\[[^\]]*\]\s*)*"
-    r"(?:(?:public|private|protected|internal)\s+)?"
-    r"(?:static\s+)?(?:virtual\s+|override\s+|abstract\s+|async\s+|sealed\s+)*"
-    r"(?P<ret>[A-Za-z_][\w\.<>,\[\]]*)\s+"
-    r"(?P<name>[A-Za-z_]\w*)\s*\((?P<params>[^\)]*)\)"
-)
 
-EXPLICIT_INTERFACE_METHOD_RE = re.compile(
-    r"^\s*(?:\[[^\]]*\]\s*)*"
-    r"(?:(?:public|private|protected|internal)\s+)?"
-    r"(?:static\s+)?(?:virtual\s+|override\s+|abstract\s+|async\s+|sealed\s+)*"
-    r"(?P<ret>[A-Za-z_][\w\.<>,\[\]]*)\s+"
-    r"(?P<iface>[A-Za-z_]\w*)\.(?P<name>[A-Za-z_]\w*)\s*\((?P<params>[^\)]*)\)"
-)
+    # Member name, possibly an explicit interface implementation (IFoo<T>.Bar) or a generic method (Get<T>)
+    type_params: List[str] = []
+    j += 1
+    while j < n:
+        if tokens[j] == "<":
+            end = _skip_group(tokens, j, ">")
+            type_params = [t for t in tokens[j + 1 : end - 1] if _is_ident(t)]
+            j = end
+        if j + 1 < n and tokens[j] == "." and _is_ident(tokens[j + 1]):
+            type_params = []
+            j += 2
+            continue
+        break
+    if j >= n or tokens[j] != "(":
+        return None if type_expr == "void" else MemberHead("member", type_expr)
 
-CTOR_RE = re.compile(
-    r"^\s*(?:\[[^\]]*\]\s*)*"
-    r"(?:(?:public|private|protected|internal)\s+)?"
-    r"(?P<name>[A-Za-z_]\w*)\s*\((?P<params>[^\)]*)\)"
-)
+    param_types, j = parse_param_tokens(tokens, j)
+    constraint_types: List[str] = []
+    # where T : Base, IFoo<T>, new() -- clauses only; anything else ends the head
+    while j + 2 < n and tokens[j] == "where" and _is_ident(tokens[j + 1]) and tokens[j + 2] == ":":
+        j += 3
+        while j < n:
+            if tokens[j] == "new" and tokens[j + 1 : j + 3] == ["(", ")"]:
+                j += 3
+            else:
+                k, constraint = parse_type_tokens(tokens, j)
+                if not constraint:
+                    break
+                constraint_types.append(constraint)
+                j = k
+            if j >= n or tokens[j] != ",":
+                break
+            j += 1
+    return MemberHead("method", type_expr, param_types, type_params, constraint_types)
 
 
-def parse_param_types(param_list: str) -> Set[str]:
-    if not param_list.strip():
-        return set()
-    parts: List[str] = []
-    cur: List[str] = []
-    depth = 0
-    for ch in param_list:
-        if ch == '<':
-            depth += 1
-        elif ch == '>':
-            depth = max(0, depth - 1)
-        elif ch == ',' and depth == 0:
-            parts.append("".join(cur).strip())
-            cur = []
-            continue
-        cur.append(ch)
-    last = "".join(cur).strip()
-    if last:
-        parts.append(last)
+TYPE_EXPR_CACHES = (extract_simple_type_names, is_collection_type)
 
-    out: Set[str] = set()
-    for p in parts:
-        p = p.strip()
-        if not p:
-            continue
-        # remove default value
-        p = p.split("=")[0].strip()
-        # remove modifiers
-        p = re.sub(r"\b(ref|out|in|params|this)\b", " ", p).strip()
-        # parameter name is the last identifier; type is the rest
-        tokens = p.split()
-        if len(tokens) <= 1:
-            # could be something like "CancellationToken" (no name) - ignore
-            continue
-        type_expr = " ".join(tokens[:-1])
-        out |= extract_simple_type_names(type_expr)
-    return out
 
+def type_expr_cache_report() -> List[str]:
+    lines = []
+    for fn in TYPE_EXPR_CACHES:
+        info = fn.cache_info()
+        lookups = info.hits + info.misses
+        rate = (100.0 * info.hits / lookups) if lookups else 0.0
+        lines.append(
+            f"{fn.__name__}: {info.hits} hits, {info.misses} misses ({rate:.1f}% hit rate), "
+            f"{info.currsize}/{info.maxsize} entries"
+        )
+    return lines
 
-def collect_depth0_lines(body: str) -> Iterable[str]:
-    depth = 0
-    for raw_line in body.splitlines():
-        line = raw_line
-        if depth == 0:
-            yield line
-        # update depth after yielding
-        depth += line.count("{") - line.count("}")
 
+@dataclass
+class DeclHeader:
+    """A type declaration header found by TYPE_DECL_RE in cleaned code."""
 
-def analyze_file(path: Path, known_type_kinds: dict[str, str]) -> List[TypeDecl]:
-    code = path.read_text(encoding="utf-8", errors="ignore")
-    cleaned = strip_comments_and_strings(code)
+    kind_raw: str
+    mods: str
+    name: str
+    bases: Optional[str]
+    open_brace_index: int
+    close_brace_index: int = -1
+    # Containing type chain joined with '.', e.g. Outer.Inner
+    qualified_name: str = ""
+    # Indexes (into ParsedFile.headers) of the types declared directly inside this one
+    children: List[int] = field(default_factory=list)
+    # Filled by assign_scopes
+    namespace: str = ""
+    usings: List[str] = field(default_factory=list)
+    aliases: dict[str, str] = field(default_factory=dict)
 
-    decls: List[TypeDecl] = []
-    for m in TYPE_DECL_RE.finditer(cleaned):
-        mods = m.group("mods") or ""
-        kind_raw = m.group("kind")
-        name = m.group("name")
-        bases = split_base_list(m.group("bases"))
-        kind = normalize_kind(kind_raw, mods)
-
-        base_class: Optional[str] = None
-        interfaces: List[str] = []
-
-        if kind_raw == "class":
-            if bases:
-                base_class = bases[0].strip()
-                interfaces = [b.strip() for b in bases[1:]]
-        elif kind_raw == "interface":
-            # interface extends interfaces
-            interfaces = [b.strip() for b in bases]
+    @property
+    def kind(self) -> str:
+        return normalize_kind(self.kind_raw, self.mods)
+
+
+@dataclass
+class ParsedFile:
+    """Per-file model: the file is read and stripped exactly once and shared by every pass."""
+
+    path: Path
+    cleaned: str
+    headers: List[DeclHeader] = field(default_factory=list)
+    brace_pairs: dict[int, int] = field(default_factory=dict)
+
+
+def decode_source(data: bytes) -> str:
+    """Decode raw file bytes the same way Path.read_text does (utf-8, universal newlines)."""
+    return data.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def parse_file(path: Path, data: Optional[bytes] = None) -> ParsedFile:
+    if data is None:
+        code = path.read_text(encoding="utf-8", errors="ignore")
+    else:
+        code = decode_source(data)
+    return scan_declarations(path, strip_comments_and_strings(code))
+
+
+def scan_declarations(path: Path, cleaned: str) -> ParsedFile:
+    """Find type declaration headers, brace pairs and the type scope tree in already-stripped code."""
+    headers = [
+        DeclHeader(
+            kind_raw=m.group("kind"),
+            mods=m.group("mods") or "",
+            name=m.group("name"),
+            bases=m.group("bases"),
+            open_brace_index=m.end() - 1,
+        )
+        for m in TYPE_DECL_RE.finditer(cleaned)
+    ]
+    brace_pairs = build_brace_index(cleaned)
+    link_type_scopes(headers, brace_pairs)
+    assign_scopes(cleaned, headers, brace_pairs)
+    return ParsedFile(path=path, cleaned=cleaned, headers=headers, brace_pairs=brace_pairs)
+
+
+def link_type_scopes(headers: Sequence[DeclHeader], brace_pairs: dict[int, int]) -> None:
+    """Resolve each header's body extent and build the nesting tree (headers are in source order)."""
+    scope: List[int] = []  # stack of enclosing header indexes
+    for idx, header in enumerate(headers):
+        header.close_brace_index = brace_pairs.get(header.open_brace_index, -1)
+        while scope and not (header.open_brace_index < headers[scope[-1]].close_brace_index):
+            scope.pop()
+        if scope:
+            parent = headers[scope[-1]]
+            parent.children.append(idx)
+            header.qualified_name = f"{parent.qualified_name}.{header.name}"
         else:
-            # struct/enum: ignore bases
-            pass
+            header.qualified_name = header.name
+        if header.close_brace_index != -1:
+            scope.append(idx)
 
-        # body extraction
-        open_brace_index = m.end() - 1
-        close_brace_index = find_matching_brace(cleaned, open_brace_index)
-        body = ""
-        if close_brace_index != -1:
-            body = cleaned[open_brace_index + 1 : close_brace_index]
 
-        td = TypeDecl(kind=kind, name=name, base_class=base_class, interfaces=interfaces)
+# Both start with a literal keyword so the regex engine can skip ahead quickly; that the keyword
+# starts its line (after an optional "global") is checked by _starts_line.
+NAMESPACE_RE = re.compile(r"namespace\s+(?P<name>[A-Za-z_][\w.]*)\s*(?P<term>[{;])")
+USING_RE = re.compile(
+    r"using\s+(?:static\s+)?"
+    r"(?:(?P<alias>[A-Za-z_]\w*)\s*=\s*)?(?P<target>(?:global::)?[A-Za-z_][\w.]*(?:\s*<[^;{}]*>)?)\s*;"
+)
+NAMESPACE_RE_BYTES = re.compile(NAMESPACE_RE.pattern.encode("ascii"))
+USING_RE_BYTES = re.compile(USING_RE.pattern.encode("ascii"))
 
-        # Scan only member lines at depth 0 inside the type
-        for line in collect_depth0_lines(body):
-            line_stripped = line.strip()
-            if not line_stripped:
-                continue
 
-            # methods (skip constructors)
-            mm = METHOD_RE.match(line)
-            if mm:
-                ret = mm.group("ret")
-                td.dependency |= extract_simple_type_names(ret)
-                td.dependency |= parse_param_types(mm.group("params"))
-                continue
+def _starts_line(code, pos: int, allowed_prefixes) -> bool:
+    newline = "\n" if isinstance(code, str) else b"\n"
+    return code[code.rfind(newline, 0, pos) + 1 : pos].strip() in allowed_prefixes
 
-            em = EXPLICIT_INTERFACE_METHOD_RE.match(line)
-            if em:
-                ret = em.group("ret")
-                td.dependency |= extract_simple_type_names(ret)
-                td.dependency |= parse_param_types(em.group("params"))
-                continue
 
-            # constructor: dependencies from params
-            cm = CTOR_RE.match(line)
-            if cm and cm.group("name") == name:
-                td.dependency |= parse_param_types(cm.group("params"))
-                continue
+def assign_scopes(code, headers: Sequence[DeclHeader], brace_pairs: dict[int, int]) -> None:
+    """Give every header its namespace and the using directives/aliases visible at its declaration.
 
-            # auto-properties
-            type_expr_prop = try_parse_auto_property(line)
-            if type_expr_prop:
-                type_names = extract_simple_type_names(type_expr_prop)
-                if type_names:
-                    if is_collection_type(type_expr_prop):
-                        td.aggregation |= type_names
-                    else:
-                        td.association |= type_names
+    Handles nested namespace blocks and file-scoped namespaces; usings inside a namespace block only
+    apply to that block. code may be str or a blanked bytes buffer.
+    """
+    is_text = isinstance(code, str)
+    namespace_re = NAMESPACE_RE if is_text else NAMESPACE_RE_BYTES
+    using_re = USING_RE if is_text else USING_RE_BYTES
+    decode = (lambda v: v) if is_text else (lambda v: v.decode("ascii", errors="ignore"))
+    bare = ("",) if is_text else (b"",)
+    global_prefix = ("", "global") if is_text else (b"", b"global")
+
+    # (open, close, name): the body of a block namespace, or the rest of the file after `namespace X;`
+    spaces: List[Tuple[int, int, str]] = []
+    for m in namespace_re.finditer(code):
+        if not _starts_line(code, m.start(), bare):
+            continue
+        start = m.end() - 1
+        end = brace_pairs.get(start, -1) if m.group("term") in ("{", b"{") else len(code)
+        spaces.append((start, len(code) if end == -1 else end, decode(m.group("name"))))
+    usings: List[Tuple[int, Optional[str], str]] = [
+        (
+            m.start(),
+            None if m.group("alias") is None else decode(m.group("alias")),
+            WHITESPACE_RUN_RE.sub("", decode(m.group("target"))).replace("global::", ""),
+        )
+        for m in using_re.finditer(code)
+        if _starts_line(code, m.start(), global_prefix)
+    ]
+    if not spaces and not usings:
+        return
+
+    def enclosing(pos: int) -> List[int]:
+        return [i for i, (start, end, _) in enumerate(spaces) if start < pos < end]
+
+    using_scopes = [(enclosing(pos)[-1:], alias, target) for pos, alias, target in usings]
+    for header in headers:
+        around = enclosing(header.open_brace_index)
+        header.namespace = ".".join(spaces[i][2] for i in around)
+        for scope, alias, target in using_scopes:
+            if scope and scope[0] not in around:
                 continue
+            if alias is None:
+                header.usings.append(target)
+            else:
+                header.aliases[alias] = target
 
-            # fields and expression-bodied properties
-            parsed = try_parse_field_or_expression_property(line)
-            if parsed:
-                type_expr, init = parsed
-                type_names = extract_simple_type_names(type_expr)
-                if not type_names:
-                    continue
 
-                if is_collection_type(type_expr):
-                    td.aggregation |= type_names
-                else:
-                    if init and re.search(r"\bnew\b", init):
-                        td.composition |= type_names
+MEMBER_PUNCT_RE = re.compile(r"[;{}()\[\]=#]")
+MEMBER_PUNCT_RE_BYTES = re.compile(MEMBER_PUNCT_RE.pattern.encode("ascii"))
+NON_SPACE_RE = re.compile(r"\S")
+NON_SPACE_RE_BYTES = re.compile(rb"\S")
+
+
+PP_KEYWORD_RE = re.compile(r"\s*([a-z]*)")
+
+
+@dataclass
+class MemberText:
+    """One member declaration of a type body, split at its first top-level '=' or '=>'."""
+
+    head: str
+    init: str = ""  # initializer or expression body
+    has_body: bool = False  # a method body or accessor block follows the head
+
+
+def iter_member_texts(
+    code,
+    start: int,
+    end: int,
+    cuts: dict[int, int],
+    brace_pairs: dict[int, int],
+    bodies: Optional[List[Tuple[int, int]]] = None,
+) -> Iterator[MemberText]:
+    """Split the type body code[start:end] into member declarations in one scan.
+
+    code is blanked text (str, or bytes for the mmap scanner). Blocks -- method bodies, accessors,
+    initializer braces -- are jumped over through brace_pairs, so only member headers are read.
+    cuts maps the '{' of each nested type to its '}': the nested type is skipped entirely.
+    Preprocessor directive lines are left out of the member they interrupt, and an #elif/#else branch
+    replaces what the previous branch added to an unfinished member, so alternative signatures are
+    never joined (the last branch wins). The (start, end) spans of method bodies and accessor blocks
+    are appended to bodies if given.
+    """
+    is_text = isinstance(code, str)
+    punct_re = MEMBER_PUNCT_RE if is_text else MEMBER_PUNCT_RE_BYTES
+    non_space_re = NON_SPACE_RE if is_text else NON_SPACE_RE_BYTES
+    decode = (lambda v: v) if is_text else (lambda v: v.decode("utf-8", errors="ignore"))
+    newline = "\n" if is_text else b"\n"
+    operator_chars = "!<>=" if is_text else b"!<>="
+
+    pieces: list = []  # the current part of the member, minus directive lines
+    seg = pos = start
+    head: Optional[str] = None  # set once the head is complete
+    has_body = False
+    depth = 0  # () and [] nesting
+    generation = 0  # bumped whenever the member in progress is finished, dropped or split at '='
+    # per open #if: (generation, len(pieces), depth) where it started
+    branches: List[Tuple[int, int, int]] = []
+
+    def take(stop: int) -> str:
+        nonlocal generation
+        generation += 1
+        pieces.append(code[seg:stop])
+        text = decode(code[:0].join(pieces))
+        pieces.clear()
+        return text
+
+    while True:
+        m = punct_re.search(code, pos, end)
+        if m is None:
+            return  # text after the last member (enum values, stray tokens) is not a member
+        i = m.start()
+        c = m.group()
+        pos = m.end()
+        if c in ("(", "[", b"(", b"["):
+            depth += 1
+        elif c in (")", "]", b")", b"]"):
+            depth = max(0, depth - 1)
+        elif c in ("#", b"#"):
+            line_start = code.rfind(newline, 0, i) + 1
+            if not code[line_start:i].strip():
+                eol = code.find(newline, i, end)
+                if eol == -1:
+                    eol = end
+                pieces.append(code[seg:i])
+                seg = pos = eol
+                keyword = PP_KEYWORD_RE.match(decode(code[i + 1 : eol])).group(1)
+                if keyword == "if":
+                    branches.append((generation, len(pieces), depth))
+                elif keyword == "endif" and branches:
+                    branches.pop()
+                elif keyword in ("elif", "else") and branches:
+                    started, kept, branch_depth = branches[-1]
+                    if started == generation:
+                        del pieces[kept:]
+                        depth = branch_depth
                     else:
-                        td.association |= type_names
+                        # the member began inside the previous branch: drop it
+                        pieces.clear()
+                        head, has_body, depth = None, False, 0
+                        generation += 1
+                        branches[-1] = (generation, 0, 0)
+        elif c in ("=", b"="):
+            nxt = code[pos : pos + 1]
+            if head is None and depth == 0 and nxt not in ("=", b"=") and code[i - 1 : i] not in operator_chars:
+                head = take(i)
+                if nxt in (">", b">"):
+                    pos += 1
+                seg = pos
+            elif nxt in ("=", b"=", ">", b">"):
+                pos += 1
+        elif c in ("{", b"{"):
+            if i in cuts:
+                # nested type: drop its header, continue after its body
+                pieces.clear()
+                seg = pos = cuts[i] + 1
+                head, has_body, depth = None, False, 0
+                generation += 1
                 continue
+            close = brace_pairs.get(i, -1)
+            if close == -1 or close >= end:
+                return
+            pos = close + 1
+            if head is None and depth == 0:
+                head = take(i)
+                has_body = True
+                if bodies is not None:
+                    bodies.append((i + 1, close))
+                after = non_space_re.search(code, pos, end)
+                if after is not None and after.group() in ("=", b"=") and code[after.end() : after.end() + 1] not in (">", b">"):
+                    # property initializer after the accessors: { get; set; } = new Foo();
+                    pos = seg = after.end()
+                    continue
+                if head.strip():
+                    yield MemberText(head, "", True)
+                seg = pos
+                head, has_body, depth = None, False, 0
+                generation += 1
+        elif c in ("}", b"}"):
+            pieces.clear()
+            seg = pos
+            head, has_body, depth = None, False, 0
+            generation += 1
+        elif depth == 0:  # ';'
+            if head is None:
+                head, init = take(i), ""
+            else:
+                init = take(i)
+            if head.strip():
+                yield MemberText(head, init, has_body)
+            seg = pos
+            head, has_body, depth = None, False, 0
+            generation += 1
 
-        # Filter out self refs and obvious noise
-        td.composition.discard(td.name)
-        td.aggregation.discard(td.name)
-        td.association.discard(td.name)
-        td.dependency.discard(td.name)
 
-        # Keep external base_class/interfaces as-is; but for relationship sets, prefer to keep useful ones.
-        decls.append(td)
+def type_body_cuts(headers: Sequence[DeclHeader], header: DeclHeader) -> dict[int, int]:
+    """'{' -> '}' of the nested types declared directly in header's body, for iter_member_texts."""
+    return {
+        headers[i].open_brace_index: headers[i].close_brace_index
+        for i in header.children
+        if headers[i].close_brace_index != -1
+    }
 
-    return decls
 
+def new_type_decl(header: DeclHeader) -> TypeDecl:
+    bases = split_base_list(header.bases)
+    base_class: Optional[str] = None
+    interfaces: List[str] = []
 
-def main() -> int:
-    ap = argparse.ArgumentParser(description="Generate UML ClassRelationship.csv from C# scripts")
-    ap.add_argument(
-        "--source",
-        default=str(Path("Assets/Scripts/FusionImpostor")),
-        help="Folder containing .cs files to analyze",
-    )
-    ap.add_argument(
-        "--output",
-        default=str(Path("Assets/Docs/UMLDiagramClass/ClassRelationship.csv")),
-        help="CSV output path",
-    )
-    ap.add_argument(
-        "--internal-only",
-        action="store_true",
-        help="Only include types declared under the scanned source folder in relationship columns.",
-    )
-    args = ap.parse_args()
+    if header.kind_raw == "class":
+        if bases:
+            base_class = bases[0].strip()
+            interfaces = [b.strip() for b in bases[1:]]
+    elif header.kind_raw == "interface":
+        # interface extends interfaces
+        interfaces = [b.strip() for b in bases]
+    else:
+        # struct/enum: ignore bases
+        pass
 
-    source_dir = Path(args.source)
-    output_path = Path(args.output)
+    # Nested types are reported with their containing type (Outer.Inner)
+    return TypeDecl(
+        kind=header.kind,
+        name=header.qualified_name,
+        base_class=base_class,
+        interfaces=interfaces,
+        namespace=header.namespace,
+        usings=list(header.usings),
+        aliases=dict(header.aliases),
+    )
 
-    if not source_dir.exists():
-        raise SystemExit(f"Source folder not found: {source_dir}")
 
-    cs_files = sorted(source_dir.rglob("*.cs"))
-    if not cs_files:
-        raise SystemExit(f"No .cs files found under: {source_dir}")
+def scan_members(td: TypeDecl, name: str, members: Iterable[MemberText]) -> None:
+    """Fill td's relationship sets from the member declarations of its body (name is the simple type name)."""
+    for member in members:
+        head = parse_member_head(member.head, name)
+        if head is None:
+            continue
 
-    # First pass: collect known types (names + kinds)
-    known_type_kinds: dict[str, str] = {}
-    for f in cs_files:
-        code = f.read_text(encoding="utf-8", errors="ignore")
-        cleaned = strip_comments_and_strings(code)
-        for m in TYPE_DECL_RE.finditer(cleaned):
-            mods = m.group("mods") or ""
-            kind_raw = m.group("kind")
-            name = m.group("name")
-            known_type_kinds[name] = normalize_kind(kind_raw, mods)
-
-    # Second pass: analyze per file
-    all_decls: List[TypeDecl] = []
-    for f in cs_files:
-        all_decls.extend(analyze_file(f, known_type_kinds))
+        if head.kind != "member":
+            # methods and constructors: dependencies from the signature, minus the method's own type parameters
+            used: Set[str] = set(extract_simple_type_names(head.type_expr)) if head.type_expr else set()
+            for type_expr in head.param_types + head.constraint_types:
+                used |= extract_simple_type_names(type_expr)
+            used.difference_update(head.type_params)
+            td.dependency |= used
+            continue
 
-    # Merge by type name in case multiple files/partials
-    merged: dict[str, TypeDecl] = {}
-    for d in all_decls:
-        if d.name not in merged:
-            merged[d.name] = d
+        # fields, properties, indexers and events
+        for type_expr in head.param_types:
+            td.dependency |= extract_simple_type_names(type_expr)
+        type_names = extract_simple_type_names(head.type_expr)
+        if not type_names:
             continue
-        existing = merged[d.name]
-        # Prefer a more specific kind label if available
-        existing.kind = d.kind or existing.kind
-        existing.base_class = d.base_class or existing.base_class
-        existing.interfaces = sorted(set(existing.interfaces) | set(d.interfaces))
-        existing.composition |= d.composition
-        existing.aggregation |= d.aggregation
-        existing.association |= d.association
-        existing.dependency |= d.dependency
+        if is_collection_type(head.type_expr):
+            td.aggregation |= type_names
+        elif not member.has_body and member.init and NEW_KEYWORD_RE.search(member.init):
+            td.composition |= type_names
+        else:
+            td.association |= type_names
 
-    known_type_names = set(known_type_kinds.keys())
+    # Filter out self refs and obvious noise
+    td.composition.discard(name)
+    td.aggregation.discard(name)
+    td.association.discard(name)
+    td.dependency.discard(name)
 
-    def maybe_filter_to_known(items: Set[str]) -> Set[str]:
-        if not args.internal_only:
-            return items
-        return {i for i in items if i in known_type_names}
 
-    # Normalize relationship sets: drop primitives/containers again; optionally drop unknown symbols like "get" (rare)
-    def clean_set(items: Set[str]) -> List[str]:
-        cleaned = [
-            i
-            for i in items
-            if i not in CS_PRIMITIVES and i not in GENERIC_CONTAINERS and i not in CS_KEYWORDS
-        ]
-        return sorted(set(cleaned))
+# Body scanning splits code into dotted identifier chains: every ASCII character that cannot be part of
+# one becomes a space, then split(). A C-level translate is several times faster than a regex here.
+_IDENT_CHAIN_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_.")
+_CHAIN_TABLE = {c: " " for c in range(128) if chr(c) not in _IDENT_CHAIN_CHARS}
+_CHAIN_TABLE_BYTES = bytes(c if c >= 128 or chr(c) in _IDENT_CHAIN_CHARS else 0x20 for c in range(256))
 
-    header = [
-        "Kind",
-        "Class Name",
-        "Generalization",
-        "Realization/Implement",
-        "Composition",
-        "Dependency",
-        "Assocation",
-        "Inheritance",
-        "Aggregation",
+
+def scan_body_refs(code, spans: Iterable[Tuple[int, int]], texts: Iterable[str] = ()) -> Set[str]:
+    """Distinct candidate type names used in code[start:end] for each span and in texts.
+
+    Candidates are capitalized chains not starting with '.', so Foo.Instance and new Foo() are found
+    but the member in obj.Foo is not. Matching them against declared types is left to resolve_decl.
+    """
+    if isinstance(code, str):
+        chains = {w for start, end in spans for w in code[start:end].translate(_CHAIN_TABLE).split()}
+    else:
+        raw = {w for start, end in spans for w in code[start:end].translate(_CHAIN_TABLE_BYTES).split()}
+        chains = {w.decode("utf-8", errors="ignore") for w in raw}
+    for text in texts:
+        chains.update(text.translate(_CHAIN_TABLE).split())
+    return {w.rstrip(".") for w in chains if w[0].isupper() or (w[0] == "_" and len(w) > 1)}
+
+
+def analyze_type(
+    code, headers: Sequence[DeclHeader], header: DeclHeader, brace_pairs: dict[int, int], scan_bodies: bool = False
+) -> TypeDecl:
+    """TypeDecl of one declared type; code is the blanked file text (str or mmap bytes).
+
+    With scan_bodies, names used in method bodies, accessors and initializers go to body_refs.
+    """
+    td = new_type_decl(header)
+    # Enum bodies hold values, not members
+    if header.kind_raw == "enum" or header.close_brace_index == -1:
+        return td
+    bodies: Optional[List[Tuple[int, int]]] = [] if scan_bodies else None
+    members = iter_member_texts(
+        code,
+        header.open_brace_index + 1,
+        header.close_brace_index,
+        type_body_cuts(headers, header),
+        brace_pairs,
+        bodies,
+    )
+    if bodies is None:
+        scan_members(td, header.name, members)
+        return td
+    members = list(members)
+    scan_members(td, header.name, members)
+    td.body_refs = scan_body_refs(code, bodies, (m.init for m in members if m.init))
+    return td
+
+
+def analyze_file(parsed: ParsedFile, scan_bodies: bool = False) -> List[TypeDecl]:
+    """Analyze one parsed file; the result depends only on that file's text."""
+    return [
+        analyze_type(parsed.cleaned, parsed.headers, header, parsed.brace_pairs, scan_bodies)
+        for header in parsed.headers
     ]
 
-    output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    rows: List[List[str]] = []
-    for name in sorted(merged.keys()):
-        d = merged[name]
-        kind = d.kind
-        base = (d.base_class or "").strip()
-        ifaces = "; ".join(sorted({i.strip() for i in d.interfaces if i.strip()}))
-        comp = "; ".join(clean_set(maybe_filter_to_known(d.composition)))
-        dep = "; ".join(clean_set(maybe_filter_to_known(d.dependency)))
-        assoc = "; ".join(clean_set(maybe_filter_to_known(d.association)))
-        aggr = "; ".join(clean_set(maybe_filter_to_known(d.aggregation)))
+def analyze_variants(
+    path: Path,
+    cleaned: str,
+    prof: "Profiler",
+    scan_bodies: bool = False,
+    configs: Sequence[FrozenSet[str]] = (),
+) -> List[TypeDecl]:
+    """Declaration scan and member parse of stripped code, once per distinct preprocessor variant;
+    each TypeDecl is tagged with the configurations (mask) it was seen in."""
+    variants = [(0, ())]
+    if configs:
+        with prof.phase("preprocess"):
+            variants = preprocessor_variants(cleaned, configs)
+    decls: List[TypeDecl] = []
+    for mask, spans in variants:
+        with prof.phase("declaration scan"):
+            parsed = scan_declarations(path, blank_spans(cleaned, spans) if spans else cleaned)
+        with prof.phase("member parse"):
+            variant = analyze_file(parsed, scan_bodies)
+        for d in variant:
+            d.configs = mask
+        decls.extend(variant)
+    return decls
 
-        # In this template, "Inheritance" is redundant with "Generalization"; keep same for convenience.
-        inh = base
 
-        rows.append([kind, name, base, ifaces, comp, dep, assoc, inh, aggr])
+# Bump whenever the parsing/analysis rules change in a way that affects cached TypeDecl results.
+CACHE_VERSION = 7
+
+RELATION_FIELDS: Tuple[str, ...] = ("composition", "aggregation", "association", "dependency")
+
+
+def _parser_fingerprint() -> str:
+    """Cache namespace: explicit CACHE_VERSION plus a hash of this script, so edited rules never reuse stale results."""
+    try:
+        script_hash = hashlib.sha1(Path(__file__).read_bytes()).hexdigest()
+    except OSError:
+        script_hash = ""
+    return f"{CACHE_VERSION}:{script_hash}"
+
+
+def decl_to_json(d: TypeDecl) -> dict:
+    out = {
+        "kind": d.kind,
+        "name": d.name,
+        "base_class": d.base_class,
+        "interfaces": list(d.interfaces),
+    }
+    for rel in RELATION_FIELDS:
+        out[rel] = sorted(getattr(d, rel))
+    if d.namespace:
+        out["namespace"] = d.namespace
+    if d.usings:
+        out["usings"] = list(d.usings)
+    if d.aliases:
+        out["aliases"] = dict(d.aliases)
+    if d.body_refs:
+        out["body_refs"] = sorted(d.body_refs)
+    if d.configs:
+        out["configs"] = d.configs
+    return out
+
+
+def decl_from_json(data: dict) -> TypeDecl:
+    d = TypeDecl(
+        kind=data["kind"],
+        name=data["name"],
+        base_class=data.get("base_class"),
+        interfaces=list(data.get("interfaces", [])),
+        namespace=data.get("namespace", ""),
+        usings=list(data.get("usings", [])),
+        aliases=dict(data.get("aliases", {})),
+        body_refs=set(data.get("body_refs", [])),
+        configs=data.get("configs", 0),
+    )
+    for rel in RELATION_FIELDS:
+        setattr(d, rel, set(data.get(rel, [])))
+    return d
+
+
+@functools.lru_cache(maxsize=None)
+def _umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def replace_file(tmp: Path, path: Path) -> None:
+    """os.replace that leaves path with its previous permissions, or the umask default for a new file.
+
+    Without it the result would carry the temporary file's mode, which is owner-only for mkstemp.
+    """
+    try:
+        mode = stat.S_IMODE(path.stat().st_mode)
+    except OSError:
+        mode = 0o666 & ~_umask()
+    os.chmod(tmp, mode)
+    os.replace(tmp, path)
+
+
+def default_cache_path(output_path: Path) -> Path:
+    # Leading dot: Unity ignores hidden files, so the cache never gets imported as an asset.
+    return output_path.parent / f".{output_path.stem}.cache.json"
+
+
+def configs_key(configs: Sequence[FrozenSet[str]]) -> str:
+    """Identifies a --defines configuration list in cache entries and graph signatures ("" without one)."""
+    return json.dumps([sorted(c) for c in configs], separators=(",", ":")) if configs else ""
+
+
+class AnalysisCache:
+    """On-disk cache of analyze_file results, keyed by path and validated by size, mtime and content hash.
+
+    The file is one JSON document with one entry per line. Entries are held as their JSON text and
+    only parsed when looked up: the parsed form of a whole tree's results is several times larger and
+    would outweigh the savings of --compact.
+    """
+
+    def __init__(self, path: Optional[Path]) -> None:
+        self.path = path
+        self.fingerprint = _parser_fingerprint()
+        # path -> entry JSON text
+        self._entries: dict[str, str] = {}
+        self._fresh: dict[str, str] = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self._load()
+
+    def _header(self) -> str:
+        return f'{{"version":{json.dumps(self.fingerprint)},"files":{{\n'
+
+    def _load(self) -> None:
+        assert self.path is not None
+        decoder = json.JSONDecoder()
+        entries: dict[str, str] = {}
+        try:
+            with self.path.open(encoding="utf-8") as f:
+                if f.readline() != self._header():
+                    # Parser rules changed (or unknown format): start over.
+                    return
+                for line in f:
+                    if line.startswith("}}"):
+                        self._entries = entries
+                        return
+                    key, end = decoder.raw_decode(line)
+                    if not isinstance(key, str) or line[end : end + 1] != ":":
+                        return
+                    entries[key] = line[end + 1 :].rstrip().rstrip(",")
+        except (OSError, ValueError):
+            return
+
+    def lookup(
+        self, path: Path, scan_bodies: bool = False, configs: Sequence[FrozenSet[str]] = ()
+    ) -> Tuple[Optional[List[TypeDecl]], Optional[bytes], Optional[os.stat_result]]:
+        """Return (decls, data, stat). decls is None on a miss; data holds the bytes already read, if any.
+
+        An entry analyzed without scan_bodies cannot answer a scan_bodies lookup; the reverse is fine,
+        minus the body references it holds.
+        Entries only answer lookups for the configurations they were analyzed for.
+        """
+        key = str(path)
+        st = path.stat()
+        text = self._entries.get(key)
+        entry = None if text is None else json.loads(text)
+        defines = configs_key(configs)
+        if entry is None or (scan_bodies and not entry.get("bodies")) or entry.get("defines", "") != defines:
+            self.misses += 1
+            return None, None, st
+
+        if entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+            self._fresh[key] = text
+            self.hits += 1
+            return self._decls(entry, scan_bodies), None, st
+
+        # size/mtime changed: the content may still be identical (checkout, touch, re-save)
+        data = path.read_bytes()
+        if entry.get("size") == len(data) and entry.get("sha1") == hashlib.sha1(data).hexdigest():
+            entry = dict(entry, mtime_ns=st.st_mtime_ns)
+            self._fresh[key] = json.dumps(entry, separators=(",", ":"))
+            self.dirty = True
+            self.hits += 1
+            return self._decls(entry, scan_bodies), data, st
+
+        self.misses += 1
+        return None, data, st
+
+    @staticmethod
+    def _decls(entry: dict, scan_bodies: bool) -> List[TypeDecl]:
+        decls = [decl_from_json(d) for d in entry["decls"]]
+        if not scan_bodies:
+            for d in decls:
+                d.body_refs = set()
+        return decls
+
+    def store(
+        self,
+        path: Path,
+        size: int,
+        sha1: str,
+        st: os.stat_result,
+        decls: Sequence[TypeDecl],
+        scan_bodies: bool = False,
+        configs: Sequence[FrozenSet[str]] = (),
+    ) -> None:
+        if self.path is None:
+            return  # --no-cache: nothing will be saved, so do not hold a JSON copy of every result
+        entry = {
+            "size": size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha1": sha1,
+            "decls": [decl_to_json(d) for d in decls],
+        }
+        if scan_bodies:
+            entry["bodies"] = True
+        if configs:
+            entry["defines"] = configs_key(configs)
+        self._fresh[str(path)] = json.dumps(entry, separators=(",", ":"))
+        self.dirty = True
+
+    def save(self) -> None:
+        """Persist entries seen in this run; files that disappeared from --source are dropped."""
+        if self.path is None:
+            return
+        if not self.dirty and set(self._fresh) == set(self._entries):
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            f.write(self._header())
+            last = len(self._fresh) - 1
+            for n, (key, text) in enumerate(self._fresh.items()):
+                f.write(f"{json.dumps(key)}:{text}{',' if n < last else ''}\n")
+            f.write("}}\n")
+        replace_file(tmp, self.path)
+
+
+class Profiler:
+    """Wall time and call counts per phase, plus per-file timings for the slowest-files report."""
+
+    # Report order; phases not listed here are appended in first-seen order.
+    PHASES = (
+        "discovery",
+        "cache lookup",
+        "read",
+        "strip",
+        "preprocess",
+        "declaration scan",
+        "member parse",
+        "merge",
+        "output",
+    )
+
+    def __init__(self) -> None:
+        self.phases: dict[str, List[float]] = {}  # name -> [seconds, calls]
+        self.files: List[Tuple[float, str, int, int]] = []  # (seconds, path, size, type count)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float, calls: int = 1) -> None:
+        entry = self.phases.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += calls
+
+    def record_file(self, path: Path, seconds: float, size: int, types: int) -> None:
+        self.files.append((seconds, str(path), size, types))
+
+    def snapshot(self) -> dict:
+        """Picklable state, so worker processes can send their numbers back to the parent."""
+        return {"phases": self.phases, "files": self.files}
+
+    def absorb(self, snapshot: Optional[dict]) -> None:
+        if not snapshot:
+            return
+        for name, (seconds, calls) in snapshot["phases"].items():
+            self.add(name, seconds, calls)
+        self.files.extend(snapshot["files"])
+
+    def report(self, top: int = 10, workers: int = 1) -> List[str]:
+        lines = ["Profile (wall time per phase):"]
+        names = [n for n in self.PHASES if n in self.phases] + [n for n in self.phases if n not in self.PHASES]
+        for name in names:
+            seconds, calls = self.phases[name]
+            lines.append(f"  {name:<18}{seconds:>10.3f}s {calls:>8} call{'s' if calls != 1 else ''}")
+        if workers > 1:
+            lines.append(f"  (read/strip/scan/member phases are summed over {workers} worker processes)")
+        peak = peak_memory_bytes()
+        if peak is not None:
+            line = f"Peak memory (max RSS): {peak / (1024 * 1024):.1f} MB"
+            worker_peak = peak_memory_bytes(children=True)
+            if workers > 1 and worker_peak:
+                line += f", largest worker {worker_peak / (1024 * 1024):.1f} MB"
+            lines.append(line)
+        if self.files and top > 0:
+            lines.append(f"Slowest {min(top, len(self.files))} of {len(self.files)} analyzed files:")
+            for seconds, path, size, types in heapq.nlargest(top, self.files):
+                lines.append(f"  {seconds:>8.3f}s {size / 1024:>10.1f} KB {types:>5} types  {path}")
+        return lines
+
+
+class _NullProfiler(Profiler):
+    """Used when --profile is off: phase() costs one nullcontext, nothing is recorded."""
+
+    _NULL_CONTEXT = nullcontext()
+
+    def phase(self, name: str):  # type: ignore[override]
+        return self._NULL_CONTEXT
+
+    def add(self, name: str, seconds: float, calls: int = 1) -> None:
+        pass
+
+    def record_file(self, path: Path, seconds: float, size: int, types: int) -> None:
+        pass
+
+
+NULL_PROFILER: Profiler = _NullProfiler()
+
+
+def peak_memory_bytes(children: bool = False) -> Optional[int]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def blank_spans_in_place(buf, spans: Iterable[Tuple[int, int]]) -> None:
+    """Bytes counterpart of blank_spans for a writable buffer."""
+    for start, end in spans:
+        segment = buf[start:end]
+        if b"\n" not in segment:
+            buf[start:end] = b" " * len(segment)
+        else:
+            buf[start:end] = b"\n".join(b" " * len(part) for part in segment.split(b"\n"))
+
+
+def blank_literals_in_place(buf) -> None:
+    """Bytes counterpart of strip_comments_and_strings: blank comments/literals of a writable buffer in place."""
+    blank_spans_in_place(buf, iter_literal_spans(buf))
+
+
+def scan_declarations_mapped(buf) -> Tuple[List[DeclHeader], dict[int, int]]:
+    """scan_declarations over a blanked bytes buffer; only the matched header groups are decoded."""
+    headers = [
+        DeclHeader(
+            kind_raw=m.group("kind").decode("ascii"),
+            mods=(m.group("mods") or b"").decode("ascii"),
+            name=m.group("name").decode("ascii"),
+            bases=None if m.group("bases") is None else m.group("bases").decode("utf-8", errors="ignore"),
+            open_brace_index=m.end() - 1,
+        )
+        for m in TYPE_DECL_RE_BYTES.finditer(buf)
+    ]
+    brace_pairs = build_brace_index(buf)
+    link_type_scopes(headers, brace_pairs)
+    assign_scopes(buf, headers, brace_pairs)
+    return headers, brace_pairs
+
+
+def analyze_mapped(
+    path: Path, prof: Profiler = NULL_PROFILER, scan_bodies: bool = False, configs: Sequence[FrozenSet[str]] = ()
+) -> Tuple[List[TypeDecl], int, str]:
+    """analyze_file for big files: memory-map the file and scan the bytes in place.
+
+    The map is copy-on-write, so blanking literals never touches the file and only the pages that hold
+    comments or strings get private copies. No decoded copy of the whole file, the cleaned text or the
+    type bodies is made; only header groups and member declarations are decoded. A file with several
+    preprocessor variants is the exception: every variant but the last is blanked in a private copy.
+    """
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_COPY) as buf:
+        with prof.phase("read"):
+            size = len(buf)
+            sha1 = hashlib.sha1(buf).hexdigest()
+        with prof.phase("strip"):
+            blank_literals_in_place(buf)
+        variants = [(0, ())]
+        if configs:
+            with prof.phase("preprocess"):
+                variants = preprocessor_variants(buf, configs)
+        decls: List[TypeDecl] = []
+        for n, (mask, spans) in enumerate(variants, 1):
+            code = buf if n == len(variants) else bytearray(buf)
+            if spans:
+                with prof.phase("preprocess"):
+                    blank_spans_in_place(code, spans)
+            with prof.phase("declaration scan"):
+                headers, brace_pairs = scan_declarations_mapped(code)
+            with prof.phase("member parse"):
+                for header in headers:
+                    d = analyze_type(code, headers, header, brace_pairs, scan_bodies)
+                    d.configs = mask
+                    decls.append(d)
+    return decls, size, sha1
+
+
+# Files at least this big are scanned through analyze_mapped (overridable with --mmap-threshold).
+DEFAULT_MMAP_THRESHOLD = 1 << 20
+
+
+def analyze_path(
+    path: Path,
+    data: Optional[bytes] = None,
+    profile: bool = False,
+    mmap_threshold: Optional[int] = None,
+    scan_bodies: bool = False,
+    configs: Sequence[FrozenSet[str]] = (),
+) -> Tuple[List[TypeDecl], int, str, Optional[dict]]:
+    """Read (unless data is given), parse and analyze one file.
+
+    Files of mmap_threshold bytes or more that were not read yet go through analyze_mapped instead
+    (None disables it). Returns (decls, size, sha1, profile snapshot) so the caller can refresh the
+    cache without shipping the bytes back. Top-level so it can be used as a process pool task.
+    """
+    prof = Profiler() if profile else NULL_PROFILER
+    start = time.perf_counter()
+    if data is None and mmap_threshold is not None:
+        size = path.stat().st_size
+        # mmap cannot map an empty file
+        if size and size >= mmap_threshold:
+            decls, size, sha1 = analyze_mapped(path, prof, scan_bodies, configs)
+            if not profile:
+                return decls, size, sha1, None
+            prof.record_file(path, time.perf_counter() - start, size, len(decls))
+            return decls, size, sha1, prof.snapshot()
+    with prof.phase("read"):
+        if data is None:
+            data = path.read_bytes()
+        code = decode_source(data)
+    with prof.phase("strip"):
+        cleaned = strip_comments_and_strings(code)
+    decls = analyze_variants(path, cleaned, prof, scan_bodies, configs)
+    if not profile:
+        return decls, len(data), hashlib.sha1(data).hexdigest(), None
+    prof.record_file(path, time.perf_counter() - start, len(data), len(decls))
+    return decls, len(data), hashlib.sha1(data).hexdigest(), prof.snapshot()
+
+
+def analyze_pending(
+    pending: Sequence[Tuple[Path, Optional[bytes]]],
+    jobs: int,
+    profile: bool = False,
+    mmap_threshold: Optional[int] = None,
+    scan_bodies: bool = False,
+    configs: Sequence[FrozenSet[str]] = (),
+) -> Iterator[Tuple[List[TypeDecl], int, str, Optional[dict]]]:
+    """Analyze files serially or across a process pool; results are yielded in input order either way."""
+    if jobs <= 1 or len(pending) < 2:
+        for path, data in pending:
+            yield analyze_path(path, data, profile, mmap_threshold, scan_bodies, configs)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = min(jobs, len(pending))
+    chunksize = max(1, len(pending) // (workers * 4))
+    paths = [path for path, _ in pending]
+    datas = [data for _, data in pending]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(
+            analyze_path,
+            paths,
+            datas,
+            [profile] * len(paths),
+            [mmap_threshold] * len(paths),
+            [scan_bodies] * len(paths),
+            [configs] * len(paths),
+            chunksize=chunksize,
+        )
+
+
+def merge_decls(all_decls: Iterable[TypeDecl]) -> dict[str, TypeDecl]:
+    """Merge by type name in case multiple files/partials declare the same type (later files win on kind/base).
+
+    Pass resolved decls (resolve_decl) so same-named types from different namespaces stay apart.
+    """
+    merged: dict[str, TypeDecl] = {}
+    copied: Set[str] = set()
+    for d in all_decls:
+        if d.name not in merged:
+            merged[d.name] = d
+            continue
+        existing = merged[d.name]
+        if d.name not in copied:
+            # Never mutate the per-file results: they are cached and reused by watch mode.
+            existing = replace(
+                existing,
+                interfaces=list(existing.interfaces),
+                composition=set(existing.composition),
+                aggregation=set(existing.aggregation),
+                association=set(existing.association),
+                dependency=set(existing.dependency),
+                body_refs=set(existing.body_refs),
+            )
+            merged[d.name] = existing
+            copied.add(d.name)
+        # Prefer a more specific kind label if available
+        existing.kind = d.kind or existing.kind
+        existing.base_class = d.base_class or existing.base_class
+        existing.interfaces = sorted(set(existing.interfaces) | set(d.interfaces))
+        existing.composition |= d.composition
+        existing.aggregation |= d.aggregation
+        existing.association |= d.association
+        existing.dependency |= d.dependency
+        existing.body_refs |= d.body_refs
+    return merged
+
+
+SCOPE_MEMO_LIMIT = 4096
+
+
+class SymbolTable:
+    """Every declared type by fully qualified name (Namespace.Outer.Inner), built once per run.
+
+    References resolve roughly the way the C# compiler looks them up: using aliases first, then types
+    nested in the enclosing types and the enclosing namespaces from the innermost out, then the
+    namespaces imported by using directives. Every step is a dictionary lookup, memoized per scope.
+    """
+
+    def __init__(self, names: Iterable[str]) -> None:
+        self.names: Set[str] = set(names)
+        self._scopes: dict[tuple, dict[str, Optional[str]]] = {}
+
+    @classmethod
+    def from_decls(cls, decls: Iterable[TypeDecl]) -> "SymbolTable":
+        return cls(d.qualified_name for d in decls)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def resolve(self, name: str, scope: TypeDecl) -> Optional[str]:
+        """Qualified name of the declared type that name refers to inside scope, or None (external type)."""
+        key = (scope.qualified_name, tuple(scope.usings), tuple(sorted(scope.aliases.items())))
+        memo = self._scopes.get(key)
+        if memo is None:
+            if len(self._scopes) >= SCOPE_MEMO_LIMIT:
+                # Lookups from one scope come together (one type at a time): keep memory bounded on huge trees.
+                self._scopes.clear()
+            memo = self._scopes[key] = {}
+        if name not in memo:
+            memo[name] = self._lookup(name, scope)
+        return memo[name]
+
+    def _lookup(self, name: str, scope: TypeDecl) -> Optional[str]:
+        names = self.names
+        if name.startswith("global::"):
+            name = name[len("global::") :]
+            return name if name in names else None
+        head, dot, rest = name.partition(".")
+        alias = scope.aliases.get(head)
+        if alias is not None:
+            target = alias.split("<", 1)[0] + dot + rest
+            return target if target in names else None
+        # Namespace.Outer.Inner -> Namespace.Outer.Inner.X, Namespace.Outer.X, Namespace.X, X
+        prefix = scope.qualified_name
+        while prefix:
+            candidate = f"{prefix}.{name}"
+            if candidate in names:
+                return candidate
+            prefix = prefix.rpartition(".")[0]
+        if name in names:
+            return name
+        for using in scope.usings:
+            candidate = f"{using}.{name}"
+            if candidate in names:
+                return candidate
+        return None
+
+    def resolve_used(self, name: str, scope: TypeDecl) -> Optional[str]:
+        """Declared type a dotted name from code starts with: Foo.Instance.Bar -> Foo (or Ns.Foo), else None."""
+        while True:
+            resolved = self.resolve(name, scope)
+            if resolved is not None or "." not in name:
+                return resolved
+            name = name.rpartition(".")[0]
+
+    def resolve_written(self, written: str, scope: TypeDecl) -> str:
+        """A base-list entry as written (maybe generic) with its type name qualified when it resolves."""
+        base = written.split("<", 1)[0].strip()
+        resolved = self.resolve(base, scope)
+        if resolved is None:
+            return written
+        return resolved + written[len(written.split("<", 1)[0]) :]
+
+
+def resolve_decl(d: TypeDecl, symbols: SymbolTable) -> TypeDecl:
+    """Copy of d named by its qualified name, with every reference that resolves to a declared type
+    rewritten to that type's qualified name (external types keep the name as written)."""
+    own = d.qualified_name
+
+    def resolve_set(items: Set[str]) -> Set[str]:
+        out = {symbols.resolve(i, d) or i for i in items}
+        out.discard(own)
+        return out
+
+    return replace(
+        d,
+        name=own,
+        namespace="",
+        base_class=None if d.base_class is None else symbols.resolve_written(d.base_class, d),
+        interfaces=[symbols.resolve_written(i, d) for i in d.interfaces],
+        composition=resolve_set(d.composition),
+        aggregation=resolve_set(d.aggregation),
+        association=resolve_set(d.association),
+        dependency=resolve_set(d.dependency),
+        # body references are kept only when they name a declared type
+        body_refs={r for r in map(lambda ref: symbols.resolve_used(ref, d), d.body_refs) if r and r != own},
+    )
+
+
+@dataclass
+class RelationshipRow:
+    """One finalized output row; every output format is written from these."""
+
+    kind: str
+    name: str
+    generalization: str
+    realization: List[str]
+    composition: List[str]
+    dependency: List[str]
+    association: List[str]
+    aggregation: List[str]
+
+    def to_csv(self) -> List[str]:
+        # In this template, "Inheritance" is redundant with "Generalization"; keep same for convenience.
+        return [
+            self.kind,
+            self.name,
+            self.generalization,
+            "; ".join(self.realization),
+            "; ".join(self.composition),
+            "; ".join(self.dependency),
+            "; ".join(self.association),
+            self.generalization,
+            "; ".join(self.aggregation),
+        ]
+
+
+CSV_HEADER = [
+    "Kind",
+    "Class Name",
+    "Generalization",
+    "Realization/Implement",
+    "Composition",
+    "Dependency",
+    "Assocation",
+    "Inheritance",
+    "Aggregation",
+]
+
+
+def make_row(d: TypeDecl, known_type_names: Set[str], internal_only: bool = False) -> RelationshipRow:
+    def maybe_filter_to_known(items: Set[str]) -> Set[str]:
+        if not internal_only:
+            return items
+        return {i for i in items if i in known_type_names}
+
+    # Normalize relationship sets: drop primitives/containers again; optionally drop unknown symbols like "get" (rare)
+    def clean_set(items: Set[str]) -> List[str]:
+        cleaned = [
+            i
+            for i in items
+            if i not in CS_PRIMITIVES and i not in GENERIC_CONTAINERS and i not in CS_KEYWORDS
+        ]
+        return sorted(set(cleaned))
+
+    return RelationshipRow(
+        kind=d.kind,
+        name=d.name,
+        generalization=(d.base_class or "").strip(),
+        realization=sorted({i.strip() for i in d.interfaces if i.strip()}),
+        composition=clean_set(maybe_filter_to_known(d.composition)),
+        # names used in bodies are dependencies unless the type already holds them as a field/property
+        dependency=clean_set(
+            maybe_filter_to_known(d.dependency | (d.body_refs - d.composition - d.aggregation - d.association))
+        ),
+        association=clean_set(maybe_filter_to_known(d.association)),
+        aggregation=clean_set(maybe_filter_to_known(d.aggregation)),
+    )
+
+
+def iter_rows(
+    merged: dict[str, TypeDecl], known_type_names: Set[str], internal_only: bool = False
+) -> Iterable[RelationshipRow]:
+    """Yield output rows sorted by type name."""
+    for name in sorted(merged.keys()):
+        yield make_row(merged[name], known_type_names, internal_only)
+
+
+# In-process API for editor tooling and hooks: analyze unsaved buffers or git blobs without touching
+# the disk, then finalize into rows that any write_* function accepts (lambda: rows).
+SourceText = Tuple[Union[str, Path], Union[str, bytes]]
+
+
+def iter_type_decls(sources: Iterable[SourceText], scan_bodies: bool = False) -> Iterator[TypeDecl]:
+    """Lazily analyze (path, text) pairs; text is str or raw bytes (decoded like files on disk).
+
+    Yields each file's TypeDecls as soon as that file is parsed; path is only used for reporting.
+    """
+    for path, text in sources:
+        if isinstance(text, str):
+            code = text.replace("\r\n", "\n").replace("\r", "\n")
+        else:
+            code = decode_source(bytes(text))
+        parsed = scan_declarations(Path(path), strip_comments_and_strings(code))
+        yield from analyze_file(parsed, scan_bodies)
+
+
+def finalize(
+    decls: Iterable[TypeDecl], internal_only: bool = False, symbols: Optional[SymbolTable] = None
+) -> List[RelationshipRow]:
+    """Resolve, merge (partial types) and turn TypeDecls into output rows sorted by qualified name.
+
+    symbols defaults to a table of exactly the given declarations.
+    """
+    decls = list(decls)
+    if symbols is None:
+        symbols = SymbolTable.from_decls(decls)
+    merged = merge_decls(resolve_decl(d, symbols) for d in decls)
+    return list(iter_rows(merged, symbols.names, internal_only))
+
+
+# Compact mode (--compact) for very large trees: per-file results and finalized rows are kept as slotted
+# records of integer ids into one NameTable, with relationship sets as int arrays. Strings come back
+# only when a TypeDecl is needed for resolution or a row is written.
+class NameTable:
+    """Interns strings to dense int ids. Id 0 is reserved for "no name" (a missing base class)."""
+
+    __slots__ = ("ids", "names", "scope_ids", "scopes")
+
+    def __init__(self) -> None:
+        self.ids: dict[str, int] = {"": 0}
+        self.names: List[str] = [""]
+        # (namespace, usings, aliases) shared by every type declared in the same place
+        self.scope_ids: dict[tuple, int] = {}
+        self.scopes: List[tuple] = []
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def intern(self, name: str) -> int:
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def intern_all(self, names: Iterable[str]) -> "array[int]":
+        return array("I", map(self.intern, names))
+
+    def intern_scope(self, d: TypeDecl) -> int:
+        key = (d.namespace, tuple(d.usings), tuple(sorted(d.aliases.items())))
+        i = self.scope_ids.get(key)
+        if i is None:
+            i = self.scope_ids[key] = len(self.scopes)
+            self.scopes.append(key)
+        return i
+
+    def lookup(self, ids: Iterable[int]) -> List[str]:
+        names = self.names
+        return [names[i] for i in ids]
+
+
+class CompactDecl:
+    """A TypeDecl as ids into a NameTable; relationship sets are sorted id arrays."""
+
+    __slots__ = (
+        "kind",
+        "name",
+        "qualified",
+        "scope",
+        "base_class",
+        "interfaces",
+        "body_refs",
+        "configs",
+    ) + RELATION_FIELDS
+
+    @classmethod
+    def pack(cls, d: TypeDecl, table: NameTable) -> "CompactDecl":
+        c = cls.__new__(cls)
+        c.kind = table.intern(d.kind)
+        c.name = table.intern(d.name)
+        c.qualified = table.intern(d.qualified_name)
+        c.scope = table.intern_scope(d)
+        c.base_class = 0 if d.base_class is None else table.intern(d.base_class)
+        c.interfaces = table.intern_all(d.interfaces)
+        c.configs = d.configs
+        for rel in RELATION_FIELDS + ("body_refs",):
+            setattr(c, rel, array("I", sorted(map(table.intern, getattr(d, rel)))))
+        return c
+
+    def unpack(self, table: NameTable) -> TypeDecl:
+        names = table.names
+        namespace, usings, aliases = table.scopes[self.scope]
+        d = TypeDecl(
+            kind=names[self.kind],
+            name=names[self.name],
+            base_class=names[self.base_class] if self.base_class else None,
+            interfaces=table.lookup(self.interfaces),
+            namespace=namespace,
+            usings=list(usings),
+            aliases=dict(aliases),
+            configs=self.configs,
+        )
+        for rel in RELATION_FIELDS + ("body_refs",):
+            setattr(d, rel, set(table.lookup(getattr(self, rel))))
+        return d
+
+
+ROW_LIST_FIELDS: Tuple[str, ...] = ("realization", "composition", "dependency", "association", "aggregation")
+
+
+class CompactRow:
+    """A RelationshipRow as ids into a NameTable; list columns keep the row's (sorted by name) order."""
+
+    __slots__ = ("kind", "name", "generalization") + ROW_LIST_FIELDS
+
+    @classmethod
+    def pack(cls, row: RelationshipRow, table: NameTable) -> "CompactRow":
+        c = cls.__new__(cls)
+        c.kind = table.intern(row.kind)
+        c.name = table.intern(row.name)
+        c.generalization = table.intern(row.generalization)
+        for col in ROW_LIST_FIELDS:
+            setattr(c, col, table.intern_all(getattr(row, col)))
+        return c
+
+    def unpack(self, table: NameTable) -> RelationshipRow:
+        names = table.names
+        return RelationshipRow(
+            names[self.kind],
+            names[self.name],
+            names[self.generalization],
+            *(table.lookup(getattr(self, col)) for col in ROW_LIST_FIELDS),
+        )
+
+
+# Edge kinds in the order diagrams list them, with (Mermaid/PlantUML arrow, Graphviz edge attributes).
+# The row's own type is always on the left: "Derived --|> Base", "Whole *-- Part".
+DIAGRAM_EDGES: Tuple[Tuple[str, str, str], ...] = (
+    ("generalization", "--|>", "arrowhead=empty"),
+    ("realization", "..|>", "arrowhead=empty, style=dashed"),
+    ("composition", "*--", "dir=back, arrowtail=diamond"),
+    ("aggregation", "o--", "dir=back, arrowtail=odiamond"),
+    ("association", "-->", "arrowhead=vee"),
+    ("dependency", "..>", "arrowhead=vee, style=dashed"),
+)
+
+EDGE_KINDS: Tuple[str, ...] = tuple(kind for kind, _, _ in DIAGRAM_EDGES)
+
+DIAGRAM_STEREOTYPES = {
+    "interface": "interface",
+    "enum": "enumeration",
+    "abstract class": "abstract",
+    "static class": "static",
+    "sealed class": "sealed",
+    "struct": "struct",
+}
+
+
+def _row_edges(row: RelationshipRow) -> Iterable[Tuple[str, str]]:
+    """(edge kind, target) pairs of a row in DIAGRAM_EDGES order."""
+    for edge_kind, _, _ in DIAGRAM_EDGES:
+        targets = getattr(row, edge_kind)
+        if isinstance(targets, str):
+            targets = [targets] if targets else []
+        for target in targets:
+            yield edge_kind, target
+
+
+DIAGRAM_ID_RE = re.compile(r"\W")
+
+
+def diagram_id(name: str) -> str:
+    """Identifier safe for Mermaid/PlantUML (Outer.Inner -> Outer_Inner, Preference<bool> -> Preference_bool_)."""
+    return DIAGRAM_ID_RE.sub("_", name)
+
+
+# Zero-arg callable that yields the rows afresh; diagram writers take two cheap passes
+# (declarations, then edges) instead of buffering the graph.
+RowSource = Callable[[], Iterable[RelationshipRow]]
+
+
+def write_csv(rows: RowSource, out: TextIO) -> int:
+    writer = csv.writer(out)
+    writer.writerow(CSV_HEADER)
+    count = 0
+    for row in rows():
+        writer.writerow(row.to_csv())
+        count += 1
+    return count
+
+
+def write_jsonl(rows: RowSource, out: TextIO) -> int:
+    count = 0
+    for row in rows():
+        out.write(json.dumps(asdict(row), ensure_ascii=False))
+        out.write("\n")
+        count += 1
+    return count
+
+
+def _edge_arrow(edge_kind: str) -> str:
+    return next(arrow for kind, arrow, _ in DIAGRAM_EDGES if kind == edge_kind)
+
+
+def write_mermaid(rows: RowSource, out: TextIO) -> int:
+    out.write("classDiagram\n")
+    declared: Set[str] = set()
+
+    def declare(name: str) -> str:
+        node = diagram_id(name)
+        if node not in declared:
+            declared.add(node)
+            label = "" if node == name else f'["{name}"]'
+            out.write(f"    class {node}{label}\n")
+        return node
+
+    count = 0
+    for row in rows():
+        node = declare(row.name)
+        stereotype = DIAGRAM_STEREOTYPES.get(row.kind)
+        if stereotype:
+            out.write(f"    <<{stereotype}>> {node}\n")
+        count += 1
+    for row in rows():
+        src = diagram_id(row.name)
+        for edge_kind, target in _row_edges(row):
+            out.write(f"    {src} {_edge_arrow(edge_kind)} {declare(target)}\n")
+    return count
+
+
+PLANTUML_KEYWORDS = {"interface": "interface", "enum": "enum", "abstract class": "abstract class", "struct": "struct"}
+
+
+def write_plantuml(rows: RowSource, out: TextIO) -> int:
+    out.write("@startuml\n")
+    declared: Set[str] = set()
+
+    def declare(name: str, kind: str = "class") -> str:
+        node = diagram_id(name)
+        if node not in declared:
+            declared.add(node)
+            keyword = PLANTUML_KEYWORDS.get(kind, "class")
+            stereotype = f" <<{kind.split()[0]}>>" if kind in ("static class", "sealed class") else ""
+            out.write(f'{keyword} "{name}" as {node}{stereotype}\n')
+        return node
+
+    count = 0
+    for row in rows():
+        declare(row.name, row.kind)
+        count += 1
+    for row in rows():
+        src = diagram_id(row.name)
+        for edge_kind, target in _row_edges(row):
+            out.write(f"{src} {_edge_arrow(edge_kind)} {declare(target)}\n")
+    out.write("@enduml\n")
+    return count
+
+
+def _dot_quote(value: str) -> str:
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{escaped}"'
+
+
+def write_dot(rows: RowSource, out: TextIO) -> int:
+    out.write("digraph ClassRelationship {\n")
+    out.write("    rankdir=BT;\n")
+    out.write("    node [shape=box, fontname=Helvetica];\n")
+    count = 0
+    for row in rows():
+        src = _dot_quote(row.name)
+        stereotype = DIAGRAM_STEREOTYPES.get(row.kind)
+        label = f"«{stereotype}»\n{row.name}" if stereotype else row.name
+        out.write(f"    {src} [label={_dot_quote(label)}];\n")
+        for edge_kind, target in _row_edges(row):
+            attrs = next(a for k, _, a in DIAGRAM_EDGES if k == edge_kind)
+            out.write(f"    {src} -> {_dot_quote(target)} [{attrs}];\n")
+        count += 1
+    out.write("}\n")
+    return count
+
+
+METRICS_HEADER = ["Class Name", "Kind", "Fan-In", "Fan-Out", "Instability", "Cycle", "Cycle Size", "Layer"]
+
+
+def write_metrics(rows: RowSource, out: TextIO) -> int:
+    """Coupling report: one row per declared type with the metrics computed by graph_metrics."""
+    w = csv.writer(out)
+    w.writerow(METRICS_HEADER)
+    metrics = graph_metrics(RelationshipGraph.from_rows(rows()))
+    for m in metrics:
+        w.writerow(
+            [m.name, m.kind, m.fan_in, m.fan_out, f"{m.instability:.2f}", m.cycle, m.cycle_size or "", m.layer]
+        )
+    return len(metrics)
+
+
+# format name -> (file extension, writer)
+OUTPUT_FORMATS: dict[str, Tuple[str, Callable[[RowSource, TextIO], int]]] = {
+    "csv": (".csv", write_csv),
+    "jsonl": (".jsonl", write_jsonl),
+    "mermaid": (".mmd", write_mermaid),
+    "plantuml": (".puml", write_plantuml),
+    "dot": (".dot", write_dot),
+    "metrics": (".metrics.csv", write_metrics),
+}
+
+
+def parse_formats(value: str) -> List[str]:
+    formats = [f.strip().lower() for f in value.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in OUTPUT_FORMATS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(
+            f"unknown format(s): {', '.join(unknown) or value!r}; choose from {', '.join(OUTPUT_FORMATS)}"
+        )
+    return list(dict.fromkeys(formats))
+
+
+def output_path_for(output_path: Path, fmt: str) -> Path:
+    """CSV goes to --output itself; other formats sit next to it with their own extension."""
+    ext = OUTPUT_FORMATS[fmt][0]
+    return output_path if fmt == "csv" else output_path.with_suffix(ext)
+
+
+def write_outputs(
+    rows: RowSource, output_path: Path, formats: Sequence[str], replace_changed: bool = True
+) -> List[Tuple[str, Path, int, bool]]:
+    """Stream the merged model into every requested format; rows are regenerated on demand, never buffered.
+
+    Each format is rendered to a hidden temporary file next to its output and only moved over the output
+    when the bytes differ, so unchanged files keep their mtime (no Unity reimport). Returns
+    (format, path, rows written, changed); with replace_changed=False nothing is replaced (--check).
+    """
+    written = []
+    for fmt in formats:
+        path = output_path_for(output_path, fmt)
+        writer = OUTPUT_FORMATS[fmt][1]
+        count, changed = write_if_changed(path, lambda f: writer(rows, f), replace_changed)
+        written.append((fmt, path, count, changed))
+    return written
+
+
+def write_if_changed(path: Path, render: Callable[[TextIO], int], replace_changed: bool = True) -> Tuple[int, bool]:
+    """Render to a temporary file and move it over path only if the bytes differ; returns (count, changed)."""
+    if replace_changed:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    # Dot-prefixed so Unity ignores it even for the moment it exists.
+    tmp_dir = path.parent if path.parent.is_dir() else None
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=tmp_dir)
+    tmp = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "w", newline="", encoding="utf-8") as f:
+            count = render(f)
+        changed = not (path.is_file() and filecmp.cmp(tmp, path, shallow=False))
+        if changed and replace_changed:
+            replace_file(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return count, changed
+
+
+def read_csv_rows(path: Path) -> Optional[dict[str, List[str]]]:
+    """Rows of an existing CSV output keyed by class name, or None if it is missing or has another header."""
+    try:
+        with path.open(newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            if next(reader, None) != CSV_HEADER:
+                return None
+            return {row[1]: row for row in reader if len(row) > 1}
+    except (OSError, UnicodeDecodeError, csv.Error):
+        return None
+
+
+def diff_csv_rows(old: dict[str, List[str]], rows: Iterable[RelationshipRow]) -> List[str]:
+    """Human-readable relationship deltas between an existing CSV and the model, one line per change."""
+    lines: List[str] = []
+    new_names: Set[str] = set()
+    for row in rows:
+        new_names.add(row.name)
+        cells = row.to_csv()
+        before = old.get(row.name)
+        if before is None:
+            lines.append(f"+ {row.name} ({row.kind})")
+            continue
+        for column, old_cell, new_cell in zip(CSV_HEADER, before, cells):
+            if old_cell == new_cell:
+                continue
+            old_items = {i for i in old_cell.split("; ") if i}
+            new_items = {i for i in new_cell.split("; ") if i}
+            delta = [f"+{i}" for i in sorted(new_items - old_items)] + [f"-{i}" for i in sorted(old_items - new_items)]
+            lines.append(f"~ {row.name}: {column}: {' '.join(delta) or repr(old_cell) + ' -> ' + repr(new_cell)}")
+    lines.extend(f"- {name}" for name in sorted(set(old) - new_names))
+    return lines
+
+
+def graph_key(name: str) -> str:
+    """Node key of a type reference: the name without generic arguments or a global:: prefix."""
+    return name.replace("global::", "").split("<", 1)[0].strip()
+
+
+class RelationshipGraph:
+    """Forward and reverse adjacency for every edge kind, built from the finalized rows."""
+
+    def __init__(self) -> None:
+        # declared type name -> kind label
+        self.kinds: dict[str, str] = {}
+        # edge kind -> source type name -> targets as written in the row
+        self.edges: dict[str, dict[str, Set[str]]] = {kind: {} for kind in EDGE_KINDS}
+        # edge kind -> graph_key -> names as written; built by _index
+        self.forward: dict[str, dict[str, Set[str]]] = {}
+        self.reverse: dict[str, dict[str, Set[str]]] = {}
+        # keys of the declared types, then also of unresolved targets
+        self.declared_keys: Set[str] = set()
+        self.node_keys: Set[str] = set()
+        # every dotted suffix of a node key (NS.Outer.Inner -> Outer.Inner, Inner) -> node keys
+        self.suffixes: dict[str, Set[str]] = {}
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[RelationshipRow]) -> "RelationshipGraph":
+        graph = cls()
+        for row in rows:
+            graph.kinds[row.name] = row.kind
+            for edge_kind, target in _row_edges(row):
+                graph.edges[edge_kind].setdefault(row.name, set()).add(target)
+        graph._index()
+        return graph
+
+    def _index(self) -> None:
+        self.forward = {kind: {} for kind in EDGE_KINDS}
+        self.reverse = {kind: {} for kind in EDGE_KINDS}
+        self.declared_keys = {graph_key(name) for name in self.kinds}
+        self.node_keys = set(self.declared_keys)
+        for edge_kind, by_source in self.edges.items():
+            forward = self.forward[edge_kind]
+            reverse = self.reverse[edge_kind]
+            for source, targets in by_source.items():
+                forward.setdefault(graph_key(source), set()).update(targets)
+                for target in targets:
+                    reverse.setdefault(graph_key(target), set()).add(source)
+            self.node_keys.update(reverse)
+        self.suffixes = {}
+        for key in self.node_keys:
+            parts = key.split(".")
+            for i in range(len(parts)):
+                self.suffixes.setdefault(".".join(parts[i:]), set()).add(key)
+
+    def keys_for(self, name: str) -> Set[str]:
+        """Nodes a query name stands for: a declared type's exact (qualified) name, else every node it is
+        a suffix of. An unresolved reference written as the bare name is one of those nodes, so it
+        does not hide the declared Game.Weapon from a query for Weapon.
+        """
+        key = graph_key(name)
+        if key in self.declared_keys:
+            return {key}
+        return self.suffixes.get(key, set())
+
+    def __contains__(self, name: str) -> bool:
+        return bool(self.keys_for(name))
+
+    def neighbors(self, name: str, edge_kinds: Sequence[str], reverse: bool = False) -> List[Tuple[str, str]]:
+        """Sorted (edge kind, type) pairs one step from name; reverse follows edges backwards."""
+        indexes = self.reverse if reverse else self.forward
+        keys = self.keys_for(name)
+        return sorted({(kind, other) for kind in edge_kinds for key in keys for other in indexes[kind].get(key, ())})
+
+    def walk(self, name: str, edge_kinds: Sequence[str], reverse: bool = False) -> List[Tuple[int, str, str]]:
+        """Breadth-first transitive closure from name: (depth, edge kind, type), each type listed once."""
+        seen = set(self.keys_for(name))
+        found: List[Tuple[int, str, str]] = []
+        frontier = [name]
+        depth = 0
+        while frontier:
+            depth += 1
+            next_frontier: List[str] = []
+            for current in frontier:
+                for kind, other in self.neighbors(current, edge_kinds, reverse):
+                    key = graph_key(other)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    found.append((depth, kind, other))
+                    next_frontier.append(other)
+            frontier = next_frontier
+        return found
+
+    def to_json(self) -> dict:
+        return {
+            "kinds": self.kinds,
+            "edges": {kind: {src: sorted(dst) for src, dst in by_source.items()} for kind, by_source in self.edges.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "RelationshipGraph":
+        graph = cls()
+        graph.kinds = dict(data["kinds"])
+        for kind in EDGE_KINDS:
+            graph.edges[kind] = {src: set(dst) for src, dst in data["edges"].get(kind, {}).items()}
+        graph._index()
+        return graph
+
+
+@dataclass
+class TypeMetrics:
+    """Coupling metrics of one declared type, over the graph of declared types only (all edge kinds)."""
+
+    name: str
+    kind: str
+    fan_in: int  # declared types that reference this one
+    fan_out: int  # declared types this one references
+    instability: float  # fan_out / (fan_in + fan_out); 0 for an isolated type
+    # Types in the same dependency cycle (strongly connected component) share its smallest name;
+    # "" and 0 when the type is in no cycle
+    cycle: str
+    cycle_size: int
+    layer: int  # 0 = references no other declared type, else 1 + the highest layer it references
+
+
+def strongly_connected_components(nodes: Sequence[str], successors: dict[str, Set[str]]) -> List[List[str]]:
+    """Tarjan's algorithm, iterative so long dependency chains cannot hit the recursion limit.
+
+    Components come out in reverse topological order: each one after every component it reaches.
+    """
+    index: dict[str, int] = {}
+    low: dict[str, int] = {}
+    stack: List[str] = []
+    on_stack: Set[str] = set()
+    components: List[List[str]] = []
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors.get(root, ())))]
+        while work:
+            node, pending = work[-1]
+            for succ in pending:
+                if succ not in index:
+                    index[succ] = low[succ] = len(index)
+                    stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(successors.get(succ, ()))))
+                    break
+                if succ in on_stack:
+                    low[node] = min(low[node], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component: List[str] = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+
+def graph_metrics(graph: RelationshipGraph) -> List[TypeMetrics]:
+    """Fan-in/fan-out, instability, dependency cycles and layering of every declared type, sorted by name.
+
+    Linear in types + edges: edges to external types are dropped, Tarjan finds the cycles, and layers
+    are assigned over the acyclic condensation in the order Tarjan emits it.
+    """
+    names = sorted(graph.kinds)
+    by_key = {graph_key(name): name for name in names}
+    successors: dict[str, Set[str]] = {name: set() for name in names}
+    for by_source in graph.edges.values():
+        for source, targets in by_source.items():
+            out = successors[source]
+            for target in targets:
+                other = by_key.get(graph_key(target))
+                if other is not None and other != source:
+                    out.add(other)
+    fan_in: dict[str, int] = dict.fromkeys(names, 0)
+    for targets in successors.values():
+        for target in targets:
+            fan_in[target] += 1
+
+    component_of: dict[str, int] = {}
+    layers: List[int] = []
+    labels: List[Tuple[str, int]] = []
+    for ci, component in enumerate(strongly_connected_components(names, successors)):
+        for name in component:
+            component_of[name] = ci
+        layer = 0
+        for name in component:
+            for target in successors[name]:
+                other = component_of[target]
+                if other != ci:
+                    layer = max(layer, layers[other] + 1)
+        layers.append(layer)
+        labels.append((min(component), len(component)) if len(component) > 1 else ("", 0))
+
+    metrics: List[TypeMetrics] = []
+    for name in names:
+        fan_out = len(successors[name])
+        total = fan_in[name] + fan_out
+        ci = component_of[name]
+        cycle, cycle_size = labels[ci]
+        metrics.append(
+            TypeMetrics(
+                name=name,
+                kind=graph.kinds[name],
+                fan_in=fan_in[name],
+                fan_out=fan_out,
+                instability=fan_out / total if total else 0.0,
+                cycle=cycle,
+                cycle_size=cycle_size,
+                layer=layers[ci],
+            )
+        )
+    return metrics
+
+
+def default_graph_path(output_path: Path) -> Path:
+    # Hidden (dot-prefixed) so Unity does not import it or create a .meta file for it.
+    return output_path.with_name(f".{output_path.stem}.graph.json")
+
+
+def graph_signature(
+    sources: "SourceSet", cs_files: Sequence[Path], internal_only: bool, scan_bodies: bool = False, defines: str = ""
+) -> str:
+    """Identifies the inputs a graph was built from: parser rules, options and every file's size/mtime."""
+    h = hashlib.sha1()
+    h.update(f"{_parser_fingerprint()}\0{sources.describe()}\0{internal_only}\0{scan_bodies}\0{defines}\n".encode())
+    for f in cs_files:
+        st = f.stat()
+        h.update(f"{f}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def save_graph(path: Path, rows: RowSource, signature: str) -> None:
+    """Write RelationshipGraph.to_json of rows without building the graph: one pass for the kinds,
+    then one per edge kind, each entry dumped as it is reached.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    dump = functools.partial(json.dumps, separators=(",", ":"))
+    with tmp.open("w", encoding="utf-8") as f:
+        f.write('{"signature":%s,"graph":{"kinds":{' % dump(signature))
+        f.write(",".join("%s:%s" % (dump(row.name), dump(row.kind)) for row in rows()))
+        f.write('},"edges":{')
+        for i, edge_kind in enumerate(EDGE_KINDS):
+            f.write('%s%s:{' % ("," if i else "", dump(edge_kind)))
+            sep = ""
+            for row in rows():
+                targets = sorted({target for kind, target in _row_edges(row) if kind == edge_kind})
+                if targets:
+                    f.write("%s%s:%s" % (sep, dump(row.name), dump(targets)))
+                    sep = ","
+            f.write("}")
+        f.write("}}}")
+    replace_file(tmp, path)
+
+
+def load_graph(path: Path, signature: str) -> Optional[RelationshipGraph]:
+    """The cached graph, or None if it is missing, unreadable or was built from different inputs."""
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if data.get("signature") != signature:
+            return None
+        return RelationshipGraph.from_json(data["graph"])
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+# Pruned unless --no-default-excludes: Unity's generated folders directly under a --source root (the
+# project root), so a script folder like Assets/Scripts/Logs is still scanned, plus hidden (.git, .vs)
+# and "~" folders (Samples~, Documentation~) at any depth, which Unity itself never imports.
+DEFAULT_EXCLUDES: Tuple[str, ...] = ("/Library", "/Temp", "/Logs", "/obj", "/UserSettings", ".*", "*~")
+DEFAULT_INCLUDES: Tuple[str, ...] = ("*.cs",)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_glob(pattern: str) -> "re.Pattern[str]":
+    """Translate a glob to a regex over '/'-separated paths: * and ? stay within a segment, ** spans them."""
+    out: List[str] = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        c = pattern[i]
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[" and pattern.find("]", i + 2) != -1:
+            end = pattern.find("]", i + 2)
+            body = pattern[i + 1 : end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append("[" + body.replace("\\", "\\\\") + "]")
+            i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile("".join(out))
+
+
+class GlobSet:
+    """--include/--exclude patterns. Patterns with a '/' match the path relative to its source root; the
+    others match a single file or directory name at any depth (like .gitignore)."""
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        self.patterns = tuple(patterns)
+        self._by_name = [compile_glob(p) for p in self.patterns if "/" not in p]
+        self._by_path = [compile_glob(p.lstrip("/")) for p in self.patterns if "/" in p]
+
+    def match(self, rel: str, name: str) -> bool:
+        return any(r.fullmatch(name) for r in self._by_name) or any(r.fullmatch(rel) for r in self._by_path)
+
+
+@dataclass(frozen=True)
+class IgnoreRule:
+    """One .gitignore line; base is the absolute '/'-separated directory of its file, with a trailing '/'."""
+
+    base: str
+    regex: "re.Pattern[str]"
+    negate: bool
+    dir_only: bool
+    anchored: bool
+
+
+def read_gitignore(directory: str) -> List[IgnoreRule]:
+    """Rules of directory/.gitignore (none if it has no such file). Supports !, trailing /, anchoring and **."""
+    try:
+        with open(os.path.join(directory, ".gitignore"), encoding="utf-8", errors="ignore") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    base = directory.replace(os.sep, "/").rstrip("/") + "/"
+    rules: List[IgnoreRule] = []
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith(("\\#", "\\!")):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+        anchored = "/" in line
+        rules.append(IgnoreRule(base, compile_glob(line.lstrip("/")), negate, dir_only, anchored))
+    return rules
+
+
+def is_ignored(rules: Sequence[IgnoreRule], abs_path: str, is_dir: bool) -> bool:
+    """Git semantics: the last matching rule decides, and a '!' rule re-includes."""
+    ignored = False
+    for rule in rules:
+        if rule.dir_only and not is_dir or not abs_path.startswith(rule.base):
+            continue
+        sub = abs_path[len(rule.base) :]
+        if rule.regex.fullmatch(sub if rule.anchored else sub.rsplit("/", 1)[-1]):
+            ignored = not rule.negate
+    return ignored
+
+
+def _posix_abspath(path) -> str:
+    return os.path.abspath(path).replace(os.sep, "/")
+
+
+class SourceSet:
+    """The .cs files to analyze: several roots, include/exclude globs and .gitignore files.
+
+    Discovery is an os.scandir walk that drops excluded and ignored directories before descending, so
+    pointing --source at the project root does not list Library, Temp or .git.
+    """
+
+    def __init__(
+        self,
+        roots: Sequence[Path],
+        include: Sequence[str] = DEFAULT_INCLUDES,
+        exclude: Sequence[str] = DEFAULT_EXCLUDES,
+        use_gitignore: bool = True,
+    ) -> None:
+        self.roots = list(dict.fromkeys(roots))
+        self.include = GlobSet(include)
+        self.exclude = GlobSet(exclude)
+        self.use_gitignore = use_gitignore
+
+    def describe(self) -> str:
+        roots = ",".join(_posix_abspath(r) for r in self.roots)
+        return f"{roots}|{self.include.patterns}|{self.exclude.patterns}|{self.use_gitignore}"
+
+    def discover(self) -> List[Path]:
+        """Every matching file under the roots, sorted (the order the rest of the pipeline relies on)."""
+        found: Set[str] = set()
+        for root in self.roots:
+            for _, files in self.walk(root):
+                found.update(files)
+        return sorted(Path(f) for f in found)
+
+    def _root_rules(self, root_abs: str) -> Tuple[IgnoreRule, ...]:
+        """.gitignore rules from the directories above root, up to the enclosing git work tree."""
+        if not self.use_gitignore:
+            return ()
+        ancestors: List[str] = []
+        directory = os.path.dirname(root_abs)
+        while True:
+            ancestors.append(directory)
+            if os.path.exists(os.path.join(directory, ".git")):
+                break
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                # not inside a git work tree: only .gitignore files at or below the root apply
+                return ()
+            directory = parent
+        rules: List[IgnoreRule] = []
+        for directory in reversed(ancestors):
+            rules.extend(read_gitignore(directory))
+        return tuple(rules)
+
+    def _start(self, directory: Path) -> Optional[Tuple[str, str, str, Tuple[IgnoreRule, ...]]]:
+        """Walk state for a directory at or below one of the roots; None if it is outside or pruned."""
+        for root in self.roots:
+            if directory != root and root not in directory.parents:
+                continue
+            root_abs = _posix_abspath(root)
+            rules = self._root_rules(root_abs)
+            abs_dir = root_abs
+            rel = ""
+            for part in directory.relative_to(root).parts:
+                if self.use_gitignore:
+                    rules += tuple(read_gitignore(abs_dir))
+                abs_dir = f"{abs_dir}/{part}"
+                rel += part
+                if self.exclude.match(rel, part) or (rules and is_ignored(rules, abs_dir, True)):
+                    return None
+                rel += "/"
+            return str(directory), abs_dir, rel, rules
+        return None
+
+    def accepts(self, path: Path) -> bool:
+        """Whether discover() would list path (used for paths reported by the watchers)."""
+        start = self._start(path.parent)
+        if start is None:
+            return False
+        _, abs_dir, rel, rules = start
+        if self.use_gitignore:
+            rules += tuple(read_gitignore(abs_dir))
+        rel += path.name
+        return (
+            self.include.match(rel, path.name)
+            and not self.exclude.match(rel, path.name)
+            and not (rules and is_ignored(rules, f"{abs_dir}/{path.name}", False))
+        )
+
+    def walk(self, directory: Path) -> Iterator[Tuple[str, List[str]]]:
+        """Yield (directory, matching files) for directory and every directory below it that is not pruned."""
+        start = self._start(directory)
+        if start is None:
+            return
+        seen_links: Set[Tuple[int, int]] = set()
+        stack = [start]
+        while stack:
+            path, abs_dir, rel, rules = stack.pop()
+            if self.use_gitignore:
+                local = read_gitignore(abs_dir)
+                if local:
+                    rules += tuple(local)
+            files: List[str] = []
+            subdirs = []
+            try:
+                entries = os.scandir(path)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    name = entry.name
+                    child_rel = rel + name
+                    child_abs = f"{abs_dir}/{name}"
+                    try:
+                        is_dir = entry.is_dir()
+                        if is_dir and entry.is_symlink():
+                            # follow directory links, but only once (they may form a loop)
+                            st = entry.stat()
+                            if (st.st_dev, st.st_ino) in seen_links:
+                                continue
+                            seen_links.add((st.st_dev, st.st_ino))
+                        elif not is_dir and not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    if self.exclude.match(child_rel, name) or (rules and is_ignored(rules, child_abs, is_dir)):
+                        continue
+                    if is_dir:
+                        subdirs.append((entry.path, child_abs, child_rel + "/", rules))
+                    elif self.include.match(child_rel, name):
+                        files.append(entry.path)
+            yield path, files
+            stack.extend(reversed(subdirs))
+
+
+def discover_sources(source_dir: Path) -> List[Path]:
+    return SourceSet([source_dir]).discover()
+
+
+def load_decls(
+    cs_files: Sequence[Path],
+    cache: Union[AnalysisCache, "PartitionedCache"],
+    jobs: int = 1,
+    profiler: Profiler = NULL_PROFILER,
+    mmap_threshold: Optional[int] = DEFAULT_MMAP_THRESHOLD,
+    pack: Optional[Callable[[List[TypeDecl]], list]] = None,
+    scan_bodies: bool = False,
+    configs: Sequence[FrozenSet[str]] = (),
+) -> list:
+    """Per-file TypeDecls in cs_files order: unchanged files come from the cache, the rest are analyzed.
+
+    pack, if given, converts each file's decls as soon as they are available (compact mode), so the
+    full TypeDecls of the whole tree are never held at once.
+    """
+    per_file: list = []
+    pending: List[Tuple[Path, Optional[bytes]]] = []
+    pending_meta: List[Tuple[int, os.stat_result]] = []
+    for f in cs_files:
+        with profiler.phase("cache lookup"):
+            cached, data, st = cache.lookup(f, scan_bodies, configs)
+        if cached is not None:
+            per_file.append(pack(cached) if pack else cached)
+            continue
+        pending_meta.append((len(per_file), st))
+        pending.append((f, data))
+        per_file.append(None)
+
+    results = analyze_pending(
+        pending,
+        jobs,
+        profile=profiler is not NULL_PROFILER,
+        mmap_threshold=mmap_threshold,
+        scan_bodies=scan_bodies,
+        configs=configs,
+    )
+    for (idx, st), (path, _), (decls, size, sha1, stats) in zip(pending_meta, pending, results):
+        cache.store(path, size, sha1, st, decls, scan_bodies, configs)
+        profiler.absorb(stats)
+        per_file[idx] = pack(decls) if pack else decls
+    with profiler.phase("cache lookup"):
+        cache.save()
+    return [decls or [] for decls in per_file]
+
+
+class ProjectModel:
+    """Per-file analysis results plus the finalized rows, kept in memory so changes can be applied incrementally.
+
+    With compact=True both are stored as CompactDecl/CompactRow records over one NameTable; read rows
+    through row() or row_source() rather than from rows directly. assemblies, if given, is the
+    AssemblyMap the cache is partitioned by and the assembly graph is drawn from. With --defines
+    configurations the rows are the union over all of them; configuration_rows() gives one alone.
+    """
+
+    def __init__(
+        self,
+        cache: Union[AnalysisCache, "PartitionedCache"],
+        jobs: int = 1,
+        internal_only: bool = False,
+        profiler: Profiler = NULL_PROFILER,
+        mmap_threshold: Optional[int] = DEFAULT_MMAP_THRESHOLD,
+        compact: bool = False,
+        scan_bodies: bool = False,
+        assemblies: Optional["AssemblyMap"] = None,
+        configs: Sequence[FrozenSet[str]] = (),
+    ) -> None:
+        self.cache = cache
+        self.scan_bodies = scan_bodies
+        self.assemblies = assemblies
+        self.configs = tuple(configs)
+        self.jobs = jobs
+        self.internal_only = internal_only
+        self.profiler = profiler
+        self.mmap_threshold = mmap_threshold
+        self.names: Optional[NameTable] = NameTable() if compact else None
+        self.files: dict[Path, list] = {}
+        # qualified type name -> files declaring it (several for partial classes)
+        self.declared_in: dict[str, Set[Path]] = {}
+        self.symbols = SymbolTable(())
+        self.rows: dict = {}
+
+    def load(self, cs_files: Sequence[Path]) -> None:
+        per_file = load_decls(
+            cs_files,
+            self.cache,
+            self.jobs,
+            self.profiler,
+            self.mmap_threshold,
+            self._pack,
+            self.scan_bodies,
+            self.configs,
+        )
+        self.files = dict(zip(cs_files, per_file))
+        with self.profiler.phase("merge"):
+            self._reindex()
+            self.symbols = SymbolTable(self.declared_in)
+            if self.names is None:
+                decls = (d for f in self._ordered_files() for d in self.files[f])
+                self.rows = {row.name: row for row in finalize(decls, self.internal_only, self.symbols)}
+            else:
+                # one type at a time, so only that type's TypeDecls are ever unpacked
+                self.rows = {}
+                for name in self.declared_in:
+                    self._rebuild_row(name)
+
+    def update(self, paths: Iterable[Path]) -> Set[str]:
+        """Re-analyze created/changed files, drop deleted ones and rebuild only the affected rows.
+
+        Returns the names of the types whose rows were rebuilt or removed.
+        """
+        existing: List[Path] = []
+        affected: Set[str] = set()
+        for path in set(paths):
+            affected |= set(self._declared_names(self.files.get(path, [])))
+            if path.is_file():
+                existing.append(path)
+            else:
+                self.files.pop(path, None)
+        existing.sort()
+        per_file = load_decls(
+            existing,
+            self.cache,
+            self.jobs,
+            mmap_threshold=self.mmap_threshold,
+            pack=self._pack,
+            scan_bodies=self.scan_bodies,
+            configs=self.configs,
+        )
+        for path, decls in zip(existing, per_file):
+            self.files[path] = decls
+            affected |= set(self._declared_names(decls))
+        self._reindex()
+
+        if set(self.declared_in) != self.symbols.names:
+            # A type appeared or disappeared: any reference in any row may now resolve differently.
+            self.symbols = SymbolTable(self.declared_in)
+            affected = set(self.rows) | set(self.declared_in)
+
+        for name in affected:
+            self._rebuild_row(name)
+        return affected
+
+    def script_type(self, path: Path) -> Optional[str]:
+        """Qualified name of the type in path that Unity binds the script asset to (named like the file)."""
+        matches = [n for n in self._declared_names(self.files.get(path, [])) if n.rpartition(".")[2] == path.stem]
+        return min(matches, key=len) if matches else None
+
+    def row(self, name: str) -> RelationshipRow:
+        row = self.rows[name]
+        return row if self.names is None else row.unpack(self.names)
+
+    def row_source(self) -> RowSource:
+        return lambda: (self.row(name) for name in sorted(self.rows))
+
+    def graph(self) -> RelationshipGraph:
+        return RelationshipGraph.from_rows(self.row_source()())
+
+    def configuration_rows(self, index: int) -> List[RelationshipRow]:
+        """Rows of configs[index] alone: types and members the other configurations compile are left out."""
+        bit = 1 << index
+        decls = (
+            d for f in self._ordered_files() for d in self._unpacked(self.files[f]) if not d.configs or d.configs & bit
+        )
+        return finalize(decls, self.internal_only)
+
+    def save_graph(self, sources: SourceSet, graph_path: Path) -> None:
+        signature = graph_signature(
+            sources, sorted(self.files), self.internal_only, self.scan_bodies, configs_key(self.configs)
+        )
+        save_graph(graph_path, self.row_source(), signature)
+
+    def _ordered_files(self) -> List[Path]:
+        return sorted(self.files)
+
+    def _pack(self, decls: List[TypeDecl]) -> list:
+        if self.names is None:
+            return decls
+        return [CompactDecl.pack(d, self.names) for d in decls]
+
+    def _unpacked(self, decls: list) -> Iterable[TypeDecl]:
+        return decls if self.names is None else (c.unpack(self.names) for c in decls)
+
+    def _declared_names(self, decls: list) -> Iterator[str]:
+        if self.names is None:
+            return (d.qualified_name for d in decls)
+        names = self.names.names
+        return (names[c.qualified] for c in decls)
+
+    def _rebuild_row(self, name: str) -> None:
+        files = self.declared_in.get(name)
+        if not files:
+            self.rows.pop(name, None)
+            return
+        if self.names is None:
+            decls = [d for f in sorted(files) for d in self.files[f] if d.qualified_name == name]
+        else:
+            qualified = self.names.ids[name]
+            decls = [c.unpack(self.names) for f in sorted(files) for c in self.files[f] if c.qualified == qualified]
+        merged = merge_decls(resolve_decl(d, self.symbols) for d in decls)
+        row = make_row(merged[name], self.symbols.names, self.internal_only)
+        self.rows[name] = row if self.names is None else CompactRow.pack(row, self.names)
+
+    def _reindex(self) -> None:
+        self.declared_in = {}
+        for path, decls in self.files.items():
+            for name in self._declared_names(decls):
+                self.declared_in.setdefault(name, set()).add(path)
+
+
+# Streaming mode (--stream) for trees too large to keep in memory: each file's TypeDecls are buffered
+# only until a run is full, then written to a spill file sorted by (qualified name, file order). The rows
+# come out of a k-way merge of the runs, so the decls of a partial class meet again in the same order a
+# ProjectModel would merge them in, and only one type's decls are in memory at a time.
+SPILL_RUN_DECLS = 4096  # TypeDecls buffered before they are sorted and written out as one run
+SPILL_MERGE_FANIN = 64  # runs merged at once; bounds the number of spill files open together
+
+
+class DeclSpill:
+    """TypeDecls spilled to sorted run files in directory and merged back by qualified name.
+
+    A run line is "<qualified name>\t<zero-padded sequence>\t<decl JSON>": no name contains a tab and
+    the tab sorts below every identifier character, so plain string order of the lines is the
+    (name, sequence) order and runs merge without parsing. Whenever fanin runs of the same level pile
+    up they are merged into one run of the next level, so every decl is rewritten only a logarithmic
+    number of times.
+    """
+
+    def __init__(self, directory: Path, run_size: int = SPILL_RUN_DECLS, fanin: int = SPILL_MERGE_FANIN) -> None:
+        self.directory = directory
+        self.run_size = run_size
+        self.fanin = fanin
+        self.runs: List[Path] = []
+        self._levels: List[int] = []  # merge level of each run
+        self.names: Set[str] = set()
+        self._buffer: List[str] = []
+        self._seq = 0
+        self._files = 0
+
+    def add(self, decls: Iterable[TypeDecl]) -> None:
+        """Spill the decls of the next file; files must be added in the order their decls should merge in."""
+        for d in decls:
+            self.names.add(d.qualified_name)
+            data = json.dumps(decl_to_json(d), separators=(",", ":"))
+            self._buffer.append(f"{d.qualified_name}\t{self._seq:012d}\t{data}\n")
+            self._seq += 1
+        if len(self._buffer) >= self.run_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        self._buffer.sort()
+        with self._new_run(0).open("w", encoding="utf-8") as f:
+            f.writelines(self._buffer)
+        self._buffer = []
+        while len(self.runs) >= self.fanin and len(set(self._levels[-self.fanin :])) == 1:
+            runs = self.runs[-self.fanin :]
+            level = self._levels[-1] + 1
+            del self.runs[-self.fanin :], self._levels[-self.fanin :]
+            with self._new_run(level).open("w", encoding="utf-8") as f:
+                f.writelines(self._merge(runs))
+            for run in runs:
+                run.unlink()
+
+    def groups(self) -> Iterator[Tuple[str, List[TypeDecl]]]:
+        """(qualified name, its TypeDecls) in name order; may be iterated again once exhausted."""
+        self.flush()
+        for name, lines in itertools.groupby(self._merge(self.runs), key=lambda line: line.split("\t", 1)[0]):
+            yield name, [decl_from_json(json.loads(line.split("\t", 2)[2])) for line in lines]
+
+    def _new_run(self, level: int) -> Path:
+        path = self.directory / f"run{self._files:05d}.txt"
+        self._files += 1
+        self.runs.append(path)
+        self._levels.append(level)
+        return path
+
+    @staticmethod
+    def _merge(runs: Sequence[Path]) -> Iterator[str]:
+        with ExitStack() as stack:
+            yield from heapq.merge(*(stack.enter_context(p.open(encoding="utf-8")) for p in runs))
+
+
+def stream_decls(
+    cs_files: Sequence[Path],
+    spill: DeclSpill,
+    jobs: int = 1,
+    profiler: Profiler = NULL_PROFILER,
+    mmap_threshold: Optional[int] = DEFAULT_MMAP_THRESHOLD,
+    scan_bodies: bool = False,
+) -> None:
+    """Analyze cs_files (sorted, like ProjectModel merges them) straight into spill; the cache is not used."""
+    pending: List[Tuple[Path, Optional[bytes]]] = [(f, None) for f in sorted(cs_files)]
+    results = analyze_pending(
+        pending, jobs, profile=profiler is not NULL_PROFILER, mmap_threshold=mmap_threshold, scan_bodies=scan_bodies
+    )
+    for decls, _, _, stats in results:
+        profiler.absorb(stats)
+        with profiler.phase("spill"):
+            spill.add(decls)
+    with profiler.phase("spill"):
+        spill.flush()
+
+
+def spilled_rows(spill: DeclSpill, internal_only: bool = False) -> RowSource:
+    """Rows merged from spill, identical to a ProjectModel over the same files; re-reads the runs per call."""
+    symbols = SymbolTable(spill.names)
+
+    def rows() -> Iterator[RelationshipRow]:
+        for name, decls in spill.groups():
+            merged = merge_decls(resolve_decl(d, symbols) for d in decls)
+            yield make_row(merged[name], symbols.names, internal_only)
+
+    return rows
+
+
+# inotify(7) constants
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct("iIII")
+_INOTIFY_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF
+
+
+class InotifyWatcher:
+    """Recursive .cs watcher on Linux inotify (via ctypes, no extra dependencies)."""
+
+    name = "inotify"
+
+    def __init__(self, sources: SourceSet) -> None:
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.sources = sources
+        self._dirs: dict[int, Path] = {}
+        for root in sources.roots:
+            self._watch_tree(root)
+
+    def _watch_tree(self, root: Path) -> List[Path]:
+        """Watch root and every directory below it that discovery does not prune; returns the files found."""
+        found: List[Path] = []
+        for dirpath, files in self.sources.walk(root):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), _INOTIFY_MASK)
+            if wd >= 0:
+                self._dirs[wd] = Path(dirpath)
+            found.extend(Path(f) for f in files)
+        return found
+
+    def poll(self, timeout: Optional[float]) -> Optional[Set[Path]]:
+        """Changed .cs paths seen within timeout; None means events were lost and a full rescan is needed."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        buf = os.read(self._fd, 64 * 1024)
+        changed: Set[Path] = set()
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(buf, offset)
+            offset += _INOTIFY_EVENT.size
+            name = os.fsdecode(buf[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                return None
+            directory = self._dirs.get(wd)
+            if mask & _IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if directory is None or not name:
+                continue
+            path = directory / name
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    changed.update(self._watch_tree(path))
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    # Files of a removed directory: the model drops whatever no longer exists.
+                    changed.add(path)
+                continue
+            if name.endswith(".cs"):
+                changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Portable fallback: compares (mtime, size) snapshots of the .cs files every interval."""
+
+    name = "polling"
+
+    def __init__(self, sources: SourceSet, interval: float = 1.0) -> None:
+        self.sources = sources
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict[Path, Tuple[int, int]]:
+        snapshot: dict[Path, Tuple[int, int]] = {}
+        for path in self.sources.discover():
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            snapshot[path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def poll(self, timeout: Optional[float]) -> Optional[Set[Path]]:
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        current = self._scan()
+        previous, self._snapshot = self._snapshot, current
+        return {p for p in previous.keys() | current.keys() if previous.get(p) != current.get(p)}
+
+    def close(self) -> None:
+        pass
+
+
+def make_watcher(sources: SourceSet, force_polling: bool = False, interval: float = 1.0):
+    if not force_polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(sources)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(sources, interval)
+
+
+def watch(
+    model: ProjectModel,
+    sources: SourceSet,
+    output_path: Path,
+    formats: Sequence[str],
+    debounce: float = 0.3,
+    force_polling: bool = False,
+    graph_path: Optional[Path] = None,
+) -> int:
+    """Keep the model warm and rewrite the outputs (and the query graph) after each debounced burst of .cs changes."""
+    watcher = make_watcher(sources, force_polling, interval=max(debounce, 0.2))
+    roots = ", ".join(str(r) for r in sources.roots)
+    print(f"Watching {roots} for .cs changes ({watcher.name}); Ctrl+C to stop")
+    try:
+        while True:
+            changed = watcher.poll(None)
+            if changed is not None and not changed:
+                continue
+            # Debounce: editors and Unity save in bursts; wait until the tree is quiet.
+            while changed is not None:
+                more = watcher.poll(debounce)
+                if more is None:
+                    changed = None
+                elif not more:
+                    break
+                else:
+                    changed |= more
+            if changed is None:
+                changed = set(model.files) | set(sources.discover())
+            else:
+                # A deleted/moved directory is reported as the directory itself.
+                for path in list(changed):
+                    if path.suffix != ".cs":
+                        changed |= {f for f in model.files if path in f.parents}
+                changed = {p for p in changed if p in model.files or sources.accepts(p)}
+            if not changed:
+                continue
+
+            affected = model.update(changed)
+            if not affected:
+                continue
+            for fmt, path, count, rewritten in write_outputs(model.row_source(), output_path, formats):
+                if rewritten:
+                    print(f"[{time.strftime('%H:%M:%S')}] {len(changed)} file(s) changed, "
+                          f"{len(affected)} type(s) updated -> {path}")
+            if graph_path is not None:
+                model.save_graph(sources, graph_path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return 0
+
+
+# Scene/prefab usage (--usage). Unity stores the script of every MonoBehaviour/ScriptableObject as
+#   m_Script: {fileID: 11500000, guid: <32 hex digits>, type: 3}
+# and the guid comes from the script's .cs.meta. Text-serialized assets are streamed through one bytes
+# regex in fixed-size chunks, so even huge scenes are never held in memory or parsed as YAML.
+M_SCRIPT_RE = re.compile(rb"m_Script: \{fileID: -?\d{1,20}, guid: ([0-9a-f]{32})")
+M_SCRIPT_MAX_LEN = 128  # longer than any M_SCRIPT_RE match: the overlap kept between chunks
+USAGE_SCAN_CHUNK = 1 << 20
+META_GUID_RE = re.compile(r"^guid: ([0-9a-f]{32})\s*$")
+USAGE_ASSET_INCLUDES = ("*.unity", "*.prefab", "*.asset")
+USAGE_HEADER = ["Class Name", "Script", "Asset", "Count"]
+
+
+def read_meta_guid(meta_path: Path) -> Optional[str]:
+    """The guid of a .meta file (it sits in the first few lines), or None."""
+    try:
+        with meta_path.open(encoding="utf-8", errors="ignore") as f:
+            for _, line in zip(range(8), f):
+                m = META_GUID_RE.match(line)
+                if m:
+                    return m.group(1)
+    except OSError:
+        pass
+    return None
+
+
+def scan_script_refs(asset_path: Path) -> dict[bytes, int]:
+    """Script guid -> number of objects using it in one asset; binary-serialized assets yield nothing."""
+    counts: dict[bytes, int] = {}
+    with open(asset_path, "rb") as fh:
+        tail = fh.read(5)
+        if tail != b"%YAML":
+            return counts
+        while True:
+            chunk = fh.read(USAGE_SCAN_CHUNK)
+            if not chunk:
+                return counts
+            buf = tail + chunk
+            # carry over what a match cut by the chunk boundary could start in, but nothing already counted
+            keep = max(0, len(buf) - M_SCRIPT_MAX_LEN)
+            for m in M_SCRIPT_RE.finditer(buf):
+                guid = m.group(1)
+                counts[guid] = counts.get(guid, 0) + 1
+                keep = max(keep, m.end())
+            tail = buf[keep:]
+
+
+def default_asset_roots(source_roots: Sequence[Path]) -> List[Path]:
+    """The Unity Assets folder each source root lives in (the root itself outside a Unity project)."""
+    roots: List[Path] = []
+    for root in source_roots:
+        assets = next((p for p in (root, *root.parents) if p.name == "Assets"), root)
+        if assets not in roots:
+            roots.append(assets)
+    return roots
+
+
+def collect_script_usage(model: ProjectModel, assets: SourceSet) -> List[Tuple[str, Path, Path, int]]:
+    """(type, script, asset, count) for every scene/prefab/asset object whose script the model analyzed.
+
+    The type is the one Unity binds to the script: declared in it with the file's name.
+    """
+    scripts: dict[bytes, Path] = {}
+    for path in model.files:
+        guid = read_meta_guid(path.with_name(path.name + ".meta"))
+        if guid is not None:
+            scripts[guid.encode("ascii")] = path
+    usage: List[Tuple[str, Path, Path, int]] = []
+    if not scripts:
+        return usage
+    for asset in assets.discover():
+        for guid, count in scan_script_refs(asset).items():
+            script = scripts.get(guid)
+            if script is not None:
+                usage.append((model.script_type(script) or "", script, asset, count))
+    usage.sort(key=lambda u: (u[0], u[1].as_posix(), u[2].as_posix()))
+    return usage
+
+
+def write_usage(usage: Sequence[Tuple[str, Path, Path, int]], out: TextIO) -> int:
+    w = csv.writer(out)
+    w.writerow(USAGE_HEADER)
+    for type_name, script, asset, count in usage:
+        w.writerow([type_name, script.as_posix(), asset.as_posix(), count])
+    return len(usage)
+
+
+def usage_output_path(output_path: Path) -> Path:
+    return output_path.with_suffix(".usage.csv")
+
+
+# Assembly definitions (--assemblies). Every .cs file compiles into the assembly of the .asmdef in its
+# nearest ancestor folder (an .asmref adds its folder to the assembly it references); files outside any
+# of them go to Unity's predefined Assembly-CSharp[-Editor][-firstpass].
+PREDEFINED_ASSEMBLY = "Assembly-CSharp"
+FIRSTPASS_FOLDERS = ("Plugins", "Standard Assets", "Pro Standard Assets")
+ASSEMBLY_DEF_INCLUDES = ("*.asmdef", "*.asmref")
+
+
+@dataclass
+class AssemblyDef:
+    name: str
+    directory: Path
+    # names of referenced assemblies; "GUID:<guid>" entries are resolved through the .asmdef.meta files
+    references: List[str] = field(default_factory=list)
+
+
+def predefined_assembly(path: Path) -> str:
+    """The predefined assembly Unity compiles a script outside every .asmdef folder into."""
+    parts = path.parts
+    start = len(parts) - 1 - parts[::-1].index("Assets") if "Assets" in parts else 0
+    name = PREDEFINED_ASSEMBLY
+    if len(parts) > start + 2 and parts[start + 1] in FIRSTPASS_FOLDERS:
+        name += "-firstpass"
+    if "Editor" in parts[start:-1]:
+        name = name.replace(PREDEFINED_ASSEMBLY, PREDEFINED_ASSEMBLY + "-Editor")
+    return name
+
+
+def _read_assembly_json(path: Path) -> Optional[dict]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8-sig"))
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class AssemblyMap:
+    """Which assembly each source file belongs to, resolved once per folder."""
+
+    def __init__(self, assemblies: Sequence[AssemblyDef], folders: Optional[dict[Path, str]] = None) -> None:
+        self.assemblies = {a.name: a for a in assemblies}
+        self._folders: dict[Path, str] = {a.directory: a.name for a in assemblies}
+        self._folders.update(folders or {})
+        self._memo: dict[Path, Optional[str]] = {}
+
+    @classmethod
+    def discover(cls, definitions: SourceSet) -> "AssemblyMap":
+        """Read every .asmdef/.asmref found by definitions; unreadable files are skipped."""
+        asmdefs: List[AssemblyDef] = []
+        by_guid: dict[str, str] = {}
+        asmrefs: List[Tuple[Path, str]] = []
+        for path in definitions.discover():
+            data = _read_assembly_json(path)
+            if data is None:
+                continue
+            if path.suffix == ".asmref":
+                if isinstance(data.get("reference"), str):
+                    asmrefs.append((path.parent, data["reference"]))
+                continue
+            name = data.get("name")
+            if not isinstance(name, str) or not name:
+                continue
+            refs = [r for r in data.get("references", []) if isinstance(r, str)]
+            asmdefs.append(AssemblyDef(name, path.parent, refs))
+            guid = read_meta_guid(path.with_name(path.name + ".meta"))
+            if guid is not None:
+                by_guid[guid] = name
+
+        def resolve(ref: str) -> str:
+            return by_guid.get(ref[5:], ref) if ref.startswith("GUID:") else ref
+
+        for a in asmdefs:
+            a.references = [resolve(r) for r in a.references]
+        return cls(asmdefs, {folder: resolve(ref) for folder, ref in asmrefs})
+
+    def assembly_of(self, path: Path) -> str:
+        folder = path.parent
+        walked: List[Path] = []
+        while True:
+            if folder in self._memo:
+                name = self._memo[folder]
+                break
+            name = self._folders.get(folder)
+            if name is not None or folder.parent == folder:
+                break
+            walked.append(folder)
+            folder = folder.parent
+        for f in walked:
+            self._memo[f] = name
+        return name if name is not None else predefined_assembly(path)
+
+
+def partition_cache_path(cache_path: Path, assembly: str) -> Path:
+    """.<stem>.cache.json -> .<stem>.<assembly>.cache.json (still matched by the .*.cache.json ignore rule)."""
+    name = cache_path.name
+    stem = name[: -len(".cache.json")] if name.endswith(".cache.json") else cache_path.stem
+    return cache_path.with_name(f"{stem}.{assembly}.cache.json")
+
+
+class PartitionedCache:
+    """One AnalysisCache file per assembly, so a change only rewrites the cache of the assembly it is in.
+
+    Drop-in for AnalysisCache in load_decls and ProjectModel; path is the unpartitioned cache path the
+    partition files are named after.
+    """
+
+    def __init__(self, path: Optional[Path], assemblies: AssemblyMap) -> None:
+        self.path = path
+        self.assemblies = assemblies
+        self.partitions: dict[str, AnalysisCache] = {}
+
+    def partition(self, source: Path) -> AnalysisCache:
+        name = self.assemblies.assembly_of(source)
+        cache = self.partitions.get(name)
+        if cache is None:
+            path = partition_cache_path(self.path, name) if self.path is not None else None
+            cache = self.partitions[name] = AnalysisCache(path)
+        return cache
+
+    @property
+    def hits(self) -> int:
+        return sum(c.hits for c in self.partitions.values())
+
+    @property
+    def misses(self) -> int:
+        return sum(c.misses for c in self.partitions.values())
+
+    def lookup(
+        self, path: Path, scan_bodies: bool = False, configs: Sequence[FrozenSet[str]] = ()
+    ) -> Tuple[Optional[List[TypeDecl]], Optional[bytes], Optional[os.stat_result]]:
+        return self.partition(path).lookup(path, scan_bodies, configs)
+
+    def store(self, path: Path, *args, **kwargs) -> None:
+        self.partition(path).store(path, *args, **kwargs)
+
+    def save(self) -> None:
+        for cache in self.partitions.values():
+            cache.save()
+
+
+def assembly_edges(model: ProjectModel, assemblies: AssemblyMap) -> Tuple[dict[str, int], dict[Tuple[str, str], int]]:
+    """(types per assembly, type edges per (from, to) assembly pair) over the model's declared types."""
+    type_assembly = {name: assemblies.assembly_of(min(files)) for name, files in model.declared_in.items()}
+    types: dict[str, int] = {}
+    edges: dict[Tuple[str, str], int] = {}
+    for name in sorted(model.rows):
+        src = type_assembly[name]
+        types[src] = types.get(src, 0) + 1
+        for _, target in _row_edges(model.row(name)):
+            dst = type_assembly.get(graph_key(target))
+            if dst is not None and dst != src:
+                edges[(src, dst)] = edges.get((src, dst), 0) + 1
+    return types, edges
+
+
+def write_assembly_dot(model: ProjectModel, assemblies: AssemblyMap, out: TextIO) -> int:
+    """Assembly dependency graph. Edges are labelled with the number of type references between two
+    assemblies; references an .asmdef uses without declaring are red, declared but unused ones dashed.
+    """
+    types, edges = assembly_edges(model, assemblies)
+    out.write("digraph Assemblies {\n")
+    out.write("    rankdir=BT;\n")
+    out.write("    node [shape=box, fontname=Helvetica];\n")
+    for name in sorted(types):
+        label = f"{name}\n{types[name]} types"
+        out.write(f"    {_dot_quote(name)} [label={_dot_quote(label)}];\n")
+    for (src, dst), count in sorted(edges.items()):
+        declared = assemblies.assemblies.get(src)
+        undeclared = declared is not None and dst in assemblies.assemblies and dst not in declared.references
+        color = ", color=red" if undeclared else ""
+        out.write(f"    {_dot_quote(src)} -> {_dot_quote(dst)} [label={count}{color}];\n")
+    for name in sorted(types):
+        declared = assemblies.assemblies.get(name)
+        for ref in sorted(set(declared.references) if declared else ()):
+            if ref in types and (name, ref) not in edges:
+                out.write(f"    {_dot_quote(name)} -> {_dot_quote(ref)} [style=dashed, color=gray];\n")
+    out.write("}\n")
+    return len(types)
+
+
+def assemblies_output_path(output_path: Path) -> Path:
+    return output_path.with_suffix(".assemblies.dot")
+
+
+# Preprocessor configurations (--defines NAME=SYMBOL,...): which configurations compile each type and
+# each relationship. A type's own presence is listed as relationship "declared" with no target.
+CONFIGS_HEADER = ["Class Name", "Relationship", "Target", "Configurations"]
+
+
+def parse_configuration(value: str) -> Tuple[str, FrozenSet[str]]:
+    name, sep, symbols = value.partition("=")
+    name = name.strip()
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"expected NAME=SYMBOL[,SYMBOL...], got {value!r}")
+    return name, frozenset(s.strip() for s in symbols.split(",") if s.strip())
+
+
+def configuration_edges(model: ProjectModel, names: Sequence[str]) -> List[Tuple[str, str, str, List[str]]]:
+    """(type, relationship, target, configurations) over the rows of every configuration of the model."""
+    edges: dict[Tuple[str, str, str], List[str]] = {}
+    for index, config in enumerate(names):
+        for row in model.configuration_rows(index):
+            edges.setdefault((row.name, "declared", ""), []).append(config)
+            for edge_kind, target in _row_edges(row):
+                edges.setdefault((row.name, edge_kind, target), []).append(config)
+    order = {kind: i for i, kind in enumerate(("declared",) + EDGE_KINDS)}
+    return [(*key, edges[key]) for key in sorted(edges, key=lambda k: (k[0], order[k[1]], k[2]))]
+
+
+def write_configurations(edges: Sequence[Tuple[str, str, str, List[str]]], out: TextIO) -> int:
+    w = csv.writer(out)
+    w.writerow(CONFIGS_HEADER)
+    for name, relationship, target, configs in edges:
+        w.writerow([name, relationship, target, "; ".join(configs)])
+    return len(edges)
+
+
+def configurations_output_path(output_path: Path) -> Path:
+    return output_path.with_suffix(".configs.csv")
+
+
+def check_outputs(
+    model: ProjectModel,
+    output_path: Path,
+    formats: Sequence[str],
+    usage: Optional[Sequence[Tuple[str, Path, Path, int]]] = None,
+    config_names: Sequence[str] = (),
+) -> int:
+    """--check: report which outputs are stale (with per-type deltas for the CSV); 1 if any is, else 0."""
+    stale = 0
+    if config_names:
+        path = configurations_output_path(output_path)
+        edges = configuration_edges(model, config_names)
+        _, changed = write_if_changed(path, lambda f: write_configurations(edges, f), replace_changed=False)
+        print(f"{'Out of date' if changed else 'Up to date'}: {path}")
+        stale += changed
+    if model.assemblies is not None:
+        path = assemblies_output_path(output_path)
+        assemblies = model.assemblies
+        _, changed = write_if_changed(path, lambda f: write_assembly_dot(model, assemblies, f), replace_changed=False)
+        print(f"{'Out of date' if changed else 'Up to date'}: {path}")
+        stale += changed
+    if usage is not None:
+        path = usage_output_path(output_path)
+        _, changed = write_if_changed(path, lambda f: write_usage(usage, f), replace_changed=False)
+        print(f"{'Out of date' if changed else 'Up to date'}: {path}")
+        stale += changed
+    for fmt, path, _, changed in write_outputs(model.row_source(), output_path, formats, replace_changed=False):
+        if not changed:
+            print(f"Up to date: {path}")
+            continue
+        stale += 1
+        old = read_csv_rows(path) if fmt == "csv" else None
+        if old is None:
+            print(f"Out of date: {path}" + ("" if path.exists() else " (missing)"))
+            continue
+        deltas = diff_csv_rows(old, model.row_source()())
+        print(f"Out of date: {path} ({len(deltas)} change(s))")
+        for line in deltas:
+            print(f"  {line}")
+    return 1 if stale else 0
+
+
+DEFAULT_SOURCE = Path("Assets/Scripts/FusionImpostor")
+DEFAULT_OUTPUT = Path("Assets/Docs/UMLDiagramClass/ClassRelationship.csv")
+
+# query relation -> (edge kinds followed, follow edges backwards)
+QUERY_RELATIONS: dict[str, Tuple[Tuple[str, ...], bool]] = {
+    "uses": (EDGE_KINDS, False),
+    "used-by": (EDGE_KINDS, True),
+    "bases": (("generalization", "realization"), False),
+    "subclasses": (("generalization",), True),
+    "implementers": (("realization",), True),
+}
+
+
+def add_source_arguments(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument(
+        "--source",
+        action="append",
+        default=None,
+        help=f"Folder containing .cs files to analyze; repeat for several roots (default: {DEFAULT_SOURCE})",
+    )
+    ap.add_argument(
+        "--include",
+        action="append",
+        default=None,
+        metavar="GLOB",
+        help="Files to analyze, e.g. 'Scripts/**/*.cs' (repeatable; default: *.cs). Globs without '/' match "
+        "a file name at any depth, others the path relative to its --source root.",
+    )
+    ap.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="Files or directories to skip (repeatable); excluded directories are never descended into.",
+    )
+    ap.add_argument(
+        "--no-default-excludes",
+        action="store_true",
+        help=f"Also scan the {', '.join(DEFAULT_EXCLUDES)} directories (a leading '/' means directly under a "
+        "root, the others match at any depth).",
+    )
+    ap.add_argument(
+        "--no-gitignore",
+        action="store_true",
+        help="Do not skip files and directories ignored by .gitignore files.",
+    )
+
+
+def add_model_arguments(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument(
+        "--output",
+        default=str(DEFAULT_OUTPUT),
+        help="CSV output path; other formats are written next to it (.jsonl, .mmd, .puml, .dot, .metrics.csv, "
+        ".assemblies.dot, .configs.csv)",
+    )
+    ap.add_argument(
+        "--format",
+        type=parse_formats,
+        default=["csv"],
+        help=f"Comma-separated output formats written in one run: {','.join(OUTPUT_FORMATS)} (default: csv)",
+    )
+    ap.add_argument(
+        "--internal-only",
+        action="store_true",
+        help="Only include types declared under the scanned source folder in relationship columns.",
+    )
+    ap.add_argument(
+        "--cache",
+        default=None,
+        help="Incremental analysis cache path (default: hidden .<output stem>.cache.json next to the output)",
+    )
+    ap.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Analyze every file from scratch and do not read or write the analysis cache or the query graph.",
+    )
+    ap.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Worker processes for per-file analysis (0 = one per CPU). Output is identical to a serial run.",
+    )
+    ap.add_argument(
+        "--mmap-threshold",
+        type=int,
+        default=DEFAULT_MMAP_THRESHOLD,
+        metavar="BYTES",
+        help=(
+            "Scan files of at least this many bytes through a memory map instead of decoding them "
+            f"(default: {DEFAULT_MMAP_THRESHOLD}; 0 = every file, negative = never)."
+        ),
+    )
+    ap.add_argument(
+        "--compact",
+        action="store_true",
+        help=(
+            "Keep analysis results and rows as interned integer ids instead of Python strings and sets; "
+            "slower, but uses about a third of the memory on very large trees (a little less again with "
+            "--no-cache, which also skips the cache and query graph files). Output is identical."
+        ),
+    )
+    ap.add_argument(
+        "--scan-bodies",
+        action="store_true",
+        help=(
+            "Also scan method bodies and initializers for uses of types declared in the sources "
+            "(new X(), GetComponent<X>(), X.Instance, locals of type X) and report them as dependencies."
+        ),
+    )
+    ap.add_argument(
+        "--assemblies",
+        action="store_true",
+        help=(
+            "Assign files to assemblies from the .asmdef/.asmref files of the Assets folder, keep one analysis "
+            "cache per assembly and write the assembly dependency graph to <output>.assemblies.dot."
+        ),
+    )
+    ap.add_argument(
+        "--defines",
+        action="append",
+        type=parse_configuration,
+        default=[],
+        metavar="NAME=SYMBOLS",
+        help=(
+            "A preprocessor configuration, e.g. editor=UNITY_EDITOR or server=UNITY_SERVER,UNITY_64 "
+            "(repeatable; an empty symbol list is allowed). #if/#elif/#else blocks are then evaluated for "
+            "every configuration in the same pass; the outputs hold the union and <output>.configs.csv "
+            "lists which configurations contain each type and relationship (not refreshed by --watch)."
+        ),
+    )
+
+
+def model_from_args(
+    args: argparse.Namespace, sources: SourceSet, profiler: Profiler = NULL_PROFILER
+) -> Tuple[ProjectModel, Optional[Path], Optional[Path]]:
+    """An empty ProjectModel configured from add_model_arguments options, plus its cache and graph paths."""
+    output_path = Path(args.output)
+    cache_path: Optional[Path] = None
+    graph_path: Optional[Path] = None
+    if not args.no_cache:
+        cache_path = Path(args.cache) if args.cache else default_cache_path(output_path)
+        graph_path = default_graph_path(output_path)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    mmap_threshold = args.mmap_threshold if args.mmap_threshold >= 0 else None
+    names = [name for name, _ in args.defines]
+    if len(set(names)) != len(names):
+        raise SystemExit(f"Duplicate --defines configuration name in: {', '.join(names)}")
+    assemblies = None
+    cache: Union[AnalysisCache, PartitionedCache] = AnalysisCache(cache_path)
+    if args.assemblies:
+        exclude = ([] if args.no_default_excludes else list(DEFAULT_EXCLUDES)) + args.exclude
+        definitions = SourceSet(
+            default_asset_roots(sources.roots), ASSEMBLY_DEF_INCLUDES, exclude, use_gitignore=not args.no_gitignore
+        )
+        assemblies = AssemblyMap.discover(definitions)
+        if cache_path is not None:
+            cache = PartitionedCache(cache_path, assemblies)
+    model = ProjectModel(
+        cache,
+        jobs=jobs,
+        internal_only=args.internal_only,
+        profiler=profiler,
+        mmap_threshold=mmap_threshold,
+        compact=args.compact,
+        scan_bodies=args.scan_bodies,
+        assemblies=assemblies,
+        configs=[defines for _, defines in args.defines],
+    )
+    return model, cache_path, graph_path
+
+
+def source_set_from_args(args: argparse.Namespace) -> SourceSet:
+    roots = [Path(s) for s in args.source] if args.source else [DEFAULT_SOURCE]
+    for root in roots:
+        if not root.exists():
+            raise SystemExit(f"Source folder not found: {root}")
+    exclude = ([] if args.no_default_excludes else list(DEFAULT_EXCLUDES)) + args.exclude
+    return SourceSet(roots, args.include or DEFAULT_INCLUDES, exclude, use_gitignore=not args.no_gitignore)
+
+
+def asset_set_from_args(args: argparse.Namespace, sources: SourceSet) -> SourceSet:
+    """Scenes, prefabs and assets scanned by --usage, with the same excludes as the sources."""
+    roots = [Path(a) for a in args.assets] if args.assets else default_asset_roots(sources.roots)
+    for root in roots:
+        if not root.exists():
+            raise SystemExit(f"Assets folder not found: {root}")
+    exclude = ([] if args.no_default_excludes else list(DEFAULT_EXCLUDES)) + args.exclude
+    return SourceSet(roots, USAGE_ASSET_INCLUDES, exclude, use_gitignore=not args.no_gitignore)
+
+
+def query_main(argv: Sequence[str]) -> int:
+    """`query` subcommand: answer relationship questions from the cached graph.
+
+    The graph written by the last run is reused while every .cs file under --source still has the same
+    size and mtime; otherwise it is rebuilt first (through the analysis cache, so only changed files
+    are parsed again).
+    """
+    ap = argparse.ArgumentParser(
+        prog=f"{Path(sys.argv[0]).name} query",
+        description="Query type relationships, e.g. 'used-by PlayerNetwork --kind dependency' or "
+        "'subclasses NetworkBehaviour --transitive'.",
+    )
+    ap.add_argument("relation", choices=list(QUERY_RELATIONS), help="Which way to follow the edges")
+    ap.add_argument("type", help="Type name (simple, nested Outer.Inner, or with generic arguments)")
+    ap.add_argument(
+        "--kind",
+        action="append",
+        choices=EDGE_KINDS,
+        help="Only follow these edge kinds (repeatable; default depends on the relation)",
+    )
+    ap.add_argument("--transitive", "-t", action="store_true", help="Follow edges transitively (prints the depth too)")
+    add_source_arguments(ap)
+    ap.add_argument("--output", default=str(DEFAULT_OUTPUT), help="CSV output path the graph cache sits next to")
+    ap.add_argument(
+        "--internal-only",
+        action="store_true",
+        help="Query the graph restricted to types declared under --source.",
+    )
+    ap.add_argument(
+        "--scan-bodies",
+        action="store_true",
+        help="Query the graph that includes dependencies found in method bodies (see --scan-bodies of the main command).",
+    )
+    ap.add_argument("--cache", default=None, help="Incremental analysis cache path used when the graph is rebuilt")
+    ap.add_argument("--jobs", "-j", type=int, default=1, help="Worker processes when the graph is rebuilt")
+    args = ap.parse_args(argv)
+
+    sources = source_set_from_args(args)
+    output_path = Path(args.output)
+
+    cs_files = sources.discover()
+    graph_path = default_graph_path(output_path)
+    signature = graph_signature(sources, cs_files, args.internal_only, args.scan_bodies)
+    graph = load_graph(graph_path, signature)
+    if graph is None:
+        cache = AnalysisCache(Path(args.cache) if args.cache else default_cache_path(output_path))
+        jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+        model = ProjectModel(cache, jobs=jobs, internal_only=args.internal_only, scan_bodies=args.scan_bodies)
+        model.load(cs_files)
+        graph = model.graph()
+        save_graph(graph_path, model.row_source(), signature)
+
+    if args.type not in graph:
+        print(f"Unknown type: {args.type}", file=sys.stderr)
+        return 1
+    edge_kinds, reverse = QUERY_RELATIONS[args.relation]
+    if args.kind:
+        edge_kinds = tuple(k for k in EDGE_KINDS if k in args.kind)
+    if args.transitive:
+        for depth, edge_kind, name in graph.walk(args.type, edge_kinds, reverse):
+            print(f"{depth}\t{edge_kind}\t{name}")
+    else:
+        for edge_kind, name in graph.neighbors(args.type, edge_kinds, reverse):
+            print(f"{edge_kind}\t{name}")
+    return 0
+
+
+class RpcError(Exception):
+    """A JSON-RPC error response (code from the JSON-RPC 2.0 spec)."""
+
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class AnalysisServer:
+    """JSON-RPC 2.0 over newline-delimited JSON, answered from a resident ProjectModel.
+
+    Methods: ping, fileChanged {paths}, rescan, regenerate {formats?, check?}, relationships {type},
+    query {relation, type, kinds?, transitive?}, shutdown. Requests without an id are notifications
+    and get no response.
+    """
+
+    def __init__(
+        self,
+        model: ProjectModel,
+        sources: SourceSet,
+        output_path: Path,
+        formats: Sequence[str],
+        graph_path: Optional[Path] = None,
+    ) -> None:
+        self.model = model
+        self.sources = sources
+        self.output_path = output_path
+        self.formats = list(formats)
+        self.graph_path = graph_path
+        self.running = True
+        self._graph: Optional[RelationshipGraph] = None
+        self.methods: dict[str, Callable[..., object]] = {
+            "ping": self.ping,
+            "fileChanged": self.file_changed,
+            "rescan": self.rescan,
+            "regenerate": self.regenerate,
+            "relationships": self.relationships,
+            "query": self.query,
+            "shutdown": self.shutdown,
+        }
+
+    def handle_line(self, line: str) -> Optional[str]:
+        """One request line in, one response line out (None for notifications)."""
+        req_id = None
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                raise RpcError(-32700, "Parse error") from None
+            if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+                raise RpcError(-32600, "Invalid Request")
+            req_id = request.get("id")
+            result = self.call(request["method"], request.get("params", {}))
+            if "id" not in request:
+                return None
+            response = {"jsonrpc": "2.0", "id": req_id, "result": result}
+        except RpcError as exc:
+            response = {"jsonrpc": "2.0", "id": req_id, "error": {"code": exc.code, "message": exc.message}}
+        except Exception as exc:  # keep serving: report the failure to the client instead
+            response = {"jsonrpc": "2.0", "id": req_id, "error": {"code": -32603, "message": f"{type(exc).__name__}: {exc}"}}
+        return json.dumps(response, separators=(",", ":"))
+
+    def call(self, name: str, params) -> object:
+        method = self.methods.get(name)
+        if method is None:
+            raise RpcError(-32601, f"Method not found: {name}")
+        args, kwargs = (params, {}) if isinstance(params, list) else ((), params)
+        if not isinstance(kwargs, dict):
+            raise RpcError(-32602, "params must be an object or an array")
+        try:
+            inspect.signature(method).bind(*args, **kwargs)
+        except TypeError as exc:
+            raise RpcError(-32602, f"Invalid params: {exc}") from None
+        return method(*args, **kwargs)
+
+    def graph(self) -> RelationshipGraph:
+        if self._graph is None:
+            self._graph = self.model.graph()
+        return self._graph
+
+    def _local_path(self, path: str) -> Path:
+        """A client path in the form the model uses (clients usually send absolute paths)."""
+        p = Path(path)
+        if self.sources.roots and p.is_absolute() != self.sources.roots[0].is_absolute():
+            p = Path(os.path.abspath(p)) if self.sources.roots[0].is_absolute() else Path(os.path.relpath(p))
+        return p
+
+    def _apply(self, changed: Set[Path]) -> dict:
+        affected = self.model.update(changed)
+        if affected:
+            self._graph = None
+        return {"affected": sorted(affected)}
+
+    @staticmethod
+    def _strings(name: str, value) -> List[str]:
+        """A list-of-strings parameter; anything else (a lone string would iterate per character) is -32602."""
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            raise RpcError(-32602, f"Invalid params: {name} must be an array of strings")
+        return value
+
+    def ping(self) -> str:
+        return "pong"
+
+    def file_changed(self, paths: Sequence[str]) -> dict:
+        changed: Set[Path] = set()
+        for path in map(self._local_path, self._strings("paths", paths)):
+            # a directory stands for every file the model has below it
+            changed |= {f for f in self.model.files if path in f.parents}
+            if path in self.model.files or self.sources.accepts(path):
+                changed.add(path)
+        return self._apply(changed)
+
+    def rescan(self) -> dict:
+        return self._apply(set(self.model.files) | set(self.sources.discover()))
+
+    def regenerate(self, formats: Optional[Sequence[str]] = None, check: bool = False) -> List[dict]:
+        if formats is not None:
+            try:
+                formats = parse_formats(",".join(self._strings("formats", formats)))
+            except argparse.ArgumentTypeError as exc:
+                raise RpcError(-32602, str(exc)) from None
+        written = write_outputs(
+            self.model.row_source(), self.output_path, formats or self.formats, replace_changed=not check
+        )
+        if self.graph_path is not None and not check:
+            save_graph(
+                self.graph_path,
+                self.model.row_source(),
+                graph_signature(
+                    self.sources,
+                    sorted(self.model.files),
+                    self.model.internal_only,
+                    self.model.scan_bodies,
+                    configs_key(self.model.configs),
+                ),
+            )
+        return [{"format": fmt, "path": str(path), "rows": count, "changed": changed} for fmt, path, count, changed in written]
+
+    def relationships(self, type: str) -> dict:
+        graph = self.graph()
+        if type not in graph:
+            raise RpcError(-32602, f"Unknown type: {type}")
+        keys = sorted(graph.keys_for(type))
+        return {
+            "rows": [asdict(self.model.row(k)) for k in keys if k in self.model.rows],
+            "uses": [list(edge) for edge in graph.neighbors(type, EDGE_KINDS)],
+            "usedBy": [list(edge) for edge in graph.neighbors(type, EDGE_KINDS, reverse=True)],
+        }
+
+    def query(
+        self, relation: str, type: str, kinds: Optional[Sequence[str]] = None, transitive: bool = False
+    ) -> List[dict]:
+        if relation not in QUERY_RELATIONS:
+            raise RpcError(-32602, f"Unknown relation: {relation}; choose from {', '.join(QUERY_RELATIONS)}")
+        graph = self.graph()
+        if type not in graph:
+            raise RpcError(-32602, f"Unknown type: {type}")
+        edge_kinds, reverse = QUERY_RELATIONS[relation]
+        if kinds:
+            kinds = self._strings("kinds", kinds)
+            edge_kinds = tuple(k for k in EDGE_KINDS if k in kinds)
+        if transitive:
+            return [{"depth": d, "kind": k, "type": t} for d, k, t in graph.walk(type, edge_kinds, reverse)]
+        return [{"kind": k, "type": t} for k, t in graph.neighbors(type, edge_kinds, reverse)]
+
+    def shutdown(self) -> None:
+        self.running = False
+
+
+def serve_stdio(server: AnalysisServer, stdin: TextIO, stdout: TextIO) -> None:
+    for line in stdin:
+        if not line.strip():
+            continue
+        response = server.handle_line(line)
+        if response is not None:
+            stdout.write(response + "\n")
+            stdout.flush()
+        if not server.running:
+            break
+
+
+def serve_unix_socket(server: AnalysisServer, socket_path: Path) -> None:
+    """Serve any number of clients on a Unix socket, one request at a time, in a single thread."""
+    import socket
+
+    if not hasattr(socket, "AF_UNIX"):
+        raise SystemExit("Unix sockets are not available on this platform; use stdio (omit --socket)")
+    try:
+        if stat.S_ISSOCK(socket_path.stat().st_mode):
+            socket_path.unlink()  # left over from a server that did not shut down cleanly
+    except FileNotFoundError:
+        pass
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(str(socket_path))
+    listener.listen()
+    buffers: dict = {}
+    try:
+        while server.running:
+            readable, _, _ = select.select([listener, *buffers], [], [])
+            for sock in readable:
+                if sock is listener:
+                    conn, _ = listener.accept()
+                    buffers[conn] = b""
+                    continue
+                data = sock.recv(64 * 1024)
+                if not data:
+                    del buffers[sock]
+                    sock.close()
+                    continue
+                lines = (buffers[sock] + data).split(b"\n")
+                buffers[sock] = lines.pop()
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    response = server.handle_line(line.decode("utf-8", errors="replace"))
+                    if response is not None:
+                        sock.sendall(response.encode("utf-8") + b"\n")
+                    if not server.running:
+                        break
+    finally:
+        for sock in buffers:
+            sock.close()
+        listener.close()
+        try:
+            socket_path.unlink()
+        except OSError:
+            pass
+
+
+def serve_main(argv: Sequence[str]) -> int:
+    """`serve` subcommand: keep the model, caches and graph resident and answer JSON-RPC requests."""
+    ap = argparse.ArgumentParser(
+        prog=f"{Path(sys.argv[0]).name} serve",
+        description="Serve newline-delimited JSON-RPC 2.0 on stdin/stdout or a Unix socket. Methods: "
+        "ping, fileChanged {paths}, rescan, regenerate {formats?, check?}, relationships {type}, "
+        "query {relation, type, kinds?, transitive?}, shutdown.",
+    )
+    add_source_arguments(ap)
+    add_model_arguments(ap)
+    ap.add_argument("--socket", default=None, help="Listen on this Unix socket path instead of stdin/stdout")
+    args = ap.parse_args(argv)
+
+    sources = source_set_from_args(args)
+    model, _, graph_path = model_from_args(args, sources)
+    model.load(sources.discover())
+    server = AnalysisServer(model, sources, Path(args.output), args.format, graph_path)
+    # stdout carries the protocol in stdio mode, so status goes to stderr
+    where = args.socket or "stdin/stdout"
+    print(f"Serving {len(model.rows)} types from {len(model.files)} files on {where}", file=sys.stderr, flush=True)
+    try:
+        if args.socket:
+            serve_unix_socket(server, Path(args.socket))
+        else:
+            serve_stdio(server, sys.stdin, sys.stdout)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def report_written(written: Sequence[Tuple[str, Path, int, bool]]) -> None:
+    for fmt, path, count, changed in written:
+        if not changed:
+            print(f"Unchanged: {path}")
+        elif fmt == "csv":
+            print(f"Wrote {count} rows to: {path}")
+        elif fmt == "usage":
+            print(f"Wrote {count} script usages to: {path}")
+        elif fmt == "assemblies":
+            print(f"Wrote {count} assemblies to: {path}")
+        elif fmt == "configs":
+            print(f"Wrote {count} configuration entries to: {path}")
+        else:
+            print(f"Wrote {count} types ({fmt}) to: {path}")
+
+
+def stream_main(args: argparse.Namespace, cs_files: Sequence[Path], output_path: Path, profiler: Profiler) -> int:
+    """--stream: analyze into spill runs in a hidden temporary folder, then write every format from them."""
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    mmap_threshold = args.mmap_threshold if args.mmap_threshold >= 0 else None
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # next to the output rather than in the system temp folder, which is often RAM-backed
+    with tempfile.TemporaryDirectory(prefix=f".{output_path.stem}.spill.", dir=output_path.parent) as tmp:
+        spill = DeclSpill(Path(tmp))
+        stream_decls(cs_files, spill, jobs, profiler, mmap_threshold, args.scan_bodies)
+        with profiler.phase("output"):
+            written = write_outputs(spilled_rows(spill, args.internal_only), output_path, args.format)
+        runs = len(spill.runs)
+    report_written(written)
+    print(f"Analyzed {len(cs_files)} files through {runs} spill run(s)")
+    if args.profile:
+        for line in profiler.report(args.profile_top, workers=jobs if len(cs_files) > 1 else 1):
+            print(line)
+    return 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv[:1] == ["query"]:
+        return query_main(argv[1:])
+    if argv[:1] == ["serve"]:
+        return serve_main(argv[1:])
+
+    ap = argparse.ArgumentParser(
+        description="Generate UML ClassRelationship.csv from C# scripts",
+        epilog="Run '%(prog)s query -h' to query the relationship graph cached by the last run, or "
+        "'%(prog)s serve -h' to keep the model resident behind a JSON-RPC server.",
+    )
+    add_source_arguments(ap)
+    add_model_arguments(ap)
+    ap.add_argument(
+        "--check",
+        action="store_true",
+        help="Do not write anything: compare the model with the existing outputs, print the relationship "
+        "changes and exit with status 1 if any output is out of date.",
+    )
+    ap.add_argument(
+        "--usage",
+        action="store_true",
+        help=(
+            "Also write <output>.usage.csv: which scenes, prefabs and assets use each analyzed script, "
+            "matched through the GUIDs in the .cs.meta files (not refreshed by --watch)."
+        ),
+    )
+    ap.add_argument(
+        "--assets",
+        action="append",
+        default=[],
+        metavar="DIR",
+        help="Folder scanned for .unity/.prefab/.asset files by --usage (repeatable; default: the Assets folder of each --source)",
+    )
+    ap.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "Bounded-memory mode for very large trees: spill per-file results to sorted runs in a hidden "
+            "folder next to the output and write the outputs from a k-way merge by type name. Skips the "
+            "analysis cache and the query graph; cannot be combined with --watch, --check, --usage, "
+            "--assemblies, --compact or --defines."
+        ),
+    )
+    ap.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Print type-expression cache statistics after the run.",
+    )
+    ap.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and regenerate the outputs whenever .cs files under --source change.",
+    )
+    ap.add_argument(
+        "--debounce",
+        type=float,
+        default=0.3,
+        help="Seconds of quiet to wait after a change before regenerating in --watch mode (default: 0.3)",
+    )
+    ap.add_argument(
+        "--poll",
+        action="store_true",
+        help="In --watch mode, poll file timestamps instead of using inotify.",
+    )
+    ap.add_argument(
+        "--profile",
+        action="store_true",
+        help="Report wall time and call counts per phase, peak memory and the slowest files.",
+    )
+    ap.add_argument(
+        "--profile-top",
+        type=int,
+        default=10,
+        metavar="N",
+        help="Number of slowest files listed by --profile (default: 10)",
+    )
+    args = ap.parse_args(argv)
+    if args.check and args.watch:
+        ap.error("--check and --watch cannot be combined")
+    if args.stream:
+        conflicts = [
+            f"--{o}" for o in ("watch", "check", "usage", "assemblies", "compact", "defines") if getattr(args, o)
+        ]
+        if conflicts:
+            ap.error(f"--stream cannot be combined with {', '.join(conflicts)}")
+
+    sources = source_set_from_args(args)
+    output_path = Path(args.output)
+
+    profiler = Profiler() if args.profile else NULL_PROFILER
+
+    with profiler.phase("discovery"):
+        cs_files = sources.discover()
+    if not cs_files and not args.watch:
+        raise SystemExit(f"No .cs files found under: {', '.join(str(r) for r in sources.roots)}")
+
+    if args.stream:
+        return stream_main(args, cs_files, output_path, profiler)
+
+    model, cache_path, graph_path = model_from_args(args, sources, profiler)
+    cache = model.cache
+    jobs = model.jobs
+    model.load(cs_files)
+
+    usage = None
+    if args.usage:
+        with profiler.phase("usage scan"):
+            usage = collect_script_usage(model, asset_set_from_args(args, sources))
+
+    if args.check:
+        with profiler.phase("output"):
+            return check_outputs(model, output_path, args.format, usage, [name for name, _ in args.defines])
 
-    with output_path.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(header)
-        writer.writerows(rows)
+    with profiler.phase("output"):
+        written = write_outputs(model.row_source(), output_path, args.format)
+        if usage is not None:
+            path = usage_output_path(output_path)
+            count, changed = write_if_changed(path, lambda f: write_usage(usage, f))
+            written.append(("usage", path, count, changed))
+        if model.assemblies is not None:
+            path = assemblies_output_path(output_path)
+            assemblies = model.assemblies
+            count, changed = write_if_changed(path, lambda f: write_assembly_dot(model, assemblies, f))
+            written.append(("assemblies", path, count, changed))
+        if args.defines:
+            path = configurations_output_path(output_path)
+            edges = configuration_edges(model, [name for name, _ in args.defines])
+            count, changed = write_if_changed(path, lambda f: write_configurations(edges, f))
+            written.append(("configs", path, count, changed))
+        if graph_path is not None:
+            model.save_graph(sources, graph_path)
+    report_written(written)
+    if cache_path is not None:
+        where = f"cache: {cache_path}"
+        if isinstance(cache, PartitionedCache):
+            where = f"{len(cache.partitions)} per-assembly caches: {partition_cache_path(cache_path, '*')}"
+        print(f"Analyzed {cache.misses} of {len(cs_files)} files ({cache.hits} unchanged, from {where})")
+    if args.verbose:
+        scope = " (main process only; workers keep their own caches)" if jobs > 1 and cache.misses > 1 else ""
+        print(f"Type-expression caches{scope}:")
+        for line in type_expr_cache_report():
+            print(f"  {line}")
+    if args.profile:
+        for line in profiler.report(args.profile_top, workers=jobs if cache.misses > 1 else 1):
+            print(line)
 
-    print(f"Wrote {len(rows)} rows to: {output_path}")
+    if args.watch:
+        return watch(model, sources, output_path, args.format, args.debounce, args.poll, graph_path)
     return 0
 
 
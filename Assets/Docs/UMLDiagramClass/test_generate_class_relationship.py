@@ -0,0 +1,896 @@
+"""Regression tests for generate_class_relationship.py: run with `python -m pytest` from this folder."""
+
+import csv
+import io
+import json
+import os
+import queue
+import re
+import signal
+import stat
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import bench_class_relationship as bench  # noqa: E402
+import generate_class_relationship as gcr  # noqa: E402
+
+
+def analyze(source: str, tmp_path: Path, mapped: bool = False, scan_bodies: bool = False) -> dict:
+    """TypeDecls of one C# source by qualified name, through the str scanner or the mmap one."""
+    path = tmp_path / "Test.cs"
+    path.write_text(source, encoding="utf-8")
+    data = None if mapped else path.read_bytes()
+    decls = gcr.analyze_path(path, data, mmap_threshold=0 if mapped else None, scan_bodies=scan_bodies)[0]
+    return {d.qualified_name: d for d in decls}
+
+
+# Alternative signatures chosen by #if/#else, from VFolders.cs and DOTweenModuleUtils.cs
+IF_ELSE_SIGNATURES = """
+class FolderStateChangeDetector : AssetPostprocessor
+{
+#if UNITY_2021_2_OR_NEWER
+    static void OnPostprocessAllAssets(string[] importedAssets, string[] deletedAssets, string[] movedAssets, string[] movedFromAssetPaths, bool didDomainReload)
+#else
+    static void OnPostprocessAllAssets(string[] importedAssets, string[] deletedAssets, string[] movedAssets, string[] movedFromAssetPaths)
+#endif
+    {
+        foreach (var path in importedAssets) { }
+    }
+}
+
+static class DOTweenModuleUtils
+{
+#if UNITY_EDITOR
+    // Fires OnApplicationPause in DOTweenComponent even when Editor is paused
+#if UNITY_4_3 || UNITY_4_4 || UNITY_4_5 || UNITY_4_6 || UNITY_5 || UNITY_2017_1
+    static void PlaymodeStateChanged()
+    #else
+    static void PlaymodeStateChanged(UnityEditor.PlayModeStateChange state)
+#endif
+    {
+        if (DOTween.instance == null) return;
+    }
+#endif
+}
+"""
+
+
+@pytest.mark.parametrize("mapped", [False, True])
+def test_if_else_signatures_are_not_joined(tmp_path, mapped):
+    decls = analyze(IF_ELSE_SIGNATURES, tmp_path, mapped)
+    assert decls["FolderStateChangeDetector"].dependency == set()
+    assert decls["DOTweenModuleUtils"].dependency == {"UnityEditor.PlayModeStateChange"}
+
+
+def test_member_started_in_if_branch_is_dropped_at_else(tmp_path):
+    decls = analyze(
+        """
+class A
+{
+#if X
+    Foo first;
+    Bar Get(Baz b)
+#else
+    Qux Get(Quux q)
+#endif
+    { return null; }
+}
+""",
+        tmp_path,
+    )
+    assert decls["A"].association == {"Foo"}
+    assert decls["A"].dependency == {"Qux", "Quux"}
+
+
+def test_only_where_clauses_are_constraints():
+    head = gcr.parse_member_head("T Get<T>(Foo f) where T : Base, IBar<T>, new() where U : class", "A")
+    assert head is not None
+    assert head.constraint_types == ["Base", "IBar<T>", "class"]
+    head = gcr.parse_member_head("void Run(Foo f) Run(Foo f, Bar b)", "A")
+    assert head is not None
+    assert head.constraint_types == []
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        'var s = "class Fake { }"; // class Fake2 { }',
+        "/* class Fake {\n } */ int x;",
+        "char c = '{'; char q = '\\'';",
+        'var v = @"a ""{"" b";',
+        'var i = $"{a + $"{b}"} }}";',
+        'var r = """\n  "class" { """;',
+    ],
+)
+def test_strip_blanks_literals_and_comments_in_place(code):
+    cleaned = gcr.strip_comments_and_strings(code)
+    assert len(cleaned) == len(code)
+    assert [i for i, c in enumerate(cleaned) if c == "\n"] == [i for i, c in enumerate(code) if c == "\n"]
+    assert "class" not in cleaned and "{" not in cleaned and "}" not in cleaned
+
+
+def test_strip_keeps_code_between_literals():
+    code = 'Foo("a", \'b\') /* c */ + Bar; // d'
+    assert gcr.strip_comments_and_strings(code).split() == ["Foo(", ",", ")", "+", "Bar;"]
+
+
+@pytest.mark.parametrize(
+    "head, kind, type_expr, params",
+    [
+        ("public Dictionary<string, List<Foo>> map", "member", "Dictionary<string, List<Foo>>", []),
+        ("private Foo? maybe", "member", "Foo?", []),
+        ("int?[] counts", "member", "int?[]", []),
+        ("public (Foo a, Bar? b) Pair", "member", "(Foo, Bar?)", []),
+        (
+            "protected virtual Task<Foo?> LoadAsync(CancellationToken token, Bar? bar = null)",
+            "method",
+            "Task<Foo?>",
+            ["CancellationToken", "Bar?"],
+        ),
+        ("Foo this[Bar key]", "member", "Foo", ["Bar"]),
+        ("public A(Foo foo)", "constructor", "", ["Foo"]),
+    ],
+)
+def test_member_heads(head, kind, type_expr, params):
+    parsed = gcr.parse_member_head(head, "A")
+    assert parsed is not None
+    assert (parsed.kind, parsed.type_expr, parsed.param_types) == (kind, type_expr, params)
+
+
+def test_generic_and_nullable_members(tmp_path):
+    decls = analyze(
+        """
+class A
+{
+    List<Foo> foos = new List<Foo>();
+    Bar? bar;
+    Baz baz = new Baz();
+    Dictionary<string, Qux> table;
+    T Get<T>(Quux q) where T : Corge { return default; }
+}
+""",
+        tmp_path,
+    )
+    a = decls["A"]
+    assert a.aggregation == {"Foo", "Qux"}
+    assert a.association == {"Bar"}
+    assert a.composition == {"Baz"}
+    assert a.dependency == {"Quux", "Corge"}
+
+
+TWO_TYPES = {
+    "Player.cs": "class Player { void Start() { var w = new Weapon(); Score.Instance.Add(1); } }",
+    "Weapon.cs": "class Weapon { }",
+    "Score.cs": "class Score { public static Score Instance; public void Add(int n) { } }",
+}
+
+
+def run_main(tmp_path: Path, name: str, *args: str) -> str:
+    output = tmp_path / "out" / f"{name}.csv"
+    assert gcr.main(["--source", str(tmp_path / "src"), "--output", str(output), *args]) == 0
+    return output.read_text(encoding="utf-8")
+
+
+def test_scan_bodies_reports_body_dependencies(tmp_path):
+    (tmp_path / "src").mkdir()
+    for name, text in TWO_TYPES.items():
+        (tmp_path / "src" / name).write_text(text, encoding="utf-8")
+    output = run_main(tmp_path, "scan", "--scan-bodies", "--no-cache")
+    rows = {line.split(",")[1]: line for line in output.splitlines()}
+    assert "Score; Weapon" in rows["Player"]
+
+
+def test_plain_run_after_scan_bodies_with_the_same_cache(tmp_path):
+    (tmp_path / "src").mkdir()
+    for name, text in TWO_TYPES.items():
+        (tmp_path / "src" / name).write_text(text, encoding="utf-8")
+    cache = str(tmp_path / ".shared.cache.json")
+    fresh = run_main(tmp_path, "fresh", "--no-cache")
+    run_main(tmp_path, "scan", "--scan-bodies", "--cache", cache)
+    assert run_main(tmp_path, "plain", "--cache", cache) == fresh
+    # and the bodies are still there for the next --scan-bodies run
+    assert run_main(tmp_path, "scan2", "--scan-bodies", "--cache", cache) == run_main(
+        tmp_path, "scan3", "--scan-bodies", "--no-cache"
+    )
+
+
+def test_outputs_get_default_or_previous_permissions(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "A.cs").write_text("class A { B b; }", encoding="utf-8")
+    old_mask = os.umask(0o022)
+    gcr._umask.cache_clear()
+    try:
+        run_main(tmp_path, "out", "--format", "csv,dot")
+        out = tmp_path / "out"
+        for path in (out / "out.csv", out / "out.dot", out / ".out.cache.json"):
+            assert stat.S_IMODE(path.stat().st_mode) == 0o644, path
+        os.chmod(out / "out.csv", 0o664)
+        (tmp_path / "src" / "A.cs").write_text("class A { C c; }", encoding="utf-8")
+        run_main(tmp_path, "out")
+        assert stat.S_IMODE((out / "out.csv").stat().st_mode) == 0o664
+    finally:
+        os.umask(old_mask)
+        gcr._umask.cache_clear()
+
+
+def test_streamed_graph_matches_relationship_graph(tmp_path):
+    source = """
+namespace Game
+{
+    interface IDamageable { }
+    class Unit : MonoBehaviour, IDamageable { List<Weapon> weapons; Score score; }
+    class Weapon { public Unit Owner { get; set; } }
+    class Score { }
+}
+"""
+    rows = gcr.finalize(analyze(source, tmp_path).values())
+    path = tmp_path / ".graph.json"
+    gcr.save_graph(path, lambda: iter(rows), "sig")
+    expected = gcr.RelationshipGraph.from_rows(rows).to_json()
+    assert expected["edges"]["realization"] and expected["edges"]["aggregation"]
+    loaded = gcr.load_graph(path, "sig")
+    assert loaded is not None and loaded.to_json() == expected
+    assert list(loaded.kinds) == list(expected["kinds"])
+    assert gcr.load_graph(path, "other") is None
+
+
+def test_query_unresolved_name_does_not_hide_declared_type(tmp_path, capsys):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "Player.cs").write_text(
+        "namespace Game\n{\n    class Weapon { }\n    class Player { Weapon weapon; }\n}\n", encoding="utf-8"
+    )
+    (tmp_path / "src" / "Enemy.cs").write_text("class Enemy { Weapon weapon; }", encoding="utf-8")
+    run_main(tmp_path, "out")
+    capsys.readouterr()
+    assert gcr.main(["query", "used-by", "Weapon", "--source", str(tmp_path / "src"),
+                     "--output", str(tmp_path / "out" / "out.csv")]) == 0
+    used_by = {line.split("\t")[1] for line in capsys.readouterr().out.splitlines()}
+    assert used_by == {"Enemy", "Game.Player"}
+
+
+def test_bench_corpus_only_replaces_a_generated_folder(tmp_path):
+    project = tmp_path / "Assets"
+    project.mkdir()
+    (project / "Player.cs").write_text("class Player { }", encoding="utf-8")
+    with pytest.raises(SystemExit):
+        bench.prepare_corpus_folder(project)
+    assert (project / "Player.cs").exists()
+
+    corpus = tmp_path / "corpus"
+    bench.generate_corpus(corpus, bench.CorpusSpec(files=3))
+    (corpus / "stale.cs").write_text("class Stale { }", encoding="utf-8")
+    bench.prepare_corpus_folder(corpus)
+    assert not corpus.exists()
+    bench.prepare_corpus_folder(tmp_path / "missing")
+
+
+@pytest.mark.parametrize(
+    "condition, defined, expected",
+    [
+        ("A", {"A"}, True),
+        ("A", set(), False),
+        ("!A", set(), True),
+        ("!!A", {"A"}, True),
+        ("A || B && C", {"A"}, True),
+        ("A || B && C", {"B"}, False),
+        ("A || B && C", {"B", "C"}, True),
+        ("(A || B) && C", {"A"}, False),
+        ("!(A || B)", {"B"}, False),
+        ("!A && B", {"B"}, True),
+        ("A == B", set(), True),
+        ("A != B", {"A"}, True),
+        ("A == true", {"A"}, True),
+        ("true && !false", set(), True),
+        ("  UNITY_EDITOR&&!UNITY_WEBGL ", {"UNITY_EDITOR"}, True),
+        ("A &&", {"A"}, False),
+        ("(A", {"A"}, False),
+        ("A B", {"A", "B"}, False),
+        ("A + B", {"A", "B"}, False),
+        ("", {"A"}, False),
+    ],
+)
+def test_pp_condition(condition, defined, expected):
+    assert gcr.parse_pp_condition(condition)(defined) is expected
+
+
+PP_NESTED = """class A
+{
+#if EDITOR
+    int editor;
+#if DEBUG
+    int editorDebug;
+#elif TRACE
+    int editorTrace;
+#else
+    int editorRelease;
+#endif
+#elif SERVER
+    int server;
+#else
+    int player;
+#endif
+#define LOCAL
+#if LOCAL
+    int local;
+#endif
+}
+"""
+
+
+def surviving_fields(code: str, defines: set) -> List[str]:
+    spans = gcr.inactive_spans(gcr.scan_directives(code), frozenset(defines), len(code))
+    return re.findall(r"int (\w+);", gcr.blank_spans(code, spans))
+
+
+@pytest.mark.parametrize(
+    "defines, fields",
+    [
+        (set(), ["player", "local"]),
+        ({"EDITOR"}, ["editor", "editorRelease", "local"]),
+        ({"EDITOR", "DEBUG", "TRACE"}, ["editor", "editorDebug", "local"]),
+        ({"EDITOR", "TRACE"}, ["editor", "editorTrace", "local"]),
+        ({"SERVER", "TRACE"}, ["server", "local"]),
+        ({"EDITOR", "SERVER"}, ["editor", "editorRelease", "local"]),
+    ],
+)
+def test_inactive_spans_follow_nested_branches(defines, fields):
+    assert surviving_fields(PP_NESTED, defines) == fields
+
+
+def test_inactive_spans_keep_offsets_and_ignore_defines_in_dead_code():
+    code = "#if NEVER\n#define LATE\n#endif\n#if LATE\nint late;\n#endif\n#endif\nint after;\n"
+    spans = gcr.inactive_spans(gcr.scan_directives(code), frozenset(), len(code))
+    assert len(gcr.blank_spans(code, spans)) == len(code)
+    # the #define is in dead code, and the stray #endif is tolerated
+    assert surviving_fields(code, set()) == ["after"]
+    # an unterminated #if runs to the end of the file
+    assert surviving_fields("#if A\nint a;\n", set()) == []
+
+
+def test_preprocessor_variants_share_identical_configurations():
+    configs = [frozenset(), frozenset({"DEBUG"}), frozenset({"EDITOR"}), frozenset({"EDITOR", "SERVER"})]
+    variants = gcr.preprocessor_variants(PP_NESTED, configs)
+    # DEBUG alone compiles what no defines do, and SERVER is never reached inside EDITOR
+    assert sorted(mask for mask, _ in variants) == [0b0011, 0b1100]
+    assert gcr.preprocessor_variants("class A { }", configs) == [(0, ())]
+    assert gcr.preprocessor_variants(PP_NESTED, []) == [(0, ())]
+
+
+@pytest.mark.parametrize(
+    "pattern, path, matched",
+    [
+        ("*.cs", "Player.cs", True),
+        ("*.cs", "Scripts/Player.cs", False),
+        ("**/*.cs", "Player.cs", True),
+        ("**/*.cs", "Scripts/AI/Player.cs", True),
+        ("Scripts/**", "Scripts/AI/Player.cs", True),
+        ("Scripts/**", "Editor/Player.cs", False),
+        ("a/**/b", "a/b", True),
+        ("a/**/b", "a/x/y/b", True),
+        ("a/**/b", "a/xb", False),
+        ("?.cs", "A.cs", True),
+        ("?.cs", "AB.cs", False),
+        ("?.cs", "/.cs", False),
+        ("[!a]*", "b", True),
+        ("[!a]*", "a", False),
+        ("[ab].cs", "b.cs", True),
+        ("\\*.cs", "*.cs", True),
+        ("\\*.cs", "A.cs", False),
+        ("Foo+(1).cs", "Foo+(1).cs", True),
+    ],
+)
+def test_compile_glob(pattern, path, matched):
+    assert bool(gcr.compile_glob(pattern).fullmatch(path)) is matched
+
+
+def make_tree(root: Path, files: List[str]) -> None:
+    for name in files:
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_text("class A { }\n" if name.endswith(".cs") else "", encoding="utf-8")
+
+
+def discovered(sources: "gcr.SourceSet", root: Path) -> List[str]:
+    found = sources.discover()
+    for path in root.rglob("*.cs"):
+        assert sources.accepts(path) is (path in found), path
+    return [p.relative_to(root).as_posix() for p in found]
+
+
+def test_default_excludes_are_anchored_to_the_root(tmp_path):
+    make_tree(
+        tmp_path,
+        [
+            "Library/PackageCache/A.cs",
+            "Temp/B.cs",
+            "obj/C.cs",
+            ".git/D.cs",
+            "Packages/Samples~/E.cs",
+            "Assets/Scripts/Logs/Logger.cs",
+            "Assets/Scripts/obj/Obj.cs",
+            "Assets/Library/Lib.cs",
+            "Assets/Scripts/.hidden/F.cs",
+        ],
+    )
+    assert discovered(gcr.SourceSet([tmp_path]), tmp_path) == [
+        "Assets/Library/Lib.cs",
+        "Assets/Scripts/Logs/Logger.cs",
+        "Assets/Scripts/obj/Obj.cs",
+    ]
+    assert "Temp/B.cs" in discovered(gcr.SourceSet([tmp_path], exclude=()), tmp_path)
+
+
+def test_gitignore_rules(tmp_path):
+    make_tree(
+        tmp_path,
+        [
+            "A.gen.cs",
+            "Keep.gen.cs",
+            "Build/X.cs",
+            "Sub/Build/Y.cs",
+            "Sub/Generated/Z.cs",
+            "Sub/Generated.cs",
+            "docs/W.cs",
+            "docs/a/b/W.cs",
+            "Assets/Local.cs",
+            "Assets/x/Local.cs",
+            "Assets/Top.cs",
+            "Assets/x/Top.cs",
+        ],
+    )
+    (tmp_path / ".gitignore").write_text(
+        "# generated code\n*.gen.cs\n!Keep.gen.cs\n/Build/\nGenerated/\ndocs/**/*.cs\n", encoding="utf-8"
+    )
+    (tmp_path / "Assets" / ".gitignore").write_text("Local.cs\n/Top.cs\n", encoding="utf-8")
+    assert discovered(gcr.SourceSet([tmp_path]), tmp_path) == [
+        "Assets/x/Top.cs",
+        "Keep.gen.cs",
+        "Sub/Build/Y.cs",
+        "Sub/Generated.cs",
+    ]
+    assert len(discovered(gcr.SourceSet([tmp_path], use_gitignore=False), tmp_path)) == 12
+
+
+def components(successors: dict) -> List[List[str]]:
+    return [sorted(c) for c in gcr.strongly_connected_components(sorted(successors), successors)]
+
+
+def test_scc_self_loop_and_two_cycle():
+    assert components({"A": {"A"}}) == [["A"]]
+    assert components({"A": {"B"}, "B": {"A"}, "C": {"A"}}) == [["A", "B"], ["C"]]
+
+
+def test_scc_disjoint_cycles_in_reverse_topological_order():
+    successors = {
+        "A": {"B"},
+        "B": {"C"},
+        "C": {"A", "D"},
+        "D": {"E"},
+        "E": {"D"},
+        "F": {"G"},
+        "G": {"F"},
+        "H": set(),
+    }
+    found = components(successors)
+    assert sorted(found) == [["A", "B", "C"], ["D", "E"], ["F", "G"], ["H"]]
+    # every component comes after the components it reaches
+    assert found.index(["D", "E"]) < found.index(["A", "B", "C"])
+
+
+def test_scc_deep_chain_does_not_recurse():
+    depth = sys.getrecursionlimit() * 3
+    names = [f"T{i:05d}" for i in range(depth)]
+    successors = {a: {b} for a, b in zip(names, names[1:])}
+    successors[names[-1]] = {names[0]}  # one cycle through the whole chain
+    assert components(successors) == [names]
+    successors[names[-1]] = set()
+    assert len(components(successors)) == depth
+
+
+def test_graph_metrics_cycles_and_layers():
+    graph = gcr.RelationshipGraph()
+    graph.kinds = dict.fromkeys(["A", "B", "C", "D"], "class")
+    graph.edges["association"] = {"A": {"B"}, "B": {"A", "C", "List<C>"}, "C": {"C", "Vector3"}, "D": {"A"}}
+    metrics = {m.name: m for m in gcr.graph_metrics(graph)}
+    assert (metrics["A"].cycle, metrics["A"].cycle_size) == ("A", 2)
+    assert (metrics["B"].cycle, metrics["B"].cycle_size) == ("A", 2)
+    # a self-reference is not a cycle, and external types do not count
+    assert (metrics["C"].cycle, metrics["C"].fan_out, metrics["C"].fan_in) == ("", 0, 1)
+    assert [metrics[n].layer for n in "ABCD"] == [1, 1, 0, 2]
+    assert metrics["D"].instability == 1.0 and metrics["C"].instability == 0.0
+
+
+def test_decl_spill_merges_runs_like_the_in_memory_path(tmp_path):
+    per_file = []
+    for i in range(7):
+        path = tmp_path / f"File{i}.cs"
+        path.write_text(
+            f"public partial class Shared : IShared{6 - i} {{ Part{i} part; }}\n"
+            f"class Part{i} {{ class Inner {{ Shared owner; }} }}\n"
+            f"class Z{6 - i} : Part{i} {{ }}\n",
+            encoding="utf-8",
+        )
+        per_file.append(gcr.analyze_path(path)[0])
+    spill_dir = tmp_path / "spill"
+    spill_dir.mkdir()
+    spill = gcr.DeclSpill(spill_dir, run_size=2, fanin=2)
+    for decls in per_file:
+        spill.add(decls)
+
+    groups = list(spill.groups())
+    assert spill._files > len(spill.runs) > 1  # runs were written and some merged, but not all
+    assert [name for name, _ in groups] == sorted({d.qualified_name for decls in per_file for d in decls})
+    shared = dict(groups)["Shared"]
+    # duplicates (partial declarations) come back in the order the files were added
+    assert [d.interfaces or [d.base_class] for d in shared] == [[f"IShared{6 - i}"] for i in range(7)]
+    assert list(spill.groups()) == groups  # iterable again
+
+    expected = gcr.finalize(d for decls in per_file for d in decls)
+    assert list(gcr.spilled_rows(spill)()) == expected
+    assert sorted(os.listdir(spill_dir)) == sorted(p.name for p in spill.runs)
+
+
+def test_check_exit_status_and_deltas(tmp_path, capsys):
+    (tmp_path / "src").mkdir()
+    for name, text in TWO_TYPES.items():
+        (tmp_path / "src" / name).write_text(text, encoding="utf-8")
+    output = tmp_path / "out" / "out.csv"
+    check = ["--source", str(tmp_path / "src"), "--output", str(output), "--format", "csv,dot", "--check"]
+    assert gcr.main(check) == 1
+    assert "(missing)" in capsys.readouterr().out
+    assert not output.exists()
+
+    written = run_main(tmp_path, "out", "--format", "csv,dot")
+    capsys.readouterr()
+    assert gcr.main(check) == 0
+    assert capsys.readouterr().out.count("Up to date") == 2
+
+    (tmp_path / "src" / "Player.cs").write_text("class Player { Weapon weapon; Enemy target; }", encoding="utf-8")
+    (tmp_path / "src" / "Score.cs").unlink()
+    assert gcr.main(check) == 1
+    out = capsys.readouterr().out
+    assert f"Out of date: {output} (2 change(s))" in out
+    assert "~ Player: Assocation: +Enemy +Weapon" in out and "- Score" in out
+    assert f"Out of date: {output.with_suffix('.dot')}" in out
+    assert output.read_text(encoding="utf-8") == written  # --check never writes
+
+
+def test_serve_stdio_round_trip(tmp_path):
+    (tmp_path / "src").mkdir()
+    for name, text in TWO_TYPES.items():
+        (tmp_path / "src" / name).write_text(text, encoding="utf-8")
+    output = tmp_path / "out" / "out.csv"
+    server = subprocess.Popen(
+        [sys.executable, gcr.__file__, "serve", "--source", str(tmp_path / "src"), "--output", str(output)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    next_id = iter(range(1, 100))
+
+    def call(method: str, params=None) -> dict:
+        request = {"jsonrpc": "2.0", "id": next(next_id), "method": method}
+        if params is not None:
+            request["params"] = params
+        server.stdin.write(json.dumps(request) + "\n")
+        server.stdin.flush()
+        response = json.loads(server.stdout.readline())
+        assert response["id"] == request["id"]
+        return response
+
+    try:
+        assert call("ping")["result"] == "pong"
+        assert call("query", {"relation": "uses", "type": "Player"})["result"] == []
+        assert call("fileChanged", {"paths": str(tmp_path / "src" / "Player.cs")})["error"]["code"] == -32602
+        assert call("query", {"relation": "uses", "type": "Player", "kinds": "association"})["error"]["code"] == -32602
+        (tmp_path / "src" / "Player.cs").write_text("class Player { Weapon weapon; }", encoding="utf-8")
+        assert call("fileChanged", {"paths": [str(tmp_path / "src" / "Player.cs")]})["result"] == {"affected": ["Player"]}
+        assert call("query", {"relation": "used-by", "type": "Weapon"})["result"] == [
+            {"kind": "association", "type": "Player"}
+        ]
+        assert call("nope")["error"]["code"] == -32601
+        [written] = call("regenerate")["result"]
+        assert written["changed"] and written["rows"] == 3 and output.exists()
+        assert call("shutdown")["result"] is None
+        assert server.wait(timeout=10) == 0
+    finally:
+        server.kill()
+
+
+def write_sources(root: Path, sources: dict) -> List[Path]:
+    for name, text in sources.items():
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_text(text, encoding="utf-8")
+    return sorted(root / name for name in sources)
+
+
+def cache_run(path: Path, files: List[Path], jobs: int = 1) -> Tuple["gcr.AnalysisCache", list]:
+    cache = gcr.AnalysisCache(path)
+    return cache, gcr.load_decls(files, cache, jobs=jobs)
+
+
+def test_analysis_cache_hits_misses_and_fingerprint(tmp_path, monkeypatch):
+    files = write_sources(tmp_path / "src", TWO_TYPES)
+    path = tmp_path / ".cache.json"
+    first, decls = cache_run(path, files)
+    assert (first.hits, first.misses) == (0, 3)
+    warm, warm_decls = cache_run(path, files)
+    assert (warm.hits, warm.misses) == (3, 0) and warm_decls == decls
+
+    # a touched file with the same content is still a hit (by hash), and its new mtime is saved
+    player = files[0]
+    mtime_ns = player.stat().st_mtime_ns + 10**9
+    os.utime(player, ns=(mtime_ns, mtime_ns))
+    assert cache_run(path, files)[0].hits == 3
+    assert f'"mtime_ns":{mtime_ns},' in path.read_text(encoding="utf-8")
+
+    player.write_text("class Player { Weapon weapon; }", encoding="utf-8")
+    edited, edited_decls = cache_run(path, files)
+    assert (edited.hits, edited.misses) == (2, 1)
+    assert edited_decls[0][0].association == {"Weapon"}
+
+    # files no longer analyzed are dropped from the cache file
+    cache_run(path, files[1:])
+    assert str(player) not in path.read_text(encoding="utf-8")
+
+    monkeypatch.setattr(gcr, "_parser_fingerprint", lambda: "other rules")
+    changed = cache_run(path, files)[0]
+    assert (changed.hits, changed.misses) == (0, 3)
+
+
+def test_parallel_analysis_matches_serial_and_fills_the_cache(tmp_path, monkeypatch):
+    sources = {f"File{i}.cs": f"class T{i} : T{i + 1} {{ List<T{i + 2}> items; }}" for i in range(12)}
+    files = write_sources(tmp_path / "src", sources)
+    serial = gcr.load_decls(files, gcr.AnalysisCache(None), jobs=1)
+    cache, parallel = cache_run(tmp_path / ".cache.json", files, jobs=4)
+    assert parallel == serial and cache.misses == 12
+    # results computed in worker processes answer the next run from the cache
+    warm, warm_decls = cache_run(tmp_path / ".cache.json", files, jobs=4)
+    assert (warm.hits, warm.misses) == (12, 0) and warm_decls == serial
+    monkeypatch.setattr(gcr, "_parser_fingerprint", lambda: "other rules")
+    assert cache_run(tmp_path / ".cache.json", files, jobs=4)[0].misses == 12
+    assert run_main(tmp_path, "parallel", "--jobs", "4", "--no-cache") == run_main(tmp_path, "serial", "--no-cache")
+
+
+def line_reader(stream) -> Callable[[str], str]:
+    """Reads stream on a thread; the result waits (up to 20s) for the next line containing a needle."""
+    lines: "queue.Queue[str]" = queue.Queue()
+
+    def pump() -> None:
+        for line in stream:
+            lines.put(line)
+
+    threading.Thread(target=pump, daemon=True).start()
+
+    def until(needle: str) -> str:
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                line = lines.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise AssertionError(f"no {needle!r} line within 20s") from None
+            if needle in line:
+                return line
+
+    return until
+
+
+def test_watch_rebuilds_with_polling(tmp_path):
+    files = write_sources(tmp_path / "src", TWO_TYPES)
+    output = tmp_path / "out" / "out.csv"
+    watcher = subprocess.Popen(
+        [sys.executable, gcr.__file__, "--source", str(tmp_path / "src"), "--output", str(output),
+         "--watch", "--poll", "--debounce", "0.2"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        env=dict(os.environ, PYTHONUNBUFFERED="1"),
+    )
+    try:
+        until = line_reader(watcher.stdout)
+        until("Watching")
+        assert "Score" in output.read_text(encoding="utf-8")
+        files[0].write_text("class Player { Enemy target; }", encoding="utf-8")
+        (tmp_path / "src" / "Enemy.cs").write_text("class Enemy : Player { }", encoding="utf-8")
+        files[1].unlink()  # Score.cs
+        for _ in range(3):  # a poll may land between the edits above
+            until("type(s) updated")
+            rows = {line.split(",")[1]: line for line in output.read_text(encoding="utf-8").splitlines()[1:]}
+            if sorted(rows) == ["Enemy", "Player", "Weapon"]:
+                break
+        assert sorted(rows) == ["Enemy", "Player", "Weapon"]
+        assert rows["Enemy"].startswith("class,Enemy,Player,")
+        assert ",Enemy," in rows["Player"]
+        watcher.send_signal(signal.SIGINT)
+        assert watcher.wait(timeout=10) == 0
+    finally:
+        watcher.kill()
+        watcher.stdout.close()
+
+
+def test_graph_json_written_and_reused_by_query(tmp_path, capsys, monkeypatch):
+    write_sources(
+        tmp_path / "src",
+        {
+            "Unit.cs": "class Unit : MonoBehaviour, IDamageable { Weapon weapon; }",
+            "Hero.cs": "class Hero : Unit { }",
+            "Boss.cs": "class Boss : Hero { }",
+            "Weapon.cs": "class Weapon { }",
+            "IDamageable.cs": "interface IDamageable { }",
+        },
+    )
+    run_main(tmp_path, "out")
+    data = json.loads((tmp_path / "out" / ".out.graph.json").read_text(encoding="utf-8"))
+    assert data["graph"]["kinds"] == {
+        "Boss": "class", "Hero": "class", "IDamageable": "interface", "Unit": "class", "Weapon": "class"
+    }
+    assert data["graph"]["edges"]["generalization"] == {"Boss": ["Hero"], "Hero": ["Unit"], "Unit": ["MonoBehaviour"]}
+    assert data["graph"]["edges"]["realization"] == {"Unit": ["IDamageable"]}
+
+    query = ["query", "--source", str(tmp_path / "src"), "--output", str(tmp_path / "out" / "out.csv")]
+    capsys.readouterr()
+    with monkeypatch.context() as m:
+        # the graph is current, so answering must not analyze anything
+        m.setattr(gcr.ProjectModel, "load", lambda *a, **k: pytest.fail("graph was rebuilt"))
+        assert gcr.main(query + ["subclasses", "Unit", "--transitive"]) == 0
+        assert capsys.readouterr().out.splitlines() == ["1\tgeneralization\tHero", "2\tgeneralization\tBoss"]
+        assert gcr.main(query + ["implementers", "IDamageable"]) == 0
+        assert capsys.readouterr().out.splitlines() == ["realization\tUnit"]
+        assert gcr.main(query + ["uses", "Nope"]) == 1
+
+    # a changed source invalidates the signature: the query rebuilds and rewrites the graph
+    (tmp_path / "src" / "Boss.cs").write_text("class Boss : Unit { Weapon weapon; }", encoding="utf-8")
+    assert gcr.main(query + ["bases", "Boss"]) == 0
+    assert capsys.readouterr().out.splitlines() == ["generalization\tUnit"]
+    data = json.loads((tmp_path / "out" / ".out.graph.json").read_text(encoding="utf-8"))
+    assert data["graph"]["edges"]["generalization"]["Boss"] == ["Unit"]
+
+
+API_SOURCES = {
+    "Unit.cs": "namespace Game\n{\n    public partial class Unit : MonoBehaviour, IDamageable { Weapon weapon; }\n}\n",
+    "Unit.Stats.cs": "namespace Game\n{\n    partial class Unit { List<Stat> stats; }\n}\n",
+    "Weapon.cs": "namespace Game\n{\n    class Weapon { Unit owner; }\n    interface IDamageable { }\n}\n",
+}
+
+
+def test_iter_type_decls_is_lazy_and_reads_str_and_bytes():
+    def sources():
+        yield "Unit.cs", API_SOURCES["Unit.cs"].replace("\n", "\r\n")
+        yield "Weapon.cs", API_SOURCES["Weapon.cs"].encode("utf-8")
+        raise AssertionError("read past the decls that were asked for")
+
+    decls = gcr.iter_type_decls(sources())
+    unit = next(decls)
+    assert (unit.qualified_name, unit.base_class, unit.association) == ("Game.Unit", "MonoBehaviour", {"Weapon"})
+    assert [next(decls).qualified_name, next(decls).qualified_name] == ["Game.Weapon", "Game.IDamageable"]
+
+
+def test_finalize_matches_a_run_over_the_same_files(tmp_path):
+    rows = gcr.finalize(gcr.iter_type_decls(API_SOURCES.items()))
+    assert [row.name for row in rows] == ["Game.IDamageable", "Game.Unit", "Game.Weapon"]
+    unit = rows[1]
+    # partial declarations merged, references resolved through the namespace
+    assert (unit.generalization, unit.realization) == ("MonoBehaviour", ["Game.IDamageable"])
+    assert sorted(unit.association) == ["Game.Weapon"] and "Stat" in unit.aggregation
+    internal = {row.name: row for row in gcr.finalize(gcr.iter_type_decls(API_SOURCES.items()), internal_only=True)}
+    assert internal["Game.Unit"].aggregation == [] and internal["Game.Unit"].association == ["Game.Weapon"]
+
+    out = io.StringIO()
+    gcr.write_csv(lambda: rows, out)
+    write_sources(tmp_path / "src", API_SOURCES)
+    run_main(tmp_path, "out", "--no-cache")
+    assert out.getvalue().encode("utf-8") == (tmp_path / "out" / "out.csv").read_bytes()
+
+
+PLAYER_GUID = "0123456789abcdef0123456789abcdef"
+OTHER_GUID = "fedcba9876543210fedcba9876543210"
+
+
+def scene_yaml(refs: List[str]) -> str:
+    objects = [
+        f"--- !u!114 &{100 + i}\nMonoBehaviour:\n  m_Enabled: 1\n"
+        f"  m_Script: {{fileID: 11500000, guid: {guid}, type: 3}}\n  m_Name: {'x' * (i * 7 % 53)}\n"
+        for i, guid in enumerate(refs)
+    ]
+    return "%YAML 1.1\n%TAG !u! tag:unity3d.com,2011:\n" + "".join(objects)
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 64, 129, 1 << 20])
+def test_scan_script_refs_counts_matches_across_chunk_boundaries(tmp_path, monkeypatch, chunk):
+    refs = [PLAYER_GUID, OTHER_GUID, PLAYER_GUID] * 11
+    asset = tmp_path / "Main.unity"
+    asset.write_text(scene_yaml(refs), encoding="utf-8")
+    monkeypatch.setattr(gcr, "USAGE_SCAN_CHUNK", chunk)
+    assert gcr.scan_script_refs(asset) == {PLAYER_GUID.encode(): 22, OTHER_GUID.encode(): 11}
+
+
+def test_usage_output_counts_script_guids(tmp_path, monkeypatch):
+    assets = tmp_path / "Assets"
+    write_sources(assets / "Scripts", {"Player.cs": "namespace Game\n{\n    class Player : MonoBehaviour { }\n}\n"})
+    (assets / "Scripts" / "Player.cs.meta").write_text(f"fileFormatVersion: 2\nguid: {PLAYER_GUID}\n", encoding="utf-8")
+    (assets / "Scenes").mkdir()
+    (assets / "Scenes" / "Main.unity").write_text(scene_yaml([PLAYER_GUID, OTHER_GUID, PLAYER_GUID]), encoding="utf-8")
+    (assets / "Enemy.prefab").write_text(scene_yaml([PLAYER_GUID]), encoding="utf-8")
+    (assets / "Binary.asset").write_bytes(b"\x00\x01" + f"m_Script: {{fileID: 1, guid: {PLAYER_GUID}".encode())
+    monkeypatch.setattr(gcr, "USAGE_SCAN_CHUNK", 16)
+    output = tmp_path / "out" / "out.csv"
+    assert gcr.main(["--source", str(assets / "Scripts"), "--output", str(output), "--usage", "--no-cache"]) == 0
+    with output.with_suffix(".usage.csv").open(encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [
+        gcr.USAGE_HEADER,
+        ["Game.Player", (assets / "Scripts" / "Player.cs").as_posix(), (assets / "Enemy.prefab").as_posix(), "1"],
+        ["Game.Player", (assets / "Scripts" / "Player.cs").as_posix(), (assets / "Scenes" / "Main.unity").as_posix(), "2"],
+    ]
+
+
+CORE_GUID = "11111111111111111111111111111111"
+ASSEMBLY_TREE = {
+    "Scripts/Core/Game.Core.asmdef": '{"name": "Game.Core"}',
+    "Scripts/Core/Game.Core.asmdef.meta": f"fileFormatVersion: 2\nguid: {CORE_GUID}\n",
+    "Scripts/Core/Unit.cs": "class Unit { }",
+    "Scripts/Core/AI/Brain.cs": "class Brain { Unit unit; }",
+    "Scripts/UI/Game.UI.asmdef": f'{{"name": "Game.UI", "references": ["GUID:{CORE_GUID}", "Unity.TextMeshPro"]}}',
+    "Scripts/UI/Hud.cs": "class Hud { }",
+    "Scripts/Extensions/Core.asmref": f'{{"reference": "GUID:{CORE_GUID}"}}',
+    "Scripts/Extensions/UnitExtensions.cs": "static class UnitExtensions { }",
+    "Scripts/Broken/Broken.asmdef": "{ not json",
+    "Scripts/Broken/Loose.cs": "class Loose { }",
+    "Scripts/Editor/Tool.cs": "class Tool { }",
+    "Plugins/Lib.cs": "class Lib { }",
+    "Plugins/Editor/LibTool.cs": "class LibTool { }",
+}
+
+
+def test_assembly_map_assigns_asmdef_asmref_and_predefined_assemblies(tmp_path):
+    assets = tmp_path / "Assets"
+    write_sources(assets, ASSEMBLY_TREE)
+    assemblies = gcr.AssemblyMap.discover(gcr.SourceSet([assets], gcr.ASSEMBLY_DEF_INCLUDES))
+    assert sorted(assemblies.assemblies) == ["Game.Core", "Game.UI"]
+    assert assemblies.assemblies["Game.UI"].references == ["Game.Core", "Unity.TextMeshPro"]
+    assigned = {
+        name: assemblies.assembly_of(assets / name) for name in ASSEMBLY_TREE if name.endswith(".cs")
+    }
+    assert assigned == {
+        "Scripts/Core/Unit.cs": "Game.Core",
+        "Scripts/Core/AI/Brain.cs": "Game.Core",
+        "Scripts/UI/Hud.cs": "Game.UI",
+        "Scripts/Extensions/UnitExtensions.cs": "Game.Core",
+        "Scripts/Broken/Loose.cs": "Assembly-CSharp",
+        "Scripts/Editor/Tool.cs": "Assembly-CSharp-Editor",
+        "Plugins/Lib.cs": "Assembly-CSharp-firstpass",
+        "Plugins/Editor/LibTool.cs": "Assembly-CSharp-Editor-firstpass",
+    }
+
+
+def test_assemblies_partition_the_cache(tmp_path):
+    assets = tmp_path / "Assets"
+    write_sources(assets, ASSEMBLY_TREE)
+    output = tmp_path / "out" / "out.csv"
+    run = ["--source", str(assets / "Scripts"), "--output", str(output), "--assemblies"]
+    assert gcr.main(run) == 0
+    partitions = {p.name: p.stat().st_ino for p in output.parent.glob(".out.*.cache.json")}
+    assert sorted(partitions) == [
+        ".out.Assembly-CSharp-Editor.cache.json",
+        ".out.Assembly-CSharp.cache.json",
+        ".out.Game.Core.cache.json",
+        ".out.Game.UI.cache.json",
+    ]
+    assert "UnitExtensions.cs" in (output.parent / ".out.Game.Core.cache.json").read_text(encoding="utf-8")
+
+    # an edit only rewrites the cache partition of its own assembly
+    (assets / "Scripts" / "UI" / "Hud.cs").write_text("class Hud { Unit unit; Tool tool; }", encoding="utf-8")
+    assert gcr.main(run) == 0
+    rewritten = {name for name, ino in partitions.items() if (output.parent / name).stat().st_ino != ino}
+    assert rewritten == {".out.Game.UI.cache.json"}
+    dot = output.with_suffix(".assemblies.dot").read_text(encoding="utf-8")
+    assert '"Game.UI" -> "Game.Core" [label=1];' in dot
+    assert '"Game.UI" -> "Assembly-CSharp-Editor" [label=1];' in dot